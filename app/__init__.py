@@ -12,17 +12,43 @@ def setup_database(app):
             # Testa conexão básica antes de tudo
             db.session.execute(text('SELECT 1'))
             
-            # Cria as tabelas se não existirem
+            # Cria as tabelas se não existirem (todos os modelos importados antes: as chaves estrangeiras
+            # apontam para users/ticket/item mesmo quando create_app() é chamado sem importar nada, ex: update_db.py)
+            from app.models.user import User
+            from app.models.ticket import Ticket  # noqa: F401 (chamados, comentários, anexos, rollup)
+            from app.models.settings import Item  # noqa: F401 (configurações, inventário, eventos de estoque)
+            from app.models.job import Job  # noqa: F401 (tabela da fila de tarefas)
+            from app.models.stock import StockMovement  # noqa: F401 (razão de estoque)
+            from app.models.ad_search import AdSearch  # noqa: F401 (resultados de busca no AD)
             db.create_all()
             
             # Cria administrador padrão
-            from app.models.user import User
             if not User.query.first():
                 admin_user = User(username='admin', email='admin@local', role='admin', fullname='Administrador')
                 admin_user.set_password('admin')
                 db.session.add(admin_user)
                 db.session.commit()
                 app.logger.info("Admin padrão criado com sucesso.")
+
+            # Backfill do rollup de estatísticas em bancos que já tinham tickets
+            from app.models.ticket import TicketStatsRollup
+            if not TicketStatsRollup.query.first() and Ticket.query.first():
+                from app.services.stats import rebuild_ticket_rollup
+                rebuild_ticket_rollup()
+                app.logger.info("Rollup de estatísticas reconstruído.")
+
+            # Saldo inicial no razão de estoque para itens cadastrados antes dele
+            from app.services.stock import backfill_stock_ledger
+            if backfill_stock_ledger():
+                app.logger.info("Razão de estoque inicializado com os saldos atuais.")
+
+            # Índice de busca textual de tickets (FTS5 no SQLite, tsvector no Postgres)
+            from app.services.search import setup_search_index
+            setup_search_index()
+
+            # Índice de busca do inventário (FTS5 no SQLite, trigramas no Postgres)
+            from app.services.item_search import setup_item_search_index
+            setup_item_search_index()
         except Exception as e:
             app.logger.error(f"Erro crítico no banco de dados: {e}")
 
@@ -79,6 +105,7 @@ def create_app(config_class=Config):
     from .routes.users import users_bp
     from .routes.settings import settings_bp
     from .routes.inventory import inventory_bp
+    from .routes.jobs import jobs_bp
     
     app.register_blueprint(main_bp)
     app.register_blueprint(auth_bp)
@@ -86,6 +113,21 @@ def create_app(config_class=Config):
     app.register_blueprint(users_bp)
     app.register_blueprint(settings_bp)
     app.register_blueprint(inventory_bp)
+    app.register_blueprint(jobs_bp)
+
+    # Comandos CLI (flask stats-rebuild, flask stats-check, ...)
+    from .commands import register_commands
+    register_commands(app)
+
+    # Vigia de SLA em segundo plano (desligado por padrão; em serverless use `flask sla-watch` à parte)
+    if app.config.get('SLA_WATCHER_ENABLED'):
+        from .services.sla_watcher import start_sla_watcher
+        start_sla_watcher(app)
+
+    # Worker de tarefas dentro do servidor web (desligado por padrão; o normal é `flask worker` à parte)
+    if app.config.get('JOB_WORKER_ENABLED'):
+        from .services.jobs import start_job_worker
+        start_job_worker(app, threads=app.config.get('JOB_WORKER_THREADS', 2))
 
     return app
 
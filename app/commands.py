@@ -0,0 +1,356 @@
+import click
+
+
+def register_commands(app):
+    """Registra os comandos de linha de comando (flask <comando>)"""
+
+    @app.cli.command('stats-rebuild')
+    def stats_rebuild():
+        """Reconstrói a tabela ticket_stats_rollup a partir dos tickets existentes."""
+        from app.services.stats import rebuild_ticket_rollup
+        rows = rebuild_ticket_rollup()
+        click.echo(f'Rollup reconstruído: {rows} linha(s).')
+
+    @app.cli.command('stats-check')
+    @click.option('--fix', is_flag=True, help='Reconstrói o rollup se houver divergências.')
+    def stats_check(fix):
+        """Verifica se o ticket_stats_rollup está consistente com a tabela ticket."""
+        from app.services.stats import check_ticket_rollup, rebuild_ticket_rollup
+        mismatches = check_ticket_rollup()
+        if not mismatches:
+            click.echo('Rollup consistente.')
+            return
+
+        for key, expected, current in mismatches:
+            click.echo(f'{key}: esperado {expected}, atual {current}')
+        click.echo(f'{len(mismatches)} divergência(s) encontrada(s).')
+
+        if fix:
+            rows = rebuild_ticket_rollup()
+            click.echo(f'Rollup reconstruído: {rows} linha(s).')
+        else:
+            raise SystemExit(1)
+
+    @app.cli.command('stats-bench')
+    @click.option('--sizes', default='1000,10000,50000', show_default=True, help='Quantidades de chamados sintéticos.')
+    @click.option('--repeat', default=3, show_default=True, help='Execuções por medida (vale a melhor).')
+    def stats_bench(sizes, repeat):
+        """Compara os contadores do dashboard (um GROUP BY) com a contagem antiga em Python (tudo é desfeito no final)."""
+        import time
+        from types import SimpleNamespace
+        from app.extensions import db
+        from app.models.ticket import Ticket
+        from app.models.user import User
+        from app.services.query_plans import count_statements
+        from app.services.stats import get_dashboard_stats, CLOSED_STATUSES
+
+        def legacy_stats():
+            # Como main.index fazia antes: hidrata todos os chamados e conta em quatro passadas
+            tickets = Ticket.query.all()
+            return {'total': len(tickets),
+                    'open': sum(1 for t in tickets if t.status == 'Aberto'),
+                    'in_progress': sum(1 for t in tickets if t.status == 'Em andamento'),
+                    'closed': sum(1 for t in tickets if t.status in CLOSED_STATUSES)}
+
+        def best_of(func):
+            timings = []
+            for _ in range(repeat):
+                db.session.expunge_all()
+                started = time.perf_counter()
+                result = func()
+                timings.append(time.perf_counter() - started)
+            return result, min(timings) * 1000
+
+        admin = SimpleNamespace(id=None, role='admin')
+        author_id = db.session.query(User.id).order_by(User.id).limit(1).scalar()
+        statuses = ['Aberto', 'Em andamento', 'Resolvido', 'Fechado']
+        table = Ticket.__table__
+        inserted = 0
+        failed = False
+        try:
+            for size in sorted(int(value) for value in sizes.split(',') if value.strip()):
+                rows = [{'title': f'bench {i}', 'description': 'bench', 'category': 'Geral', 'priority': 'Media',
+                         'status': statuses[i % len(statuses)], 'user_id': author_id}
+                        for i in range(inserted, size)]
+                if rows:
+                    # Core: sem eventos do ORM (rollup, busca, SLA); tudo é desfeito no rollback
+                    db.session.execute(table.insert(), rows)
+                    inserted = size
+
+                with count_statements() as counter:
+                    grouped, grouped_ms = best_of(lambda: get_dashboard_stats(admin))
+                legacy, legacy_ms = best_of(legacy_stats)
+                statements = counter.count // repeat
+                ok = grouped == legacy and statements == 1
+                failed = failed or not ok
+                click.echo(f'{grouped["total"]:>8} chamado(s): GROUP BY {grouped_ms:8.1f} ms ({statements} comando(s)) | '
+                           f'antigo {legacy_ms:9.1f} ms{"" if ok else "  DIVERGENTE"}')
+        finally:
+            db.session.rollback()
+        if failed:
+            raise SystemExit(1)
+
+    @app.cli.command('check-loaders')
+    @click.option('--sizes', default='5,50', show_default=True, help='Quantidades de chamados carregados por perfil.')
+    def check_loaders(sizes):
+        """Falha se algum perfil de carregamento de Ticket fizer N+1 (dados sintéticos, desfeitos no final)."""
+        import secrets
+        from app.extensions import db
+        from app.models.ticket import Ticket, ticket_observers
+        from app.models.user import User
+        from app.services.query_plans import count_statements
+
+        # Relacionamentos que as telas de cada perfil acessam e o máximo de comandos aceito
+        profiles = {
+            'list': (('author', 'assigned_to'), 1),
+            'export': (('author', 'assigned_to'), 1),
+            'detail': (('author', 'assigned_to', 'assigned_by', 'observers'), 2),
+        }
+        sizes = sorted(int(value) for value in sizes.split(',') if value.strip())
+        count = sizes[-1]
+        prefix = f'bench-{secrets.token_hex(4)}-'
+        failed = False
+        try:
+            # Um autor, um responsável e um observador distintos por chamado: N+1 apareceria como N comandos
+            db.session.execute(User.__table__.insert(), [
+                {'username': f'{prefix}{i}', 'email': f'{prefix}{i}@bench.invalid', 'role': 'user'}
+                for i in range(count * 2)])
+            user_ids = [row.id for row in db.session.query(User.id).filter(User.username.startswith(prefix))
+                        .order_by(User.id)]
+            db.session.execute(Ticket.__table__.insert(), [
+                {'title': f'bench {i}', 'description': 'bench', 'category': 'Geral', 'status': 'Aberto',
+                 'user_id': user_ids[i], 'assigned_to_id': user_ids[count + i], 'assigned_by_id': user_ids[i]}
+                for i in range(count)])
+            ticket_ids = [row.id for row in db.session.query(Ticket.id).order_by(Ticket.id.desc()).limit(count)]
+            db.session.execute(ticket_observers.insert(), [
+                {'ticket_id': ticket_id, 'user_id': user_ids[count + i]} for i, ticket_id in enumerate(ticket_ids)])
+
+            for profile, (attributes, limit) in profiles.items():
+                counts = []
+                for size in sizes:
+                    db.session.expunge_all()  # Sem mapa de identidade: cada acesso preguiçoso viraria um SELECT
+                    with count_statements() as counter:
+                        for ticket in Ticket.query_for(profile).filter(Ticket.id.in_(ticket_ids[:size])).all():
+                            for attribute in attributes:
+                                value = getattr(ticket, attribute)
+                                if isinstance(value, list):
+                                    [user.username for user in value]
+                    counts.append(counter.count)
+                ok = len(set(counts)) == 1 and counts[0] <= limit
+                failed = failed or not ok
+                detail = ', '.join(f'{size} chamado(s): {n}' for size, n in zip(sizes, counts))
+                click.echo(f'[{"ok" if ok else "N+1"}] {profile}: {detail} (máximo {limit})')
+        finally:
+            db.session.rollback()
+        if failed:
+            raise SystemExit(1)
+
+    @app.cli.command('low-stock-rebuild')
+    def low_stock_rebuild():
+        """Recalcula o flag de estoque baixo de todos os itens (sem gerar eventos)."""
+        from app.services.low_stock import rebuild_low_stock
+        fixed = rebuild_low_stock()
+        click.echo(f'Flag de estoque baixo recalculado: {fixed} item(ns) corrigido(s).')
+
+    @app.cli.command('stock-check')
+    @click.option('--fix', is_flag=True, help='Registra movimentos de conciliação para as divergências.')
+    def stock_check(fix):
+        """Confere o saldo em cache de cada item com a soma do razão de estoque."""
+        from app.services.stock import check_stock_ledger, reconcile_stock_ledger
+        mismatches = check_stock_ledger()
+        if not mismatches:
+            click.echo('Razão de estoque consistente.')
+            return
+
+        for item_id, name, quantity, total in mismatches:
+            click.echo(f'#{item_id} {name}: saldo {quantity}, razão {total}')
+        click.echo(f'{len(mismatches)} divergência(s) encontrada(s).')
+
+        if fix:
+            fixed = reconcile_stock_ledger()
+            click.echo(f'{fixed} movimento(s) de conciliação registrado(s).')
+        else:
+            raise SystemExit(1)
+
+    @app.cli.command('stock-concurrency-check')
+    @click.option('--threads', 'thread_count', default=16, show_default=True, help='Técnicos consumindo ao mesmo tempo.')
+    @click.option('--stock', default=10, show_default=True, help='Saldo inicial do item sintético.')
+    @click.option('--amount', default=1, show_default=True, help='Quantidade pedida por thread.')
+    def stock_concurrency_check(thread_count, stock, amount):
+        """Falha se consumos simultâneos da mesma peça deixarem o estoque negativo ou o razão divergente.
+
+        Cria um item e um chamado sintéticos, dispara as threads juntas e remove tudo no final.
+        """
+        import secrets
+        import threading
+        from flask import current_app
+        from sqlalchemy import func
+        from sqlalchemy.exc import OperationalError
+        from app.extensions import db
+        from app.models.settings import Item
+        from app.models.stock import StockMovement
+        from app.models.ticket import Ticket, TicketItem
+        from app.models.user import User
+        from app.services.stock import ConsumptionLine, check_stock_ledger, consume_items
+
+        flask_app = current_app._get_current_object()
+        author_id = db.session.query(User.id).order_by(User.id).limit(1).scalar()
+        name = f'bench-{secrets.token_hex(4)}'
+        item = Item(name=name, category='Geral', quantity=stock)
+        ticket = Ticket(title=name, description='bench', category='Geral', status='Aberto', user_id=author_id)
+        db.session.add_all([item, ticket])
+        db.session.commit()
+        item_id, ticket_id = item.id, ticket.id
+
+        barrier = threading.Barrier(thread_count)
+        results = {'consumed': 0, 'refused': 0, 'errors': 0}
+        lock = threading.Lock()
+
+        def consume():
+            with flask_app.app_context():
+                barrier.wait()
+                try:
+                    recorded, _ = consume_items(ticket_id, [ConsumptionLine(item_id, amount)])
+                    db.session.commit()
+                    outcome = 'consumed' if recorded else 'refused'
+                except OperationalError:
+                    # Banco ocupado (ex: trava de escrita do SQLite esgotou o tempo): nada foi gravado
+                    db.session.rollback()
+                    outcome = 'errors'
+                with lock:
+                    results[outcome] += 1
+
+        try:
+            threads = [threading.Thread(target=consume) for _ in range(thread_count)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            db.session.expire_all()
+            quantity = db.session.query(Item.quantity).filter(Item.id == item_id).scalar()
+            used = db.session.query(func.coalesce(func.sum(TicketItem.quantity_used), 0)) \
+                .filter(TicketItem.ticket_id == ticket_id).scalar()
+            ledger_ok = not any(row.id == item_id for row in check_stock_ledger())
+            checks = {
+                f'saldo final {quantity} >= 0': quantity >= 0,
+                f'usado no chamado {used} = baixado {stock - quantity}': used == stock - quantity,
+                f'usado {used} = consumos aceitos x {amount}': used == results['consumed'] * amount,
+                'razão de estoque consistente': ledger_ok,
+            }
+            click.echo(f'{thread_count} thread(s): {results["consumed"]} consumo(s), {results["refused"]} recusado(s) '
+                       f'por saldo, {results["errors"]} erro(s) de banco.')
+            for label, ok in checks.items():
+                click.echo(f'[{"ok" if ok else "FALHA"}] {label}')
+        finally:
+            # Dados sintéticos: remove também os movimentos do item (incluindo o de exclusão)
+            db.session.rollback()
+            db.session.execute(TicketItem.__table__.delete().where(TicketItem.ticket_id == ticket_id))
+            db.session.delete(db.session.get(Item, item_id))
+            db.session.delete(db.session.get(Ticket, ticket_id))
+            db.session.flush()
+            db.session.execute(StockMovement.__table__.delete().where(StockMovement.item_id == item_id))
+            db.session.commit()
+        if not all(checks.values()):
+            raise SystemExit(1)
+
+    @app.cli.command('ad-sync')
+    @click.option('--full', is_flag=True, help="Ignora a marca d'água e relê o diretório inteiro.")
+    def ad_sync(full):
+        """Sincroniza os usuários alterados no AD desde a última execução (para agendar no cron)."""
+        from app.services.ad_sync import sync_ad_users
+        try:
+            result = sync_ad_users(full=full)
+        except (ValueError, ConnectionError) as e:
+            click.echo(f'Erro: {e}', err=True)
+            raise SystemExit(1)
+
+        origin = 'completa' if result.since is None else f'desde uSNChanged {result.since}'
+        click.echo(f'Sincronização {origin} com {result.server}: {result.created} criado(s), '
+                   f'{result.updated} atualizado(s), {result.disabled} desativado(s), {result.skipped} ignorado(s).')
+        click.echo(f"Nova marca d'água: {result.watermark}.")
+
+    @app.cli.command('ad-import-bench')
+    @click.option('--users', 'count', default=10000, show_default=True, help='Usuários sintéticos a importar.')
+    @click.option('--workers', type=int, default=None, help='Processos para os hashes (padrão: AD_HASH_WORKERS; 1 = em série).')
+    def ad_import_bench(count, workers):
+        """Mede a vazão da importação do AD com usuários sintéticos (tudo é desfeito no final)."""
+        import secrets
+        import time
+        from app.extensions import db
+        from app.services.active_directory import import_ad_users, password_hash_pool
+
+        prefix = f'bench-{secrets.token_hex(4)}-'
+        ad_users = [{'username': f'{prefix}{i}', 'email': f'{prefix}{i}@bench.invalid',
+                     'display_name': f'Usuário {i}', 'dn': ''} for i in range(count)]
+        try:
+            started = time.perf_counter()
+            with password_hash_pool(workers) as executor:
+                imported, skipped = import_ad_users(ad_users, executor=executor)
+                db.session.flush()
+            elapsed = time.perf_counter() - started
+        finally:
+            db.session.rollback()
+
+        mode = 'no pool de processos' if executor else 'em série'
+        click.echo(f'{imported} usuário(s) importado(s), {skipped} ignorado(s) em {elapsed:.1f}s '
+                   f'({imported / elapsed:.0f} usuários/s, hashes {mode}).')
+
+    @app.cli.command('search-reindex')
+    def search_reindex():
+        """Reconstrói os índices de busca textual dos tickets e do inventário."""
+        from app.services.search import get_search_backend, rebuild_search_index
+        from app.services.item_search import get_item_search_backend, rebuild_item_search_index
+        rebuild_search_index()
+        rebuild_item_search_index()
+        click.echo(f'Índice de busca reconstruído ({get_search_backend().name}).')
+        click.echo(f'Índice do inventário reconstruído ({get_item_search_backend().name}).')
+
+    def report_query_plans():
+        """Imprime o plano de cada consulta das rotas principais; retorna True se alguma varre a tabela"""
+        from app.services.query_plans import check_query_plans, hot_queries
+        failures = check_query_plans()
+        for name in hot_queries():
+            status = 'VARREDURA' if name in failures else 'ok'
+            click.echo(f'[{status}] {name}')
+            for line in failures.get(name, []):
+                click.echo(f'    {line}')
+        return bool(failures)
+
+    @app.cli.command('check-indexes')
+    def check_indexes():
+        """Falha se alguma consulta das rotas principais cair em varredura completa de tabela."""
+        if report_query_plans():
+            raise SystemExit(1)
+
+    @app.cli.command('sla-recompute')
+    def sla_recompute():
+        """Recalcula o prazo (due_at) dos chamados abertos com as configurações de SLA atuais."""
+        from app.extensions import db
+        from app.services.sla import recompute_open_due_dates
+        updated = recompute_open_due_dates()
+        db.session.commit()
+        click.echo(f'Prazo recalculado em {updated} chamado(s).')
+
+    @app.cli.command('sla-watch')
+    @click.option('--refresh', default=60, show_default=True, help='Segundos entre buscas de mudanças feitas por outros processos.')
+    def sla_watch(refresh):
+        """Vigia os prazos dos chamados abertos e registra os vencimentos (bloqueia até Ctrl+C)."""
+        from app.services.sla_watcher import start_sla_watcher
+        click.echo('Vigia de SLA iniciado.')
+        try:
+            start_sla_watcher(app, background=False, refresh_seconds=refresh)
+        except KeyboardInterrupt:
+            click.echo('Vigia de SLA encerrado.')
+
+    @app.cli.command('worker')
+    @click.option('--threads', default=2, show_default=True, help='Tarefas executadas em paralelo.')
+    @click.option('--poll', default=2.0, show_default=True, help='Segundos entre buscas quando a fila está vazia.')
+    def worker(threads, poll):
+        """Executa as tarefas em segundo plano (importações, exportações, backup) até Ctrl+C."""
+        from app.services.jobs import start_job_worker
+        click.echo(f'Worker de tarefas iniciado ({threads} thread(s)).')
+        try:
+            start_job_worker(app, threads=threads, poll_seconds=poll, background=False)
+        except KeyboardInterrupt:
+            click.echo('Worker de tarefas encerrado.')
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev_secret_key_123'
@@ -33,5 +34,24 @@ class Config:
         "pool_timeout": 30,
     }
 
+    # Fuso do expediente usado no cálculo de SLA por horário comercial
+    SLA_TIMEZONE = os.environ.get('SLA_TIMEZONE') or 'America/Sao_Paulo'
+
+    # Vigia de prazos em thread dentro do servidor web (alternativa: processo separado com `flask sla-watch`)
+    SLA_WATCHER_ENABLED = os.environ.get('SLA_WATCHER_ENABLED', '').lower() in ('1', 'true', 'yes')
+
+    # Fila de tarefas (importações, exportações, backup): arquivos de entrada/saída e worker embutido
+    # Na Vercel só o diretório temporário aceita escrita
+    JOB_STORAGE_DIR = os.environ.get('JOB_STORAGE_DIR') or (
+        os.path.join(tempfile.gettempdir(), 'helpdesk_jobs') if os.environ.get('VERCEL')
+        else os.path.join(_rootdir, 'instance', 'jobs'))
+    JOB_WORKER_ENABLED = os.environ.get('JOB_WORKER_ENABLED', '').lower() in ('1', 'true', 'yes')
+    # Há um `flask worker` em outro processo/container; sem ele nem o embutido, as tarefas rodam na requisição
+    JOB_EXTERNAL_WORKER = os.environ.get('JOB_EXTERNAL_WORKER', '').lower() in ('1', 'true', 'yes')
+    JOB_WORKER_THREADS = int(os.environ.get('JOB_WORKER_THREADS') or 2)
+
+    # Processos que geram os hashes das senhas iniciais na importação do AD (0 = nº de CPUs, 1 = em série)
+    AD_HASH_WORKERS = int(os.environ.get('AD_HASH_WORKERS') or 0)
+
     UPLOAD_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'uploads')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024 # 16MB max limit
@@ -0,0 +1,56 @@
+from datetime import datetime
+from app.extensions import db
+
+
+class AdSearch(db.Model):
+    """Resultado de uma busca no AD guardado no servidor (app.services.ad_search).
+
+    O cliente recebe só o id curto (handle); as entradas ficam em
+    ad_search_entry e a busca inteira expira em expires_at.
+    """
+    __tablename__ = 'ad_search'
+
+    id = db.Column(db.String(16), primary_key=True)  # Handle aleatório passado na URL
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    search_term = db.Column(db.String(255))
+    total = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    # Entradas apagadas em lote junto com a busca (app.services.ad_search), sem carregar no ORM
+    entries = db.relationship('AdSearchEntry', backref='search', lazy='dynamic')
+
+    def __repr__(self):
+        return f'<AdSearch {self.id} ({self.total})>'
+
+
+class AdSearchEntry(db.Model):
+    """Usuário encontrado em uma busca no AD, na ordem de exibição"""
+    __tablename__ = 'ad_search_entry'
+    __table_args__ = (
+        db.Index('ix_ad_search_entry_search_id_position', 'search_id', 'position'),
+        db.Index('ix_ad_search_entry_search_id_username', 'search_id', 'username'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    search_id = db.Column(db.String(16), db.ForeignKey('ad_search.id', ondelete='CASCADE'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    username = db.Column(db.String(64), nullable=False)
+    email = db.Column(db.String(120))
+    display_name = db.Column(db.String(200))
+    first_name = db.Column(db.String(100))
+    last_name = db.Column(db.String(100))
+    dn = db.Column(db.String(500))
+
+    def to_dict(self):
+        return {
+            'username': self.username,
+            'email': self.email,
+            'display_name': self.display_name,
+            'first_name': self.first_name,
+            'last_name': self.last_name,
+            'dn': self.dn,
+        }
+
+    def __repr__(self):
+        return f'<AdSearchEntry {self.search_id} {self.username}>'
@@ -0,0 +1,71 @@
+import json
+from datetime import datetime
+from app.extensions import db
+
+JOB_QUEUED = 'Na fila'
+JOB_RUNNING = 'Executando'
+JOB_DONE = 'Concluído'
+JOB_FAILED = 'Falhou'
+JOB_FINISHED_STATUSES = (JOB_DONE, JOB_FAILED)
+
+
+class Job(db.Model):
+    """Tarefa administrativa executada em segundo plano pelo `flask worker`.
+
+    A própria tabela é a fila: os workers reservam a próxima linha 'Na fila'
+    com um UPDATE condicional, então SQLite e Postgres servem sem broker externo.
+    """
+    __table_args__ = (
+        db.Index('ix_job_status_id', 'status', 'id'),
+        db.Index('ix_job_user_id_created_at', 'user_id', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=JOB_QUEUED)
+    params = db.Column(db.Text)  # JSON
+    progress = db.Column(db.Integer, default=0)  # 0-100
+    message = db.Column(db.String(255))
+    result = db.Column(db.Text)  # JSON com o resumo produzido pela tarefa
+    result_path = db.Column(db.String(255))  # Arquivo gerado (relativo a JOB_STORAGE_DIR)
+    result_name = db.Column(db.String(255))  # Nome sugerido no download
+    result_mimetype = db.Column(db.String(100))
+    error = db.Column(db.Text)
+    worker = db.Column(db.String(100))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    user = db.relationship('User', foreign_keys=[user_id])
+
+    @property
+    def params_dict(self):
+        return json.loads(self.params) if self.params else {}
+
+    @property
+    def result_dict(self):
+        return json.loads(self.result) if self.result else {}
+
+    @property
+    def is_finished(self):
+        return self.status in JOB_FINISHED_STATUSES
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'finished': self.is_finished,
+            'progress': self.progress or 0,
+            'message': self.message,
+            'error': self.error,
+            'has_file': bool(self.result_path) and self.status == JOB_DONE,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
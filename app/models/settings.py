@@ -1,5 +1,13 @@
+import time
+from datetime import datetime
+from typing import NamedTuple, Optional
+from sqlalchemy import event
+from sqlalchemy.ext.hybrid import hybrid_property
 from app.extensions import db
 
+SETTINGS_CACHE_NAME = 'settings'  # Linha em cache_version que sinaliza mudanças entre workers
+SETTINGS_VERSION_CHECK_SECONDS = 5  # Intervalo máximo para um worker perceber mudança feita por outro
+
 class AppSettings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     ad_server = db.Column(db.String(128), nullable=True)
@@ -7,17 +15,87 @@ class AppSettings(db.Model):
     ad_base_dn = db.Column(db.String(128), nullable=True)
     ad_user_dn = db.Column(db.String(128), nullable=True) # User to bind with (usually required for AD)
     ad_user_password = db.Column(db.String(128), nullable=True) # Password for bind user
+    # JSON {servidor: maior uSNChanged já sincronizado} (app.services.ad_sync)
+    ad_sync_watermarks = db.Column(db.Text, nullable=True)
     
     # SLA Settings (in hours)
     sla_hours_baixa = db.Column(db.Integer, default=48)
     sla_hours_media = db.Column(db.Integer, default=24)
     sla_hours_alta = db.Column(db.Integer, default=8)
     sla_hours_critica = db.Column(db.Integer, default=4)
+    # Calendário do SLA: expediente vazio = prazos em horas corridas (24x7)
+    sla_business_hours = db.Column(db.String(100), nullable=True)  # ex: "08:00-12:00,13:00-18:00"
+    sla_work_days = db.Column(db.String(20), default='0,1,2,3,4')  # 0 = segunda ... 6 = domingo
+    sla_holidays = db.Column(db.Text, nullable=True)  # AAAA-MM-DD, DD/MM/AAAA ou DD/MM (recorrente)
     theme = db.Column(db.String(20), default='light')
 
     def __repr__(self):
         return '<AppSettings>'
 
+
+class SettingsSnapshot(NamedTuple):
+    """Cópia imutável das configurações, compartilhada entre requisições do mesmo processo"""
+    ad_server: Optional[str] = None
+    ad_domain: Optional[str] = None
+    ad_base_dn: Optional[str] = None
+    ad_user_dn: Optional[str] = None
+    ad_user_password: Optional[str] = None
+    sla_hours_baixa: int = 48
+    sla_hours_media: int = 24
+    sla_hours_alta: int = 8
+    sla_hours_critica: int = 4
+    sla_business_hours: Optional[str] = None
+    sla_work_days: str = '0,1,2,3,4'
+    sla_holidays: Optional[str] = None
+    theme: str = 'light'
+
+    @classmethod
+    def from_model(cls, app_settings):
+        if app_settings is None:
+            return cls()
+        defaults = cls()
+        # Colunas nulas (bancos antigos) caem no valor padrão
+        return cls(**{field: getattr(app_settings, field) if getattr(app_settings, field) is not None
+                      else getattr(defaults, field) for field in cls._fields})
+
+
+# Cache do processo: versão lida de cache_version, snapshot e momento da última conferência
+_settings_cache = {'version': None, 'snapshot': None, 'checked_at': 0.0}
+
+
+def get_app_settings():
+    """Configurações (AD, SLA, tema) carregadas uma vez por processo.
+
+    A versão em cache_version é conferida no máximo a cada
+    SETTINGS_VERSION_CHECK_SECONDS; só então outro worker recarrega.
+    No próprio processo, invalidate_app_settings() tem efeito imediato.
+    """
+    now = time.monotonic()
+    cached = _settings_cache
+    if cached['snapshot'] is not None and now - cached['checked_at'] < SETTINGS_VERSION_CHECK_SECONDS:
+        return cached['snapshot']
+
+    version = db.session.query(CacheVersion.version).filter_by(name=SETTINGS_CACHE_NAME).scalar() or 0
+    snapshot = cached['snapshot']
+    if snapshot is None or cached['version'] != version:
+        snapshot = SettingsSnapshot.from_model(AppSettings.query.first())
+    _settings_cache.update(version=version, snapshot=snapshot, checked_at=now)
+    return snapshot
+
+
+def invalidate_app_settings():
+    """Descarta o snapshot deste processo (chamar após o commit de mudanças em AppSettings)"""
+    _settings_cache.update(version=None, snapshot=None, checked_at=0.0)
+
+
+@event.listens_for(AppSettings, 'after_insert')
+@event.listens_for(AppSettings, 'after_update')
+@event.listens_for(AppSettings, 'after_delete')
+def _settings_changed(mapper, connection, target):
+    # Incrementa a versão na mesma transação para os outros workers recarregarem
+    from app.services.cache import bump_cache_version
+    bump_cache_version(connection, SETTINGS_CACHE_NAME)
+
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False, unique=True)
@@ -26,12 +104,21 @@ class Category(db.Model):
         return f'<Category {self.name}>'
 
 class Item(db.Model):
+    __table_args__ = (
+        # Listagem ordenada por nome e filtro por categoria na tela de inventário
+        db.Index('ix_item_name', 'name'),
+        db.Index('ix_item_category_name', 'category', 'name'),
+        # Conjunto atual de itens com estoque baixo, lido pelo flag sem varrer a tabela
+        db.Index('ix_item_low_stock_name', 'low_stock', 'name'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, nullable=True)
     category = db.Column(db.String(50), nullable=False)  # Categoria do item (ex: Hardware, Software, Peças)
     quantity = db.Column(db.Integer, default=0)  # Quantidade em estoque
     min_quantity = db.Column(db.Integer, default=0)  # Quantidade mínima para alerta
+    low_stock = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())  # quantity <= min_quantity, mantido por app.services.low_stock
     unit_cost = db.Column(db.Float, default=0.0)  # Custo unitário
     location = db.Column(db.String(100), nullable=True)  # Localização física
     supplier = db.Column(db.String(100), nullable=True)  # Fornecedor
@@ -44,12 +131,48 @@ class Item(db.Model):
     def __repr__(self):
         return f'<Item {self.name}>'
     
-    @property
+    @hybrid_property
     def is_low_stock(self):
-        """Verifica se o item está com estoque baixo"""
+        """Verifica se o item está com estoque baixo (também usável em filtros SQL)"""
         return self.quantity <= self.min_quantity
     
-    @property
+    @hybrid_property
     def total_value(self):
-        """Calcula o valor total do estoque"""
+        """Calcula o valor total do estoque (também usável em SUM no SQL)"""
         return self.quantity * self.unit_cost
+
+class LowStockEvent(db.Model):
+    """Item que entrou (low_stock=True) ou saiu (False) do estoque baixo (app.services.low_stock)"""
+    __tablename__ = 'low_stock_event'
+
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False, index=True)
+    low_stock = db.Column(db.Boolean, nullable=False)
+    quantity = db.Column(db.Integer)  # Saldo e mínimo no momento do cruzamento (histórico)
+    min_quantity = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    item = db.relationship('Item', backref=db.backref('low_stock_events', lazy='dynamic', cascade='all, delete-orphan'))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'item_id': self.item_id,
+            'item_name': self.item.name if self.item else None,
+            'low_stock': self.low_stock,
+            'quantity': self.quantity,
+            'min_quantity': self.min_quantity,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+
+    def __repr__(self):
+        return f'<LowStockEvent item={self.item_id} low_stock={self.low_stock}>'
+
+class CacheVersion(db.Model):
+    """Contador de versão por cache (ex: 'users'); incrementado a cada alteração nos dados de origem"""
+    __tablename__ = 'cache_version'
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<CacheVersion {self.name}={self.version}>'
@@ -0,0 +1,45 @@
+from datetime import datetime
+from app.extensions import db
+
+MOVEMENT_INITIAL = 'Saldo inicial'
+MOVEMENT_TICKET_USE = 'Uso em chamado'
+MOVEMENT_TICKET_RETURN = 'Devolução de chamado'
+MOVEMENT_ADJUSTMENT = 'Ajuste manual'
+MOVEMENT_IMPORT = 'Importação'
+MOVEMENT_RECONCILIATION = 'Conciliação'
+MOVEMENT_DELETION = 'Exclusão do item'
+
+
+def movement_period(when):
+    """Partição mensal do razão (AAAAMM) a que uma data pertence"""
+    return when.year * 100 + when.month
+
+
+class StockMovement(db.Model):
+    """Razão de estoque: uma linha por entrada/saída, nunca alterada nem apagada (app.services.stock).
+
+    Item.quantity é o saldo corrente em cache, atualizado na mesma transação;
+    balance_after guarda o saldo após cada movimento. Sem chave estrangeira para
+    item/ticket: o histórico sobrevive à exclusão do item ou do chamado.
+    """
+    __tablename__ = 'stock_movement'
+    __table_args__ = (
+        # period (AAAAMM) particiona logicamente por mês: relatórios de um período leem só os seus meses
+        db.Index('ix_stock_movement_period_item_id', 'period', 'item_id'),
+        # Histórico e saldo em uma data de um item: varredura por intervalo dentro do item
+        db.Index('ix_stock_movement_item_id_created_at', 'item_id', 'created_at'),
+        db.Index('ix_stock_movement_ticket_id', 'ticket_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, nullable=False)
+    delta = db.Column(db.Integer, nullable=False)  # Positivo = entrada, negativo = saída
+    balance_after = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(50), nullable=False)
+    ticket_id = db.Column(db.Integer, nullable=True)
+    user_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    period = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<StockMovement item={self.item_id} {self.delta:+d} ({self.reason})>'
@@ -1,14 +1,29 @@
 from app.extensions import db
 from datetime import datetime
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import joinedload, selectinload
 
 # Tabela de associação para múltiplos observadores
 ticket_observers = db.Table('ticket_observers',
     db.Column('ticket_id', db.Integer, db.ForeignKey('ticket.id'), primary_key=True),
-    db.Column('user_id', db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    db.Column('user_id', db.Integer, db.ForeignKey('users.id'), primary_key=True),
+    # A PK começa por ticket_id; este índice atende "tickets observados pelo usuário"
+    db.Index('ix_ticket_observers_user_id_ticket_id', 'user_id', 'ticket_id')
 )
 
 class Ticket(db.Model):
+    # Índices compostos para os filtros de visibilidade/listagem mais usados
+    __table_args__ = (
+        db.Index('ix_ticket_assigned_to_id_status', 'assigned_to_id', 'status'),
+        db.Index('ix_ticket_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_ticket_status_updated_at', 'status', 'updated_at'),
+        # Índice parcial dos prazos de chamados abertos; responsável e categoria entram para
+        # os agrupamentos de SLA serem respondidos só pelo índice (ver app/services/sla_breaches.py)
+        db.Index('ix_ticket_open_due_at', 'due_at', 'assigned_to_id', 'category',
+                 sqlite_where=db.text("status IN ('Aberto', 'Em andamento')"),
+                 postgresql_where=db.text("status IN ('Aberto', 'Em andamento')")),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(150), nullable=False)
     description = db.Column(db.Text, nullable=False)
@@ -36,9 +51,27 @@ class Ticket(db.Model):
     attachments = db.relationship('Attachment', backref='ticket', lazy='dynamic', cascade="all, delete-orphan")
     used_items = db.relationship('TicketItem', back_populates='ticket', lazy='dynamic', cascade="all, delete-orphan")
 
+    @classmethod
+    def query_for(cls, profile):
+        """Query com um perfil de carregamento nomeado ('list', 'detail', 'export')"""
+        return cls.query.options(*ticket_loader_options(profile))
+
     def __repr__(self):
         return f'<Ticket {self.id}: {self.title}>'
 
+def ticket_loader_options(profile):
+    """Opções de eager loading por perfil, evitando N+1 em autor/responsável/observadores"""
+    if profile in ('list', 'export'):
+        return (joinedload(Ticket.author), joinedload(Ticket.assigned_to))
+    if profile == 'detail':
+        return (
+            joinedload(Ticket.author),
+            joinedload(Ticket.assigned_to),
+            joinedload(Ticket.assigned_by),
+            selectinload(Ticket.observers)
+        )
+    raise ValueError(f'Perfil de carregamento desconhecido: {profile}')
+
 class Attachment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
@@ -50,6 +83,10 @@ class Attachment(db.Model):
         return f'<Attachment {self.filename}>'
 
 class Comment(db.Model):
+    __table_args__ = (
+        db.Index('ix_comment_ticket_id_created_at', 'ticket_id', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
@@ -62,8 +99,13 @@ class Comment(db.Model):
 
 class TicketItem(db.Model):
     """Relacionamento entre tickets e itens usados na resolução"""
+    __table_args__ = (
+        # Relatório de consumo: agrupa por item e ordena por data (e filtra o período) sem ordenar em memória
+        db.Index('ix_ticket_item_item_id_used_at', 'item_id', 'used_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    ticket_id = db.Column(db.Integer, db.ForeignKey('ticket.id'), nullable=False)
+    ticket_id = db.Column(db.Integer, db.ForeignKey('ticket.id'), nullable=False, index=True)
     item_id = db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False)
     quantity_used = db.Column(db.Integer, default=1)  # Quantidade usada
     used_at = db.Column(db.DateTime, default=datetime.utcnow)  # Quando foi usado
@@ -80,3 +122,38 @@ class TicketItem(db.Model):
     
     def __repr__(self):
         return f'<TicketItem ticket:{self.ticket_id} item:{self.item_id} qty:{self.quantity_used}>'
+
+class TicketStatsRollup(db.Model):
+    """Contadores materializados por mês/status/prioridade/categoria (mantidos por app.services.stats)"""
+    __tablename__ = 'ticket_stats_rollup'
+    year = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    priority = db.Column(db.String(20), primary_key=True)
+    category = db.Column(db.String(50), primary_key=True)
+    opened = db.Column(db.Integer, nullable=False, default=0)  # Tickets criados no mês
+    resolved = db.Column(db.Integer, nullable=False, default=0)  # Tickets resolvidos no mês
+
+    def __repr__(self):
+        return f'<TicketStatsRollup {self.month}/{self.year} {self.status}: {self.opened}/{self.resolved}>'
+
+class SlaBreachEvent(db.Model):
+    """Chamado que ultrapassou o prazo, registrado pelo vigia de SLA (app.services.sla_watcher)"""
+    __tablename__ = 'sla_breach_event'
+    __table_args__ = (
+        # Um registro por prazo: vários vigias (workers) podem detectar o mesmo vencimento
+        db.UniqueConstraint('ticket_id', 'due_at', name='uq_sla_breach_event_ticket_id_due_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    ticket_id = db.Column(db.Integer, db.ForeignKey('ticket.id'), nullable=False)
+    due_at = db.Column(db.DateTime, nullable=False)
+    detected_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    status = db.Column(db.String(20))
+    priority = db.Column(db.String(20))
+    assigned_to_id = db.Column(db.Integer, nullable=True)  # Responsável no momento do vencimento (histórico)
+
+    ticket = db.relationship('Ticket', backref=db.backref('sla_breaches', lazy='dynamic', cascade='all, delete-orphan'))
+
+    def __repr__(self):
+        return f'<SlaBreachEvent ticket={self.ticket_id} due={self.due_at}>'
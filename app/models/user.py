@@ -13,12 +13,20 @@ class User(UserMixin, db.Model):
     role = db.Column(db.String(20), default='user') # 'admin', 'user'
     is_technician = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Conta desativada não faz login (a sincronização com o AD desativa quem foi desabilitado lá)
+    active = db.Column(db.Boolean, nullable=False, default=True, server_default=db.true())
+    ad_dn = db.Column(db.String(500), nullable=True)  # Preenchido quando o usuário vem do AD
 
     # Relationships managed in Ticket model to avoid circular import/mapper issues
     # tickets_created = db.relationship('Ticket', backref='author', lazy='dynamic', foreign_keys='Ticket.user_id', cascade='all, delete-orphan')
     # tickets_assigned = db.relationship('Ticket', backref='assigned_to', lazy='dynamic', foreign_keys='Ticket.assigned_to_id')
     comments = db.relationship('Comment', backref='author', lazy='dynamic', cascade='all, delete-orphan')
 
+    @property
+    def is_active(self):
+        # Flask-Login: conta inativa não autentica (login_user e login_required)
+        return self.active is not False
+
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
 
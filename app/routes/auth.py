@@ -25,7 +25,13 @@ def login():
                 return {'message': 'Usuário ou senha inválidos'}, 401
             flash('Usuário ou senha inválidos', 'error')
             return redirect(url_for('auth.login'))
-        
+
+        if not user.is_active:
+            if request.is_json:
+                return {'message': 'Conta desativada'}, 403
+            flash('Conta desativada. Procure o administrador.', 'error')
+            return redirect(url_for('auth.login'))
+
         login_user(user)
         
         if request.is_json:
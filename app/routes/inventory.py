@@ -1,7 +1,13 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app, jsonify, abort
 from flask_login import login_required, current_user
 from app.extensions import db
 from app.models.settings import Item
+from app.services.inventory import (inventory_totals, get_item_categories, get_items_version,
+                                    item_lookup, item_category_counts, LOOKUP_PER_PAGE)
+from app.services.item_search import search_items, TYPEAHEAD_LIMIT
+from app.services.low_stock import low_stock_items, low_stock_events, FEED_LIMIT
+from app.services.stock import set_movement_context, item_movements, stock_valuation_at
+from app.models.stock import MOVEMENT_INITIAL, MOVEMENT_ADJUSTMENT, MOVEMENT_DELETION
 from io import BytesIO
 from flask import send_file
 from openpyxl import Workbook
@@ -10,6 +16,8 @@ from datetime import datetime
 
 inventory_bp = Blueprint('inventory', __name__, url_prefix='/inventory')
 
+ITEMS_PER_PAGE = 50
+
 @inventory_bp.route('/', methods=['GET'])
 @login_required
 def index():
@@ -28,41 +36,167 @@ def index():
         query = query.filter_by(category=category_filter)
     
     if search_query:
-        query = query.filter(
-            db.or_(
-                Item.name.ilike(f'%{search_query}%'),
-                Item.description.ilike(f'%{search_query}%'),
-                Item.location.ilike(f'%{search_query}%'),
-                Item.supplier.ilike(f'%{search_query}%')
-            )
-        )
+        # Índice de busca (FTS5/pg_trgm) já ordena por relevância; o nome fica como desempate
+        query = search_items(query, search_query)
     
     if low_stock_only:
-        query = query.filter(Item.quantity <= Item.min_quantity)
-    
-    items = query.order_by(Item.name).all()
-    
-    # Estatísticas
-    total_items = len(items)
-    total_value = sum(item.total_value for item in items)
-    low_stock_items = len([item for item in items if item.is_low_stock])
+        query = query.filter(Item.low_stock.is_(True))
     
-    # Categorias disponíveis
-    categories = db.session.query(Item.category).distinct().all()
-    categories = [cat[0] for cat in categories if cat[0]]
+    # Estatísticas do filtro inteiro em uma consulta agregada; a tabela é paginada
+    totals = inventory_totals(query)
+    page = request.args.get('page', 1, type=int)
+    items = query.order_by(Item.name, Item.id).paginate(page=page, per_page=ITEMS_PER_PAGE, error_out=False, count=False)
+    items.total = totals.count
+
+    page_args = {k: v for k, v in request.args.items() if k != 'page'}
+    prev_url = url_for('inventory.index', page=items.prev_num, **page_args) if items.has_prev else None
+    next_url = url_for('inventory.index', page=items.next_num, **page_args) if items.has_next else None
     
     return render_template('inventory/index.html',
-                         items=items,
-                         categories=categories,
-                         total_items=total_items,
-                         total_value=total_value,
-                         low_stock_items=low_stock_items,
+                         items=items.items,
+                         pagination=items,
+                         prev_url=prev_url,
+                         next_url=next_url,
+                         categories=get_item_categories(),
+                         total_items=totals.count,
+                         total_value=totals.value,
+                         low_stock_items=totals.low_stock,
                          filters={
                              'category': category_filter,
                              'q': search_query,
                              'low_stock': low_stock_only
                          })
 
+@inventory_bp.route('/search.json')
+@login_required
+def search_json():
+    """Busca rápida (type-ahead) para os seletores de material dos chamados.
+
+    ?q= termo (vazio traz os primeiros por nome), ?limit= máx. de itens,
+    ?all=1 inclui itens sem estoque.
+    """
+    if current_user.role != 'admin':
+        abort(403)
+
+    q = request.args.get('q', '')
+    limit = min(request.args.get('limit', TYPEAHEAD_LIMIT, type=int), 100)
+
+    query = Item.query
+    if request.args.get('all') != '1':
+        query = query.filter(Item.quantity > 0)
+    items = search_items(query, q).order_by(Item.name, Item.id).limit(limit).all()
+
+    return jsonify(q=q, items=[{
+        'id': item.id,
+        'name': item.name,
+        'category': item.category,
+        'quantity': item.quantity,
+        'unit_cost': item.unit_cost,
+        'location': item.location,
+    } for item in items])
+
+@inventory_bp.route('/lookup.json')
+@login_required
+def lookup_json():
+    """Itens paginados e agrupados por categoria para os seletores de material (cache com ETag).
+
+    ?q= busca, ?category= filtra, ?page=/?per_page= paginam, ?all=1 inclui itens
+    sem estoque. A primeira página traz também as categorias com a contagem.
+    """
+    if current_user.role != 'admin':
+        abort(403)
+
+    # O ETag é a versão dos itens: qualquer inclusão, edição ou baixa de estoque gera outro
+    etag = f'items-{get_items_version()}'
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        in_stock = request.args.get('all') != '1'
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', LOOKUP_PER_PAGE, type=int), 1), 100)
+        data = item_lookup(request.args.get('q', ''), request.args.get('category') or None,
+                           page=page, per_page=per_page, in_stock=in_stock)
+        if page == 1:
+            data['categories'] = [{'name': name, 'count': count}
+                                  for name, count in item_category_counts(in_stock)]
+        response = jsonify(data)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@inventory_bp.route('/low-stock.json')
+@login_required
+def low_stock_json():
+    """Itens com estoque baixo agora e o feed de cruzamentos de limite (?after=<id do último evento>)"""
+    if current_user.role != 'admin':
+        abort(403)
+
+    after_id = request.args.get('after', type=int)
+    limit = min(request.args.get('limit', FEED_LIMIT, type=int), 500)
+    events = low_stock_events(after_id, limit)
+
+    return jsonify(
+        items=[{
+            'id': item.id, 'name': item.name, 'category': item.category,
+            'quantity': item.quantity, 'min_quantity': item.min_quantity
+        } for item in low_stock_items()],
+        events=[e.to_dict() for e in events],
+        last_event_id=events[-1].id if events else after_id,
+    )
+
+@inventory_bp.route('/<int:id>/movements')
+@login_required
+def item_movements_view(id):
+    """Razão de estoque do item (entradas, saídas e saldo após cada movimento)"""
+    if current_user.role != 'admin':
+        flash('Acesso negado.', 'error')
+        return redirect(url_for('main.index'))
+
+    item = Item.query.get_or_404(id)
+    start_date = _parse_filter_date(request.args.get('start_date'))
+    end_date = _parse_filter_date(request.args.get('end_date'), end_of_day=True)
+    page = request.args.get('page', 1, type=int)
+    movements = item_movements(item.id, start_date, end_date).paginate(
+        page=page, per_page=ITEMS_PER_PAGE, error_out=False, count=False)
+
+    users = {}
+    user_ids = {m.user_id for m in movements.items if m.user_id}
+    if user_ids:
+        from app.models.user import User
+        users = {u.id: u for u in User.query.filter(User.id.in_(user_ids))}
+
+    page_args = {k: v for k, v in request.args.items() if k != 'page'}
+    return render_template('inventory/movements.html',
+                         item=item,
+                         movements=movements.items,
+                         users=users,
+                         prev_url=url_for('inventory.item_movements_view', id=id, page=movements.prev_num, **page_args) if movements.has_prev else None,
+                         next_url=url_for('inventory.item_movements_view', id=id, page=movements.next_num, **page_args) if movements.has_next else None,
+                         filters={'start_date': request.args.get('start_date', ''), 'end_date': request.args.get('end_date', '')})
+
+@inventory_bp.route('/valuation.json')
+@login_required
+def valuation_json():
+    """Saldo e valor do estoque em uma data (?date=AAAA-MM-DD), reconstruídos pelo razão"""
+    if current_user.role != 'admin':
+        abort(403)
+
+    when = _parse_filter_date(request.args.get('date'), end_of_day=True) or datetime.utcnow()
+    rows = stock_valuation_at(when)
+    return jsonify(
+        date=when.isoformat(),
+        total_value=float(sum(value or 0 for *_, value in rows)),
+        items=[{'id': item_id, 'name': name, 'quantity': quantity, 'value': float(value or 0)}
+               for item_id, name, quantity, value in rows],
+    )
+
+def _parse_filter_date(value, end_of_day=False):
+    try:
+        date = datetime.strptime(value, '%Y-%m-%d') if value else None
+    except ValueError:
+        return None
+    return date.replace(hour=23, minute=59, second=59) if date and end_of_day else date
+
 @inventory_bp.route('/create', methods=['GET', 'POST'])
 @login_required
 def create_item():
@@ -101,6 +235,7 @@ def create_item():
             supplier=supplier
         )
         
+        set_movement_context(new_item, MOVEMENT_INITIAL, user_id=current_user.id)
         db.session.add(new_item)
         db.session.commit()
         
@@ -142,6 +277,7 @@ def edit_item(id):
         item.description = description
         item.category = category
         item.quantity = quantity
+        set_movement_context(item, MOVEMENT_ADJUSTMENT, user_id=current_user.id)
         item.min_quantity = min_quantity
         item.unit_cost = unit_cost
         item.location = location
@@ -168,6 +304,7 @@ def delete_item(id):
         flash(f'Não é possível excluir o item "{item.name}" pois ele já foi usado em chamados.', 'error')
         return redirect(url_for('inventory.index'))
     
+    set_movement_context(item, MOVEMENT_DELETION, user_id=current_user.id)
     db.session.delete(item)
     db.session.commit()
     
@@ -244,126 +381,19 @@ def export_usage_excel():
         flash('Acesso negado.', 'error')
         return redirect(url_for('main.index'))
     
-    from app.models.ticket import TicketItem, Ticket
-    from app.models.user import User
-    
-    start_date_str = request.args.get('start_date')
-    end_date_str = request.args.get('end_date')
-    
-    query = db.session.query(TicketItem, Ticket, User, Item).\
-        join(Ticket, TicketItem.ticket_id == Ticket.id).\
-        join(User, Ticket.user_id == User.id).\
-        join(Item, TicketItem.item_id == Item.id)
-        
-    if start_date_str:
-        try:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-            query = query.filter(TicketItem.used_at >= start_date)
-        except: pass
-    if end_date_str:
+    from app.services.jobs import enqueue_job
+    from app.routes.jobs import job_response
+
+    params = {}
+    for field in ('start_date', 'end_date'):
         try:
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
-            end_date = end_date.replace(hour=23, minute=59, second=59)
-            query = query.filter(TicketItem.used_at <= end_date)
-        except: pass
-        
-    usage_records = query.order_by(Item.name, TicketItem.used_at.desc()).all()
-    
-    if not usage_records:
-        flash('Nenhum registro encontrado para o período selecionado.', 'warning')
-        return redirect(url_for('inventory.index'))
+            params[field] = datetime.strptime(request.args.get(field, ''), '%Y-%m-%d').date().isoformat()
+        except ValueError:
+            pass
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Consumo de Itens"
-    
-    headers = [
-        'Data', 'Item', 'Categoria', 'Quantidade', 'Custo Unitário (R$)',
-        'Custo Total (R$)', 'Solicitante', 'Username', 'Chamado', 'Notas'
-    ]
-    
-    # Format Headers
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="C0504D", end_color="C0504D", fill_type="solid")
-    
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal='center')
-    
-    row_num = 2
-    current_item = None
-    item_qty_sum = 0
-    item_cost_sum = 0
-    
-    subtotal_font = Font(bold=True)
-    subtotal_fill = PatternFill(start_color="F2DCDB", end_color="F2DCDB", fill_type="solid")
-
-    def write_subtotal(ws, row, item_name, qty, cost):
-        ws.cell(row=row, column=1, value='---')
-        ws.cell(row=row, column=2, value=f'TOTAL {item_name}')
-        ws.cell(row=row, column=4, value=qty)
-        ws.cell(row=row, column=6, value=cost)
-        ws.cell(row=row, column=10, value='Subtotal por item')
-        for c in range(1, 11):
-            ws.cell(row=row, column=c).font = subtotal_font
-            ws.cell(row=row, column=c).fill = subtotal_fill
-
-    for ticket_item, ticket, user, item in usage_records:
-        if current_item and current_item != item.name:
-            write_subtotal(ws, row_num, current_item, item_qty_sum, item_cost_sum)
-            row_num += 1
-            item_qty_sum = 0
-            item_cost_sum = 0
-            
-        current_item = item.name
-        qty = ticket_item.quantity_used
-        cost = qty * item.unit_cost
-        item_qty_sum += qty
-        item_cost_sum += cost
-        
-        row_data = [
-            ticket_item.used_at.strftime('%d/%m/%Y %H:%M'),
-            item.name,
-            item.category,
-            qty,
-            item.unit_cost,
-            cost,
-            user.fullname or user.username,
-            user.username,
-            f"#{ticket.id} - {ticket.title}",
-            ticket_item.notes or ''
-        ]
-        for col_num, value in enumerate(row_data, 1):
-            ws.cell(row=row_num, column=col_num, value=value)
-        row_num += 1
-            
-    # Add last subtotal
-    if current_item:
-        write_subtotal(ws, row_num, current_item, item_qty_sum, item_cost_sum)
+    job = enqueue_job('usage_export', params, user_id=current_user.id)
 
-    # Adjust column widths
-    for col in ws.columns:
-        max_length = 0
-        column = col[0].column_letter
-        for cell in col:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except: pass
-        ws.column_dimensions[column].width = min(max_length + 4, 60)
-            
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        as_attachment=True,
-        download_name=f"relatorio_consumo_{datetime.now().strftime('%Y%m%d')}.xlsx"
-    )
+    return job_response(job)
 
 @inventory_bp.route('/import', methods=['POST'])
 @login_required
@@ -385,93 +415,52 @@ def import_inventory():
         flash('Por favor, envie um arquivo Excel (.xlsx).', 'error')
         return redirect(url_for('inventory.index'))
         
-    try:
-        from openpyxl import load_workbook
-        wb = load_workbook(file)
-        ws = wb.active
-        
-        # Mapa de colunas esperado (smart matching)
-        headers = [cell.value for cell in ws[1]]
-        
-        # Encontrar índices das colunas
-        def find_col(names):
-            for i, h in enumerate(headers):
-                if h and any(n.lower() in h.lower() for n in names):
-                    return i + 1
-            return None
-            
-        col_name = find_col(['nome', 'item', 'produto'])
-        col_category = find_col(['categoria', 'grupo'])
-        col_quantity = find_col(['quantidade', 'estoque', 'qtd'])
-        col_min = find_col(['mínima', 'minima', 'alerta'])
-        col_cost = find_col(['custo', 'valor', 'preço', 'preco'])
-        col_desc = find_col(['descrição', 'descrição', 'obs'])
-        col_loc = find_col(['localização', 'local', 'prateleira'])
-        col_sup = find_col(['fornecedor', 'marca'])
-        
-        if not col_name or not col_category or not col_quantity:
-            flash('O arquivo deve conter as colunas: Nome, Categoria e Quantidade.', 'error')
-            return redirect(url_for('inventory.index'))
-            
-        count_updated = 0
-        count_created = 0
-        
-        # Iterar a partir da segunda linha
-        for row_idx in range(2, ws.max_row + 1):
-            name = ws.cell(row=row_idx, column=col_name).value
-            if not name: continue
-            
-            name = str(name).strip()
-            category = ws.cell(row=row_idx, column=col_category).value or 'Geral'
-            quantity = ws.cell(row=row_idx, column=col_quantity).value or 0
-            
-            # Tentar converter para int
-            try: quantity = int(quantity)
-            except: quantity = 0
-            
-            item = Item.query.filter_by(name=name).first()
-            if item:
-                # Update
-                item.category = str(category).strip()
-                item.quantity = quantity
-                if col_min:
-                    val = ws.cell(row=row_idx, column=col_min).value
-                    if val is not None: item.min_quantity = int(val)
-                if col_cost:
-                    val = ws.cell(row=row_idx, column=col_cost).value
-                    if val is not None: item.unit_cost = float(val)
-                if col_desc:
-                    val = ws.cell(row=row_idx, column=col_desc).value
-                    if val: item.description = str(val).strip()
-                if col_loc:
-                    val = ws.cell(row=row_idx, column=col_loc).value
-                    if val: item.location = str(val).strip()
-                if col_sup:
-                    val = ws.cell(row=row_idx, column=col_sup).value
-                    if val: item.supplier = str(val).strip()
-                count_updated += 1
-            else:
-                # Create
-                new_item = Item(
-                    name=name,
-                    category=str(category).strip(),
-                    quantity=quantity,
-                    min_quantity=int(ws.cell(row=row_idx, column=col_min).value or 0) if col_min else 0,
-                    unit_cost=float(ws.cell(row=row_idx, column=col_cost).value or 0.0) if col_cost else 0.0,
-                    description=str(ws.cell(row=row_idx, column=col_desc).value or '').strip() if col_desc else '',
-                    location=str(ws.cell(row=row_idx, column=col_loc).value or '').strip() if col_loc else '',
-                    supplier=str(ws.cell(row=row_idx, column=col_sup).value or '').strip() if col_sup else ''
-                )
-                db.session.add(new_item)
-                count_created += 1
-                
-        db.session.commit()
-        flash(f'Sucesso! {count_updated} itens atualizados e {count_created} novos itens criados.', 'success')
-        
-    except Exception as e:
-        db.session.rollback()
-        flash(f'Erro ao processar o arquivo: {str(e)}', 'error')
-        
-    return redirect(url_for('inventory.index'))
+    from app.services.jobs import enqueue_job
+    from app.routes.jobs import job_response
+
+    # Processada como tarefa (worker ou, sem ele, na própria requisição); a planilha fica na pasta da tarefa
+    job = enqueue_job('inventory_import', {'dry_run': request.form.get('dry_run') == '1', 'filename': file.filename},
+                      user_id=current_user.id, upload=file, upload_name='import.xlsx')
+    return job_response(job)
+
+
+@inventory_bp.route('/import/<int:job_id>/report', methods=['GET'])
+@login_required
+def import_report(job_id):
+    if current_user.role != 'admin':
+        flash('Acesso negado.', 'error')
+        return redirect(url_for('main.index'))
+
+    from app.models.job import Job, JOB_DONE
+    from app.services.inventory_import import ImportReport
+
+    job = Job.query.get_or_404(job_id)
+    if job.kind != 'inventory_import' or job.status != JOB_DONE:
+        return redirect(url_for('jobs.view', id=job.id))
+    result = job.result_dict
+    return render_template('inventory/import_report.html', job=job, report=ImportReport.from_dict(result),
+                           filename=result.get('filename') or 'planilha')
+
+
+@inventory_bp.route('/import/<int:job_id>/confirm', methods=['POST'])
+@login_required
+def confirm_import(job_id):
+    """Aplica uma simulação concluída, reaproveitando a planilha já enviada"""
+    if current_user.role != 'admin':
+        flash('Acesso negado.', 'error')
+        return redirect(url_for('main.index'))
+
+    from app.models.job import Job, JOB_DONE
+    from app.services.jobs import enqueue_copy
+    from app.routes.jobs import job_response
+
+    job = Job.query.get_or_404(job_id)
+    if job.kind != 'inventory_import' or job.status != JOB_DONE or not job.params_dict.get('dry_run'):
+        flash('Esta importação não pode ser confirmada.', 'error')
+        return redirect(url_for('jobs.view', id=job.id))
+
+    new_job = enqueue_copy(job, 'inventory_import', {'dry_run': False, 'filename': job.params_dict.get('filename')},
+                           user_id=current_user.id)
+    return job_response(new_job)
 
 
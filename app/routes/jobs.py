@@ -0,0 +1,86 @@
+import os
+from flask import Blueprint, render_template, redirect, url_for, flash, jsonify, send_file, abort
+from flask_login import login_required, current_user
+from app.models.job import Job, JOB_DONE
+from app.services.jobs import job_storage_dir
+from app.services.admin_jobs import JOB_LABELS
+
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+JOBS_LIST_LIMIT = 50
+
+# Tela de origem de cada tipo de tarefa (link "Voltar")
+JOB_RETURN_ENDPOINTS = {
+    'inventory_import': ('inventory.index', {}),
+    'usage_export': ('inventory.index', {}),
+    'ad_bulk_import': ('settings.index', {'tab': 'ad'}),
+    'backup': ('settings.index', {'tab': 'backup'}),
+    'stats_export': ('main.admin_stats', {}),
+}
+
+
+def _get_job_or_404(id):
+    if current_user.role != 'admin':
+        abort(403)
+    return Job.query.get_or_404(id)
+
+
+def _job_links(job):
+    endpoint, args = JOB_RETURN_ENDPOINTS.get(job.kind, ('main.index', {}))
+    links = {'return_url': url_for(endpoint, **args), 'download_url': None, 'report_url': None}
+    if job.status == JOB_DONE and job.result_path:
+        links['download_url'] = url_for('jobs.download', id=job.id)
+    if job.status == JOB_DONE and job.kind == 'inventory_import':
+        links['report_url'] = url_for('inventory.import_report', job_id=job.id)
+    return links
+
+
+def job_response(job):
+    """Resposta das rotas que criam tarefas: o arquivo, se a tarefa já terminou (execução na
+    própria requisição, sem worker), senão a tela de acompanhamento"""
+    if job.status == JOB_DONE and job.result_path:
+        path = os.path.join(job_storage_dir(job.id), job.result_path)
+        if os.path.exists(path):
+            return send_file(path, mimetype=job.result_mimetype, as_attachment=True, download_name=job.result_name)
+    return redirect(url_for('jobs.view', id=job.id))
+
+
+@jobs_bp.route('/', methods=['GET'])
+@login_required
+def index():
+    if current_user.role != 'admin':
+        flash('Acesso negado.', 'error')
+        return redirect(url_for('main.index'))
+
+    jobs = Job.query.order_by(Job.id.desc()).limit(JOBS_LIST_LIMIT).all()
+    return render_template('jobs/index.html', jobs=jobs, labels=JOB_LABELS)
+
+
+@jobs_bp.route('/<int:id>', methods=['GET'])
+@login_required
+def view(id):
+    job = _get_job_or_404(id)
+    return render_template('jobs/view.html', job=job, label=JOB_LABELS.get(job.kind, job.kind), **_job_links(job))
+
+
+@jobs_bp.route('/<int:id>/status', methods=['GET'])
+@login_required
+def status(id):
+    """Consulta de progresso (polling da tela da tarefa)"""
+    job = _get_job_or_404(id)
+    response = jsonify({**job.to_dict(), **_job_links(job)})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@jobs_bp.route('/<int:id>/download', methods=['GET'])
+@login_required
+def download(id):
+    job = _get_job_or_404(id)
+    if job.status != JOB_DONE or not job.result_path:
+        abort(404)
+    path = os.path.join(job_storage_dir(job.id), job.result_path)
+    if not os.path.exists(path):
+        flash('O arquivo desta tarefa não está mais disponível.', 'error')
+        return redirect(url_for('jobs.view', id=job.id))
+    return send_file(path, mimetype=job.result_mimetype, as_attachment=True, download_name=job.result_name)
@@ -1,18 +1,19 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, session, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required, current_user
 from app.extensions import db
 from sqlalchemy import text
-from app.models.settings import Category, AppSettings
+from app.models.settings import Category, AppSettings, get_app_settings, invalidate_app_settings
 from app.models.user import User
-import ldap3
+from app.services.active_directory import iter_ad_users, import_ad_user_stream
+from app.services.ad_search import (create_ad_search, get_ad_search, ad_search_page, find_ad_search_entry,
+                                    remove_ad_search_entry, delete_ad_searches, iter_ad_search_entries)
+from app.services.sla import parse_business_hours, parse_work_days, parse_holidays, recompute_open_due_dates, WEEKDAY_NAMES
 import secrets
 import string
 import zipfile
-import io
 import os
 import shutil
 from datetime import datetime
-from flask import send_file, request
 
 
 
@@ -32,32 +33,12 @@ def index():
         db.session.add(app_settings)
         db.session.commit()
         
-    # Buscar usuários encontrados na sessão (se houver)
-    ad_users_found = session.get('ad_users_found', [])
-    
-    # Verificar quais usuários já existem no sistema
-    existing_usernames = set(User.query.with_entities(User.username).all())
-    existing_usernames = {u[0] for u in existing_usernames}
-    
-    existing_emails = set(User.query.with_entities(User.email).all())
-    existing_emails = {e[0] for e in existing_emails}
-    
-    # Marcar usuários que já existem
-    for user in ad_users_found:
-        user['exists'] = user['username'] in existing_usernames or user['email'] in existing_emails
-    
-    # Agrupar usuários por prefixo (ex: DNP001 -> DNP)
-    grouped_users = {}
-    for user in ad_users_found:
-        prefix = user['username'][:3].upper() if user['username'] and len(user['username']) >= 3 else 'Outros'
-        if prefix not in grouped_users:
-            grouped_users[prefix] = []
-        grouped_users[prefix].append(user)
-        
-    # Ordenar grupos e usuários dentro dos grupos
-    sorted_groups = sorted(grouped_users.items())
-    for prefix in grouped_users:
-        grouped_users[prefix] = sorted(grouped_users[prefix], key=lambda x: x['display_name'])
+    # Resultado da busca no AD guardado no servidor; a URL traz só o handle e a página
+    ad_search = get_ad_search(request.args.get('ad_search'), current_user.id)
+    ad_users_found, ad_has_next = [], False
+    ad_page = max(request.args.get('ad_page', 1, type=int), 1)
+    if ad_search:
+        ad_users_found, ad_has_next = ad_search_page(ad_search, ad_page)
 
     # Obter aba ativa da query string
     active_tab = request.args.get('tab', 'categories')
@@ -65,9 +46,12 @@ def index():
     return render_template('settings.html', 
                          categories=categories, 
                          settings=app_settings,
+                         ad_search=ad_search,
                          ad_users_found=ad_users_found,
-                         grouped_ad_users=sorted_groups,
+                         ad_page=ad_page,
+                         ad_has_next=ad_has_next,
                          active_tab=active_tab,
+                         weekday_names=WEEKDAY_NAMES,
                          now=datetime.utcnow())
 
 @settings_bp.route('/categories', methods=['POST'])
@@ -127,6 +111,7 @@ def update_ad_config():
     # Se campo está vazio mas usuário ainda existe, manter senha anterior (não atualizar)
     
     db.session.commit()
+    invalidate_app_settings()
     flash('Configurações do AD salvas.', 'success')
     return redirect(url_for('settings.index', tab='ad'))
 
@@ -140,206 +125,58 @@ def update_sla_config():
     if not app_settings:
         app_settings = AppSettings()
         db.session.add(app_settings)
+    sla_fields = ('sla_hours_baixa', 'sla_hours_media', 'sla_hours_alta', 'sla_hours_critica',
+                  'sla_business_hours', 'sla_work_days', 'sla_holidays')
+    previous = tuple(getattr(app_settings, f) for f in sla_fields)
     
     try:
         app_settings.sla_hours_baixa = int(request.form.get('sla_hours_baixa', 48))
         app_settings.sla_hours_media = int(request.form.get('sla_hours_media', 24))
         app_settings.sla_hours_alta = int(request.form.get('sla_hours_alta', 8))
         app_settings.sla_hours_critica = int(request.form.get('sla_hours_critica', 4))
-        
-        db.session.commit()
-        flash('Configurações de SLA salvas.', 'success')
     except ValueError:
         flash('Valores inválidos para SLA (use apenas números inteiros).', 'error')
-        
-    return redirect(url_for('settings.index', tab='sla'))
-
-def _get_ad_connection(app_settings):
-    """Helper function to create LDAP connection to AD"""
-    if not app_settings or not app_settings.ad_server:
-        raise ValueError('Servidor AD não configurado')
-    
-    # Criar servidor LDAP
-    server = ldap3.Server(app_settings.ad_server, get_info=ldap3.ALL)
-    
-    # Preparar credenciais de bind
-    user = None
-    password = None
-    authentication = ldap3.ANONYMOUS
-    
-    # Se usuário foi fornecido, preparar autenticação
-    if app_settings.ad_user_dn and app_settings.ad_user_dn.strip():
-        user = app_settings.ad_user_dn.strip()
-        password = app_settings.ad_user_password
-        
-        # Se não há senha salva ou senha está vazia, não usar autenticação
-        if not password or not str(password).strip():
-            # Se usuário foi fornecido mas sem senha, usar conexão anônima
-            user = None
-            authentication = ldap3.ANONYMOUS
-        else:
-            password = str(password).strip()
-            authentication = ldap3.SIMPLE
-            
-            # Se o usuário está apenas como username (sem @ e sem DN), tentar construir UPN
-            if '@' not in user and ',' not in user and app_settings.ad_domain:
-                # Construir formato UPN automaticamente
-                user = f'{user}@{app_settings.ad_domain}'
-    
-    # Criar conexão
-    conn = ldap3.Connection(
-        server,
-        user=user,
-        password=password if password else None,
-        authentication=authentication,
-        auto_bind=True,
-        raise_exceptions=False
-    )
-    
-    # Verificar se a conexão foi bem-sucedida
-    if not conn.bound:
-        error_msg = conn.result.get('description', 'Erro desconhecido')
-        error_code = conn.result.get('result', '')
-        
-        # Mensagens de erro mais amigáveis
-        if 'invalidCredentials' in str(error_msg) or error_code == 49:
-            if user and password:
-                # Tentar formatos alternativos se ainda não tentamos
-                if '@' in user:
-                    # Já tentamos UPN, tentar DN se possível
-                    suggested_format = f'CN={user.split("@")[0]},CN=Users,{app_settings.ad_base_dn or ""}'
-                else:
-                    # Tentar UPN se tiver domínio
-                    if app_settings.ad_domain:
-                        suggested_format = f'{user}@{app_settings.ad_domain}'
-                    else:
-                        suggested_format = f'CN={user},CN=Users,DC=...'
-                
-                raise ConnectionError(
-                    f'Credenciais inválidas. Verifique:\n'
-                    f'- Usuário: {user}\n'
-                    f'- Se a senha está correta\n'
-                    f'- Se a conta não está bloqueada ou desabilitada\n'
-                    f'- Tente usar formato UPN: {suggested_format if "@" not in user else "ou formato DN completo"}'
-                )
-            elif user and not password:
-                raise ConnectionError(
-                    'Usuário fornecido mas senha está vazia. '
-                    'Forneça a senha ou deixe ambos vazios para conexão anônima.'
-                )
-            else:
-                raise ConnectionError('Falha na autenticação. O servidor pode não permitir conexão anônima.')
-        else:
-            conn.unbind()
-            raise ConnectionError(f'Falha ao conectar ao AD: {error_msg} (código: {error_code})')
-    
-    return conn
+        return redirect(url_for('settings.index', tab='sla'))
 
-def _search_ad_users(app_settings, search_term=None):
-    """Busca usuários no Active Directory"""
-    conn = None
+    # Calendário (expediente vazio = horas corridas)
+    business_hours = request.form.get('sla_business_hours', '').strip()
+    work_days = ','.join(sorted(request.form.getlist('sla_work_days')))
+    holidays = request.form.get('sla_holidays', '').strip()
     try:
-        conn = _get_ad_connection(app_settings)
-        
-        # Priorizar Base DN configurado pelo usuário
-        base_dn = app_settings.ad_base_dn or ''
-        
-        # Se não houver Base DN, tentar construir a partir do domínio
-        if not base_dn and app_settings.ad_domain:
-            base_dn = ','.join([f'DC={part}' for part in app_settings.ad_domain.split('.')])
-            
-        if not base_dn:
-            raise ValueError('Base DN não configurado. Por favor, configure o Base DN ou o Domínio nas configurações do AD.')
-        
-        # Filtro para buscar usuários (pessoas com conta habilitada e que não sejam contas de computador)
-        # !(sAMAccountName=*$) exclui contas de máquina via LDAP
-        base_active_filter = '(&(objectCategory=person)(objectClass=user)(!(userAccountControl:1.2.840.113556.1.4.803:=2))(!(sAMAccountName=*$)))'
-        
-        if search_term:
-            search_filter = f'(&{base_active_filter}(|(displayName=*{search_term}*)(sAMAccountName=*{search_term}*)(mail=*{search_term}*)))'
-        else:
-            search_filter = base_active_filter
-        
-        # Atributos a serem retornados
-        attributes = ['sAMAccountName', 'mail', 'cn', 'displayName', 'userPrincipalName', 'givenName', 'sn', 'userAccountControl']
-
-        
-        # Realizar busca
-        success = conn.search(
-            search_base=base_dn,
-            search_filter=search_filter,
-            search_scope=ldap3.SUBTREE,
-            attributes=attributes,
-            size_limit=1000
-        )
-        
-        if not success:
-            error_msg = conn.result.get('description', 'Erro desconhecido na busca')
-            error_code = conn.result.get('result', '')
-            raise ConnectionError(f'Falha ao buscar usuários: {error_msg} (código: {error_code})')
-        
-        users = []
-        for entry in conn.entries:
-            try:
-                # Extrair informações do usuário
-                username = str(entry.sAMAccountName) if hasattr(entry, 'sAMAccountName') and entry.sAMAccountName else None
-                
-                # IGNORAR se não houver username ou se for conta de máquina (termina com $) ou contiver $
-                if not username or '$' in username:
-                    continue
-
-                email = str(entry.mail) if hasattr(entry, 'mail') and entry.mail else None
-                first_name = str(entry.givenName) if hasattr(entry, 'givenName') and entry.givenName else ''
-                last_name = str(entry.sn) if hasattr(entry, 'sn') and entry.sn else ''
-                user_account_control = int(str(entry.userAccountControl)) if hasattr(entry, 'userAccountControl') and entry.userAccountControl else 0
-
-                # Verificar se a conta está ativa (bit ACCOUNTDISABLE não está definido)
-                # No AD, o bit 2 (valor 2) do userAccountControl indica conta desativada
-                if user_account_control & 2:
-                    continue
-
+        windows = parse_business_hours(business_hours)
+        if windows and not parse_work_days(work_days):
+            raise ValueError('Selecione ao menos um dia útil.')
+        parse_holidays(holidays)
+    except ValueError as e:
+        db.session.rollback()
+        flash(f'Calendário de SLA inválido: {e}', 'error')
+        return redirect(url_for('settings.index', tab='sla'))
 
-                full_name = f'{first_name} {last_name}'.strip()
-                if not full_name:
-                    full_name = str(entry.displayName) if hasattr(entry, 'displayName') and entry.displayName else str(entry.cn) if hasattr(entry, 'cn') and entry.cn else username or ''
-                
-                upn = str(entry.userPrincipalName) if hasattr(entry, 'userPrincipalName') and entry.userPrincipalName else None
-                
-                if not email and upn:
-                    email = upn
-                
-                if not email:
-                    if app_settings.ad_domain:
-                        email = f'{username}@{app_settings.ad_domain}'
-                    else:
-                        email = f'{username}@local'
-                
-                if username:
-                    users.append({
-                        'username': username,
-                        'email': email,
-                        'display_name': full_name,
-                        'first_name': first_name,
-                        'last_name': last_name,
-                        'dn': str(entry.entry_dn) if hasattr(entry, 'entry_dn') else ''
-                    })
-            except Exception as e:
-                continue
-        
-        return users
+    app_settings.sla_business_hours = business_hours or None
+    app_settings.sla_work_days = work_days
+    app_settings.sla_holidays = holidays or None
+    db.session.commit()
+    invalidate_app_settings()
+
+    # Prazos dos chamados abertos passam a seguir a nova configuração (só se ela mudou:
+    # o recálculo percorre todos os chamados abertos dentro da requisição)
+    if tuple(getattr(app_settings, f) for f in sla_fields) == previous:
+        flash('Configurações de SLA salvas (sem alterações).', 'success')
+        return redirect(url_for('settings.index', tab='sla'))
+    updated = recompute_open_due_dates()
+    db.session.commit()
+    flash(f'Configurações de SLA salvas. Prazo recalculado em {updated} chamado(s) aberto(s).', 'success')
         
-    finally:
-        if conn:
-            try:
-                conn.unbind()
-            except:
-                pass
+    return redirect(url_for('settings.index', tab='sla'))
 
 @settings_bp.route('/ad-clear-search', methods=['POST'])
 @login_required
 def clear_ad_search():
-    """Limpa os resultados da busca do AD da sessão"""
-    session.pop('ad_users_found', None)
+    """Descarta os resultados da busca do AD guardados no servidor"""
+    ad_search = get_ad_search(request.form.get('ad_search'), current_user.id)
+    if ad_search:
+        delete_ad_searches([ad_search.id])
+        db.session.commit()
     flash('Busca limpa com sucesso.', 'info')
     return redirect(url_for('settings.index', tab='ad'))
 
@@ -351,29 +188,29 @@ def sync_ad():
     if current_user.role != 'admin':
         return redirect(url_for('main.index'))
 
-    app_settings = AppSettings.query.first()
-    if not app_settings or not app_settings.ad_server:
+    app_settings = get_app_settings()
+    if not app_settings.ad_server:
         flash('Configure o servidor AD primeiro.', 'error')
         return redirect(url_for('settings.index', tab='ad'))
 
     try:
-        session.pop('ad_users_found', None) # Limpar busca anterior
-        
         search_query = request.form.get('search_query', '').strip()
-        users = _search_ad_users(app_settings, search_term=search_query if search_query else None)
+        # Busca paginada no AD gravada direto no servidor, em lotes; o navegador recebe só o handle
+        ad_search = create_ad_search(iter_ad_users(app_settings, search_term=search_query if search_query else None),
+                                     user_id=current_user.id, search_term=search_query or None)
         
-        if not users:
+        if not ad_search.total:
+            db.session.rollback()
             flash('Nenhum usuário ativo encontrado no AD. Possíveis causas:\n- Base DN incorreto\n- Filtro muito restritivo\n- Nenhum usuário habilitado no servidor\n- Permissões insuficientes para buscar usuários', 'warning')
             return redirect(url_for('settings.index', tab='ad'))
         
-        # Armazenar usuários encontrados na sessão para importação manual
-        session['ad_users_found'] = users
+        db.session.commit()
         
-        flash(f'✅ SUCESSO! {len(users)} usuário(s) ativo(s) encontrado(s) no AD. Selecione para importar.', 'success')
+        flash(f'✅ SUCESSO! {ad_search.total} usuário(s) ativo(s) encontrado(s) no AD. Selecione para importar.', 'success')
+        return redirect(url_for('settings.index', tab='ad', ad_search=ad_search.id))
         
     except Exception as e:
-        # Limpar sessão em caso de erro
-        session.pop('ad_users_found', None)
+        db.session.rollback()
         flash(f'Erro ao buscar usuários no AD: {str(e)}', 'error')
 
     return redirect(url_for('settings.index', tab='ad'))
@@ -385,32 +222,35 @@ def import_single_ad_user():
         flash('Acesso negado. Apenas administradores podem importar usuários.', 'danger')
         return redirect(url_for('main.index'))
 
+    ad_search = get_ad_search(request.form.get('ad_search'), current_user.id)
+    back = url_for('settings.index', tab='ad', ad_search=ad_search.id if ad_search else None,
+                   ad_page=request.form.get('ad_page', type=int))
+
     username_to_import = request.form.get('username')
     if not username_to_import:
         flash('Nome de usuário não fornecido para importação.', 'error')
-        return redirect(url_for('settings.index', tab='ad'))
+        return redirect(back)
 
-    ad_users_found = session.get('ad_users_found', [])
-    user_data_to_import = next((user for user in ad_users_found if user['username'] == username_to_import), None)
+    entry = find_ad_search_entry(ad_search, username_to_import) if ad_search else None
 
-    if not user_data_to_import:
+    if not entry:
         flash(f'Usuário "{username_to_import}" não encontrado na última busca do AD ou já importado.', 'error')
-        return redirect(url_for('settings.index', tab='ad'))
+        return redirect(back)
 
     try:
-        username = user_data_to_import['username']
-        email = user_data_to_import['email']
-        display_name = user_data_to_import['display_name']
+        username = entry.username
+        email = entry.email
+        display_name = entry.display_name
 
         existing_user = User.query.filter_by(username=username).first()
         if existing_user:
             flash(f'Usuário "{username}" já existe no sistema.', 'warning')
-            return redirect(url_for('settings.index', tab='ad'))
+            return redirect(back)
 
         existing_email = User.query.filter_by(email=email).first()
         if existing_email:
             flash(f'E-mail "{email}" já cadastrado para outro usuário.', 'warning')
-            return redirect(url_for('settings.index', tab='ad'))
+            return redirect(back)
 
         new_user = User(
             username=username,
@@ -422,17 +262,16 @@ def import_single_ad_user():
         new_user.set_password(username)
         
         db.session.add(new_user)
+        remove_ad_search_entry(ad_search, entry)
         db.session.commit()
         
         flash(f'Usuário "{display_name}" ({username}) importado com sucesso! Senha inicial: {username}', 'success')
-        
-        session['ad_users_found'] = [user for user in ad_users_found if user['username'] != username_to_import]
 
     except Exception as e:
         db.session.rollback()
         flash(f'Erro ao importar usuário "{username_to_import}": {str(e)}', 'error')
 
-    return redirect(url_for('settings.index', tab='ad'))
+    return redirect(back)
 
 @settings_bp.route('/ad-import-all', methods=['POST'])
 @login_required
@@ -441,58 +280,20 @@ def import_all_ad_users():
         flash('Acesso negado. Apenas administradores podem importar usuários.', 'danger')
         return redirect(url_for('main.index'))
 
-    ad_users_found = session.get('ad_users_found', [])
-    if not ad_users_found:
-        flash('Nenhum usuário encontrado na sessão para importar.', 'warning')
+    ad_search = get_ad_search(request.form.get('ad_search'), current_user.id)
+    if not ad_search or not ad_search.total:
+        flash('Nenhum usuário encontrado na busca para importar (a busca pode ter expirado).', 'warning')
         return redirect(url_for('settings.index', tab='ad'))
 
-    imported_count = 0
-    skipped_count = 0
-    errors = []
-
-    for user_data_to_import in ad_users_found:
-        try:
-            username = user_data_to_import['username']
-            email = user_data_to_import['email']
-            display_name = user_data_to_import['display_name']
-
-            existing_user = User.query.filter_by(username=username).first()
-            if existing_user:
-                skipped_count += 1
-                continue
-
-            existing_email = User.query.filter_by(email=email).first()
-            if existing_email:
-                skipped_count += 1
-                continue
-
-            new_user = User(
-                username=username,
-                email=email,
-                fullname=display_name,
-                role='user'
-            )
-            # Usar o username como senha inicial (usuários podem alterar depois)
-            new_user.set_password(username)
-
-            db.session.add(new_user)
-            imported_count += 1
-             
-        except Exception as e:
-            errors.append(f'{user_data_to_import.get("username", "desconhecido")}: {str(e)}')
-            skipped_count += 1
-
     try:
+        # Mesmo serviço da importação em massa: lotes com commit (na requisição os hashes são em série)
+        imported_count, skipped_count = import_ad_user_stream(iter_ad_search_entries(ad_search))
+        delete_ad_searches([ad_search.id])
         db.session.commit()
         if imported_count > 0:
             flash(f'✅ SUCESSO! {imported_count} usuário(s) importado(s) do AD com senha inicial igual ao username!', 'success')
         if skipped_count > 0:
             flash(f'{skipped_count} usuário(s) ignorado(s) (já existem no sistema ou com erro).', 'warning')
-        if errors:
-            flash(f'Erros na importação de alguns usuários: {"; ".join(errors[:3])}', 'error')
-        
-        # Limpar a sessão após a importação de todos
-        session.pop('ad_users_found', None)
              
     except Exception as e:
         db.session.rollback()
@@ -507,53 +308,17 @@ def bulk_import_ad_users():
     if current_user.role != 'admin':
         return redirect(url_for('main.index'))
 
-    app_settings = AppSettings.query.first()
-    if not app_settings or not app_settings.ad_server:
+    app_settings = get_app_settings()
+    if not app_settings.ad_server:
         flash('Configure o servidor AD primeiro.', 'error')
         return redirect(url_for('settings.index', tab='ad'))
 
-    try:
-        # Busca TODOS os usuários ativos (search_term=None)
-        ad_users = _search_ad_users(app_settings, search_term=None)
-        
-        if not ad_users:
-            flash('Nenhum usuário ativo encontrado para importar.', 'warning')
-            return redirect(url_for('settings.index', tab='ad'))
-
-        imported_count = 0
-        skipped_count = 0
-        
-        for user_data in ad_users:
-            username = user_data['username']
-            email = user_data['email']
-            display_name = user_data['display_name']
-
-            # Verifica se já existe
-            if User.query.filter((User.username == username) | (User.email == email)).first():
-                skipped_count += 1
-                continue
-
-            try:
-                new_user = User(
-                    username=username,
-                    email=email,
-                    fullname=display_name,
-                    role='user'
-                )
-                new_user.set_password(username)
-                db.session.add(new_user)
-                imported_count += 1
-            except:
-                skipped_count += 1
+    from app.services.jobs import enqueue_job
+    from app.routes.jobs import job_response
 
-        db.session.commit()
-        flash(f'✅ SUCESSO! {imported_count} usuários importados. {skipped_count} já existiam ou foram ignorados.', 'success')
-        
-    except Exception as e:
-        db.session.rollback()
-        flash(f'Erro na importação em massa: {str(e)}', 'error')
-
-    return redirect(url_for('settings.index', tab='ad'))
+    # Busca TODOS os usuários ativos e importa como tarefa (pode levar minutos)
+    job = enqueue_job('ad_bulk_import', user_id=current_user.id)
+    return job_response(job)
 
 @settings_bp.route('/backup', methods=['GET'])
 @login_required
@@ -562,40 +327,12 @@ def export_backup():
         flash('Acesso negado.', 'error')
         return redirect(url_for('main.index'))
 
-        
-    # Caminhos
-    root_dir = os.path.abspath(os.path.join(current_app.root_path, os.pardir))
-    instance_path = os.path.join(root_dir, 'instance')
-    uploads_path = current_app.config['UPLOAD_FOLDER']
-    
-    # Criar ZIP em memória
-    memory_file = io.BytesIO()
-    with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-        # Adicionar banco de dados
-        if os.path.exists(instance_path):
-            for root, dirs, files in os.walk(instance_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.join('instance', file)
-                    zf.write(file_path, arcname)
-        
-        # Adicionar uploads
-        if os.path.exists(uploads_path):
-            for root, dirs, files in os.walk(uploads_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.join('app/uploads', file)
-                    zf.write(file_path, arcname)
-                    
-    memory_file.seek(0)
-    filename = f"helpdesk_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
-    
-    return send_file(
-        memory_file,
-        mimetype='application/zip',
-        as_attachment=True,
-        download_name=filename
-    )
+    from app.services.jobs import enqueue_job
+    from app.routes.jobs import job_response
+
+    # O ZIP é gerado como tarefa; baixado na tela da tarefa ou direto, se rodou na requisição
+    job = enqueue_job('backup', user_id=current_user.id)
+    return job_response(job)
 
 @settings_bp.route('/restore', methods=['POST'])
 @login_required
@@ -652,7 +389,7 @@ def restore_backup():
                             return []
 
                     # 1. Limpar dados atuais (Muito mais rápido que drop_all no Postgres)
-                    db.session.execute(text('TRUNCATE TABLE users, ticket, comment, attachment, category, item, ticket_item, app_settings, ticket_observers RESTART IDENTITY CASCADE'))
+                    db.session.execute(text('TRUNCATE TABLE users, ticket, comment, attachment, category, item, ticket_item, app_settings, ticket_observers, ticket_stats_rollup, sla_breach_event, stock_movement RESTART IDENTITY CASCADE'))
                     db.session.commit()
                     
                     # Garante que a estrutura básica existe (caso alguma tabela falte)
@@ -721,7 +458,16 @@ def restore_backup():
                     
                     db.session.commit()
                     sqlite_conn.close()
-                    
+
+                    # Razão e flag de estoque baixo conferidos com os saldos migrados
+                    from app.services.stock import backfill_stock_ledger
+                    from app.services.low_stock import rebuild_low_stock
+                    backfill_stock_ledger()
+                    rebuild_low_stock()
+
+                    # TRUNCATE não dispara eventos do ORM: descarta o cache de configurações
+                    invalidate_app_settings()
+
                     # FUNDAMENTAL: Resetar as sequências após migrar dados manuais
                     from app import reset_sequences
                     reset_sequences(current_app)
@@ -733,6 +479,27 @@ def restore_backup():
                     db.session.remove()
                     db.engine.dispose()
                     shutil.copy2(db_source, db_dest)
+
+                    # O backup pode ser anterior ao rollup: recria a tabela e recalcula os contadores
+                    from app.services.stats import rebuild_ticket_rollup
+                    from app.services.search import setup_search_index, rebuild_search_index
+                    from app.services.item_search import setup_item_search_index, rebuild_item_search_index
+                    from app.services.directory import invalidate_user_directory
+                    from app.services.inventory import invalidate_item_categories
+                    from app.services.stock import backfill_stock_ledger
+                    from app.services.low_stock import rebuild_low_stock
+                    db.create_all()
+                    rebuild_ticket_rollup()
+                    # Backup anterior ao razão ou ao flag: saldo inicial e flag recalculados a partir de item.quantity
+                    backfill_stock_ledger()
+                    rebuild_low_stock()
+                    setup_search_index()
+                    rebuild_search_index()
+                    setup_item_search_index()
+                    rebuild_item_search_index()
+                    invalidate_user_directory()
+                    invalidate_item_categories()
+                    invalidate_app_settings()
                     flash('Banco de Dados SQLite restaurado.', 'success')
             else:
                 flash('Arquivo de banco de dados não encontrado no ZIP.', 'error')
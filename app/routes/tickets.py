@@ -8,7 +8,14 @@ from datetime import datetime
 import os
 from werkzeug.utils import secure_filename
 from flask import current_app, send_from_directory
-from sqlalchemy import or_, cast, String
+from sqlalchemy.orm import joinedload
+from app.services.stats import ticket_visibility_filter
+from app.services.search import search_tickets
+from app.services.pagination import keyset_paginate
+from app.services.directory import get_user_directory
+from app.services.sla import compute_due_at
+from app.services.stock import ConsumptionLine, consume_items, parse_consumption_lines, set_movement_context
+from app.models.stock import MOVEMENT_TICKET_RETURN
 
 tickets_bp = Blueprint('tickets', __name__)
 
@@ -31,19 +38,7 @@ def create_ticket():
         observer_ids = request.form.getlist('observer_ids')
         
         # SLA Calculation
-        from app.models.settings import AppSettings
-        from datetime import timedelta
-        
-        app_settings = AppSettings.query.first()
-        sla_hours = 24 # Default
-        if app_settings:
-            p_clean = priority.lower().replace('á','a').replace('é','e').replace('í','i').replace('ó','o').replace('ú','u')
-            if 'baixa' in p_clean: sla_hours = app_settings.sla_hours_baixa or 48
-            elif 'media' in p_clean: sla_hours = app_settings.sla_hours_media or 24
-            elif 'alta' in p_clean: sla_hours = app_settings.sla_hours_alta or 8
-            elif 'critica' in p_clean or 'urgente' in p_clean: sla_hours = app_settings.sla_hours_critica or 4
-            
-        due_at = datetime.utcnow() + timedelta(hours=sla_hours)
+        due_at = compute_due_at(priority, datetime.utcnow())
 
 
         ticket = Ticket(
@@ -88,23 +83,12 @@ def create_ticket():
     if not categories:
         categories = [] # Let the user create their own
     
-    # Get all users for admin to select (as author or observer)
-    users = User.query.all()
-    users.sort(key=lambda u: (u.fullname or u.username).lower())
-    
-    # Prepare users for JSON serialization (needed for Alpine.js search)
-    users_json = []
-    for u in users:
-        users_json.append({
-            'id': u.id,
-            'username': u.username,
-            'fullname': u.fullname or u.username
-        })
+    # Admin escolhe o solicitante; observadores são buscados no diretório (main.user_directory) pelo navegador
+    users = get_user_directory().users if current_user.role == 'admin' else []
         
     return render_template('tickets/create.html', 
                           categories=categories, 
-                          users=users,
-                          users_json=users_json)
+                          users=users)
 
 
 @tickets_bp.route('/tickets/<int:id>/delete', methods=['POST'])
@@ -128,18 +112,12 @@ def delete_ticket(id):
 @tickets_bp.route('/tickets')
 @login_required
 def list_tickets():
-    query = Ticket.query
+    query = Ticket.query_for('list')
     
-    # Permission check or filtering
-    if current_user.role != 'admin':
-        # Show tickets created by user OR assigned to user OR where user is observer
-        query = query.filter(
-            or_(
-                Ticket.user_id == current_user.id,
-                Ticket.assigned_to_id == current_user.id,
-                Ticket.observers.any(User.id == current_user.id)
-            )
-        )
+    # Permission check: tickets created by user OR assigned to user OR where user is observer
+    visibility = ticket_visibility_filter(current_user)
+    if visibility is not None:
+        query = query.filter(visibility)
 
     # Search Filters
     q = request.args.get('q')
@@ -147,11 +125,8 @@ def list_tickets():
     priority = request.args.get('priority')
 
     if q:
-        query = query.filter(or_(
-            Ticket.title.ilike(f'%{q}%'),
-            Ticket.description.ilike(f'%{q}%'),
-            cast(Ticket.id, String).ilike(f'%{q}%')
-        ))
+        # Busca indexada (ranqueada) ou por número do chamado
+        query = search_tickets(query, q)
     
     if status and status != 'Todos':
         query = query.filter_by(status=status)
@@ -160,15 +135,25 @@ def list_tickets():
         query = query.filter_by(priority=priority)
 
     # Pagination
-    page = request.args.get('page', 1, type=int)
-    tickets = query.order_by(Ticket.created_at.desc()).paginate(page=page, per_page=10, error_out=False)
+    page_args = {k: v for k, v in request.args.items() if k not in ('page', 'cursor')}
+    if q:
+        # Busca ranqueada por relevância: paginação por página (resultado já é restrito pelo índice)
+        page = request.args.get('page', 1, type=int)
+        tickets = query.order_by(Ticket.created_at.desc()).paginate(page=page, per_page=10, error_out=False)
+        prev_url = url_for('tickets.list_tickets', page=tickets.prev_num, **page_args) if tickets.has_prev else None
+        next_url = url_for('tickets.list_tickets', page=tickets.next_num, **page_args) if tickets.has_next else None
+    else:
+        # Keyset (seek) em (created_at, id): páginas profundas custam o mesmo que a primeira
+        tickets = keyset_paginate(query, Ticket.created_at, Ticket.id, cursor=request.args.get('cursor'), per_page=10)
+        prev_url = url_for('tickets.list_tickets', cursor=tickets.prev_cursor, **page_args) if tickets.has_prev else None
+        next_url = url_for('tickets.list_tickets', cursor=tickets.next_cursor, **page_args) if tickets.has_next else None
     
-    return render_template('tickets/list.html', tickets=tickets)
+    return render_template('tickets/list.html', tickets=tickets, prev_url=prev_url, next_url=next_url)
 
 @tickets_bp.route('/tickets/<int:id>')
 @login_required
 def view_ticket(id):
-    ticket = Ticket.query.get_or_404(id)
+    ticket = Ticket.query_for('detail').get_or_404(id)
     # Observer check
     is_observer = current_user in ticket.observers
     
@@ -177,62 +162,32 @@ def view_ticket(id):
         return redirect(url_for('tickets.list_tickets'))
     
     technicians = User.query.filter((User.role == 'admin') | (User.is_technician == True)).all()
-    used_items = TicketItem.query.filter_by(ticket_id=id).all()
-    
-    users = User.query.all()
-    users.sort(key=lambda u: (u.fullname or u.username).lower())
-    
-    available_items = []
-    if current_user.role == 'admin':
-        from app.models.settings import Item
-        available_items = Item.query.filter(Item.quantity > 0).order_by(Item.category, Item.name).all()
-    
-    # Prepare users for JSON serialization (needed for Alpine.js search)
-    users_json = []
-    for u in users:
-        users_json.append({
-            'id': u.id,
-            'username': u.username,
-            'fullname': u.fullname or u.username
-        })
+    used_items = TicketItem.query.options(joinedload(TicketItem.item)).filter_by(ticket_id=id).all()
+    comments = Comment.query.options(joinedload(Comment.author)).filter_by(ticket_id=id).order_by(Comment.created_at).all()
+    attachments = ticket.attachments.all()
     
     return render_template('tickets/view.html', 
                          ticket=ticket, 
                          technicians=technicians, 
-                         users=users,
-                         users_json=users_json,
                          used_items=used_items,
-                         available_items=available_items,
+                         comments=comments,
+                         attachments=attachments,
                          now=datetime.utcnow())
 
 
 @tickets_bp.route('/tickets/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_ticket(id):
-    ticket = Ticket.query.get_or_404(id)
+    ticket = Ticket.query_for('detail').get_or_404(id)
     if current_user.role != 'admin' and ticket.user_id != current_user.id:
         flash('Você não tem permissão para editar este chamado.', 'danger')
         return redirect(url_for('tickets.view_ticket', id=id))
 
     if request.method == 'POST':
         priority = request.form['priority']
-        # Recalculate SLA if priority changed
+        # Recalculate SLA if priority changed (a partir da abertura, para respeitar o prazo original)
         if ticket.priority != priority:
-             from app.models.settings import AppSettings
-             from datetime import timedelta
-             app_settings = AppSettings.query.first()
-             sla_hours = 24
-             if app_settings:
-                p_clean = priority.lower().replace('á','a').replace('é','e').replace('í','i').replace('ó','o').replace('ú','u')
-                if 'baixa' in p_clean: sla_hours = app_settings.sla_hours_baixa or 48
-                elif 'media' in p_clean: sla_hours = app_settings.sla_hours_media or 24
-                elif 'alta' in p_clean: sla_hours = app_settings.sla_hours_alta or 8
-                elif 'critica' in p_clean or 'urgente' in p_clean: sla_hours = app_settings.sla_hours_critica or 4
-             
-             # Calculate from CREATION date or NOW? Usually from creation, but if changed late?
-             # Let's keep it simple: update due date based on NOW if priority changes, OR recalculate from created_at
-             # Better: Recalculate from Created At to respect original timeline
-             ticket.due_at = ticket.created_at + timedelta(hours=sla_hours)
+            ticket.due_at = compute_due_at(priority, ticket.created_at)
 
         ticket.title = request.form['title']
         ticket.category = request.form['category']
@@ -272,24 +227,18 @@ def edit_ticket(id):
         flash('Chamado atualizado com sucesso!', 'success')
         return redirect(url_for('tickets.view_ticket', id=id))
 
-    # Get all users for selection
-    users = User.query.all()
-    users.sort(key=lambda u: (u.fullname or u.username).lower())
+    # Get all users for selection (diretório em cache no processo)
+    users = get_user_directory().users if current_user.role == 'admin' else []
+    if users and not any(u['id'] == ticket.user_id for u in users):
+        # Solicitante desativado: continua na lista para o chamado não trocar de dono ao salvar
+        author = ticket.author
+        users = [{'id': author.id, 'username': author.username, 'fullname': author.fullname or author.username}] + users
     
     categories = Category.query.all()
-    # Prepare users for JSON serialization (needed for Alpine.js search)
-    users_json = []
-    for u in users:
-        users_json.append({
-            'id': u.id,
-            'username': u.username,
-            'fullname': u.fullname or u.username
-        })
         
     return render_template('tickets/edit.html', 
                           ticket=ticket, 
                           users=users, 
-                          users_json=users_json,
                           categories=categories)
 
 
@@ -325,50 +274,29 @@ def resolve_ticket(id):
         flash('Apenas administradores podem resolver chamados.', 'danger')
         return redirect(url_for('tickets.view_ticket', id=id))
     
-    ticket = Ticket.query.get_or_404(id)
-    from app.models.settings import Item
+    ticket = Ticket.query_for('list').get_or_404(id)
     
     if request.method == 'POST':
         # Atualizar status
         ticket.status = 'Resolvido'
         ticket.resolved_at = datetime.utcnow()
         
-        # Processar itens usados
-        used_items = request.form.getlist('used_items[]')
-        quantities = request.form.getlist('quantities[]')
-        notes_list = request.form.getlist('notes[]')
-        
-        for i, item_id in enumerate(used_items):
-            if item_id and quantities[i]:
-                item = Item.query.get(int(item_id))
-                if item:
-                    quantity_used = int(quantities[i])
-                    
-                    # Verificar se há estoque suficiente
-                    if item.quantity >= quantity_used:
-                        # Criar registro de item usado
-                        ticket_item = TicketItem(
-                            ticket_id=ticket.id,
-                            item_id=int(item_id),
-                            quantity_used=quantity_used,
-                            notes=notes_list[i] if i < len(notes_list) else None
-                        )
-                        db.session.add(ticket_item)
-                        
-                        # Atualizar quantidade em estoque
-                        item.quantity -= quantity_used
-                        db.session.add(item)
-                    else:
-                        flash(f'Estoque insuficiente para o item "{item.name}". Disponível: {item.quantity}', 'warning')
+        # Processar itens usados (baixa de estoque em lote, atômica por item)
+        lines, failures = parse_consumption_lines(
+            request.form.getlist('used_items[]'),
+            request.form.getlist('quantities[]'),
+            request.form.getlist('notes[]')
+        )
+        _, stock_failures = consume_items(ticket.id, lines, user_id=current_user.id)
+        for failure in failures + stock_failures:
+            flash(failure.message, 'warning')
         
         db.session.commit()
         flash('Chamado resolvido com sucesso!', 'success')
         return redirect(url_for('tickets.view_ticket', id=id))
     
-    # GET request - mostrar formulário de resolução
-    available_items = Item.query.filter(Item.quantity > 0).order_by(Item.category, Item.name).all()
-    
-    return render_template('tickets/resolve.html', ticket=ticket, available_items=available_items)
+    # GET request - mostrar formulário de resolução (os itens são carregados sob demanda pela consulta do inventário)
+    return render_template('tickets/resolve.html', ticket=ticket)
 
 @tickets_bp.route('/tickets/<int:id>/comment', methods=['POST'])
 @login_required
@@ -450,19 +378,14 @@ def add_ticket_item(id):
     from app.models.settings import Item
     item = Item.query.get_or_404(item_id)
     
-    if item.quantity >= quantity:
-        ticket_item = TicketItem(
-            ticket_id=ticket.id,
-            item_id=item.id,
-            quantity_used=quantity,
-            notes=notes
-        )
-        item.quantity -= quantity
-        db.session.add(ticket_item)
+    recorded, failures = consume_items(ticket.id, [ConsumptionLine(item.id, quantity, notes)], user_id=current_user.id)
+    if recorded:
         db.session.commit()
         flash(f'Item "{item.name}" adicionado ao chamado.', 'success')
     else:
-        flash(f'Estoque insuficiente para "{item.name}".', 'error')
+        db.session.rollback()
+        for failure in failures:
+            flash(failure.message, 'error')
         
     return redirect(url_for('tickets.view_ticket', id=id))
 
@@ -481,6 +404,7 @@ def remove_ticket_item(item_id):
     item = Item.query.get(ticket_item.item_id)
     if item:
         item.quantity += ticket_item.quantity_used
+        set_movement_context(item, MOVEMENT_TICKET_RETURN, ticket_id=ticket_id, user_id=current_user.id)
         
     db.session.delete(ticket_item)
     db.session.commit()
@@ -524,7 +448,7 @@ def add_observer(id):
         flash('Apenas administradores podem gerenciar observadores.', 'danger')
         return redirect(url_for('tickets.view_ticket', id=id))
         
-    ticket = Ticket.query.get_or_404(id)
+    ticket = Ticket.query_for('detail').get_or_404(id)
     user_id = request.form.get('user_id')
     if user_id:
         user = User.query.get(user_id)
@@ -541,7 +465,7 @@ def remove_observer(id, user_id):
         flash('Apenas administradores podem gerenciar observadores.', 'danger')
         return redirect(url_for('tickets.view_ticket', id=id))
         
-    ticket = Ticket.query.get_or_404(id)
+    ticket = Ticket.query_for('detail').get_or_404(id)
     user = User.query.get_or_404(user_id)
     if user in ticket.observers:
         ticket.observers.remove(user)
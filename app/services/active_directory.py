@@ -0,0 +1,350 @@
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from datetime import datetime
+import ldap3
+from flask import current_app, has_request_context
+from ldap3.utils.conv import escape_filter_chars
+from werkzeug.security import generate_password_hash
+from app.extensions import db
+from app.models.user import User
+from app.services.cache import bump_cache_version
+from app.services.directory import CACHE_NAME as USERS_CACHE_NAME
+
+
+def get_ad_connection(app_settings):
+    """Helper function to create LDAP connection to AD"""
+    if not app_settings or not app_settings.ad_server:
+        raise ValueError('Servidor AD não configurado')
+    
+    # Criar servidor LDAP
+    server = ldap3.Server(app_settings.ad_server, get_info=ldap3.ALL)
+    
+    # Preparar credenciais de bind
+    user = None
+    password = None
+    authentication = ldap3.ANONYMOUS
+    
+    # Se usuário foi fornecido, preparar autenticação
+    if app_settings.ad_user_dn and app_settings.ad_user_dn.strip():
+        user = app_settings.ad_user_dn.strip()
+        password = app_settings.ad_user_password
+        
+        # Se não há senha salva ou senha está vazia, não usar autenticação
+        if not password or not str(password).strip():
+            # Se usuário foi fornecido mas sem senha, usar conexão anônima
+            user = None
+            authentication = ldap3.ANONYMOUS
+        else:
+            password = str(password).strip()
+            authentication = ldap3.SIMPLE
+            
+            # Se o usuário está apenas como username (sem @ e sem DN), tentar construir UPN
+            if '@' not in user and ',' not in user and app_settings.ad_domain:
+                # Construir formato UPN automaticamente
+                user = f'{user}@{app_settings.ad_domain}'
+    
+    # Criar conexão
+    conn = ldap3.Connection(
+        server,
+        user=user,
+        password=password if password else None,
+        authentication=authentication,
+        auto_bind=True,
+        raise_exceptions=False
+    )
+    
+    # Verificar se a conexão foi bem-sucedida
+    if not conn.bound:
+        error_msg = conn.result.get('description', 'Erro desconhecido')
+        error_code = conn.result.get('result', '')
+        
+        # Mensagens de erro mais amigáveis
+        if 'invalidCredentials' in str(error_msg) or error_code == 49:
+            if user and password:
+                # Tentar formatos alternativos se ainda não tentamos
+                if '@' in user:
+                    # Já tentamos UPN, tentar DN se possível
+                    suggested_format = f'CN={user.split("@")[0]},CN=Users,{app_settings.ad_base_dn or ""}'
+                else:
+                    # Tentar UPN se tiver domínio
+                    if app_settings.ad_domain:
+                        suggested_format = f'{user}@{app_settings.ad_domain}'
+                    else:
+                        suggested_format = f'CN={user},CN=Users,DC=...'
+                
+                raise ConnectionError(
+                    f'Credenciais inválidas. Verifique:\n'
+                    f'- Usuário: {user}\n'
+                    f'- Se a senha está correta\n'
+                    f'- Se a conta não está bloqueada ou desabilitada\n'
+                    f'- Tente usar formato UPN: {suggested_format if "@" not in user else "ou formato DN completo"}'
+                )
+            elif user and not password:
+                raise ConnectionError(
+                    'Usuário fornecido mas senha está vazia. '
+                    'Forneça a senha ou deixe ambos vazios para conexão anônima.'
+                )
+            else:
+                raise ConnectionError('Falha na autenticação. O servidor pode não permitir conexão anônima.')
+        else:
+            conn.unbind()
+            raise ConnectionError(f'Falha ao conectar ao AD: {error_msg} (código: {error_code})')
+    
+    return conn
+
+AD_PAGE_SIZE = 500  # Entradas por página no controle de paginação do LDAP (RFC 2696)
+
+# Só os atributos usados para montar o usuário (a busca não traz o objeto inteiro)
+AD_USER_ATTRIBUTES = ['sAMAccountName', 'mail', 'cn', 'displayName', 'userPrincipalName', 'givenName', 'sn',
+                      'userAccountControl']
+
+# Pessoas com conta habilitada e que não sejam contas de computador
+# !(sAMAccountName=*$) exclui contas de máquina via LDAP
+AD_ACTIVE_USER_FILTER = '(&(objectCategory=person)(objectClass=user)(!(userAccountControl:1.2.840.113556.1.4.803:=2))(!(sAMAccountName=*$)))'
+
+
+def get_ad_base_dn(app_settings):
+    # Priorizar Base DN configurado pelo usuário
+    base_dn = app_settings.ad_base_dn or ''
+
+    # Se não houver Base DN, tentar construir a partir do domínio
+    if not base_dn and app_settings.ad_domain:
+        base_dn = ','.join([f'DC={part}' for part in app_settings.ad_domain.split('.')])
+
+    if not base_dn:
+        raise ValueError('Base DN não configurado. Por favor, configure o Base DN ou o Domínio nas configurações do AD.')
+    return base_dn
+
+
+def ad_attribute(attributes, name):
+    """Valor simples de um atributo (o ldap3 devolve lista quando não conhece o schema); None se vazio"""
+    value = attributes.get(name)
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else None
+    if value is None or value == '':
+        return None
+    return str(value)
+
+
+def ad_account_disabled(attributes):
+    # No AD, o bit 2 (valor 2) do userAccountControl (ACCOUNTDISABLE) indica conta desativada
+    return bool(int(ad_attribute(attributes, 'userAccountControl') or 0) & 2)
+
+
+def ad_entry_to_user(attributes, dn, app_settings):
+    """Converte os atributos de uma entrada do AD no dict de usuário; None para contas ignoradas"""
+    username = ad_attribute(attributes, 'sAMAccountName')
+
+    # IGNORAR se não houver username ou se for conta de máquina (termina com $) ou contiver $
+    if not username or '$' in username:
+        return None
+
+    email = ad_attribute(attributes, 'mail')
+    first_name = ad_attribute(attributes, 'givenName') or ''
+    last_name = ad_attribute(attributes, 'sn') or ''
+
+    if ad_account_disabled(attributes):
+        return None
+
+    full_name = f'{first_name} {last_name}'.strip()
+    if not full_name:
+        full_name = ad_attribute(attributes, 'displayName') or ad_attribute(attributes, 'cn') or username
+
+    upn = ad_attribute(attributes, 'userPrincipalName')
+
+    if not email and upn:
+        email = upn
+
+    if not email:
+        if app_settings.ad_domain:
+            email = f'{username}@{app_settings.ad_domain}'
+        else:
+            email = f'{username}@local'
+
+    return {
+        'username': username,
+        'email': email,
+        'display_name': full_name,
+        'first_name': first_name,
+        'last_name': last_name,
+        'dn': dn or ''
+    }
+
+
+def paged_ad_search(conn, base_dn, search_filter, attributes, page_size=AD_PAGE_SIZE):
+    """Gerador sobre a busca paginada do ldap3: (dn, atributos) de cada entrada, página a página.
+
+    Sem size_limit: diretórios grandes vêm inteiros, com no máximo uma página em memória.
+    """
+    entries = conn.extend.standard.paged_search(
+        search_base=base_dn,
+        search_filter=search_filter,
+        search_scope=ldap3.SUBTREE,
+        attributes=attributes,
+        paged_size=page_size,
+        generator=True
+    )
+    for entry in entries:
+        # Referências (searchResRef) e outras respostas não são usuários
+        if entry.get('type') == 'searchResEntry':
+            yield entry.get('dn'), entry.get('attributes') or {}
+
+    # Com raise_exceptions=False o ldap3 encerra a paginação em silêncio: confere o resultado final
+    result = conn.result or {}
+    if result.get('result') not in (None, 0):
+        error_msg = result.get('description', 'Erro desconhecido na busca')
+        raise ConnectionError(f'Falha ao buscar usuários: {error_msg} (código: {result.get("result")})')
+
+
+def iter_ad_users(app_settings, search_term=None, page_size=AD_PAGE_SIZE):
+    """Busca usuários ativos no Active Directory em streaming (um dict por usuário).
+
+    A conexão fica aberta enquanto o gerador é consumido e é encerrada ao final.
+    """
+    conn = get_ad_connection(app_settings)
+    try:
+        base_dn = get_ad_base_dn(app_settings)
+
+        if search_term:
+            term = escape_filter_chars(search_term)
+            search_filter = f'(&{AD_ACTIVE_USER_FILTER}(|(displayName=*{term}*)(sAMAccountName=*{term}*)(mail=*{term}*)))'
+        else:
+            search_filter = AD_ACTIVE_USER_FILTER
+
+        for dn, attributes in paged_ad_search(conn, base_dn, search_filter, AD_USER_ATTRIBUTES, page_size):
+            try:
+                user = ad_entry_to_user(attributes, dn, app_settings)
+            except (TypeError, ValueError):
+                continue
+            if user:
+                yield user
+    finally:
+        try:
+            conn.unbind()
+        except Exception:
+            pass
+
+
+AD_IMPORT_CHUNK_SIZE = 500
+HASH_POOL_MIN_PASSWORDS = 32  # Abaixo disso subir processos custa mais que gerar os hashes em série
+HASH_POOL_TASK_SIZE = 16  # Senhas enviadas a um processo por vez (menos ida e volta entre processos)
+
+
+def iter_chunks(iterable, size):
+    chunk = []
+    for value in iterable:
+        chunk.append(value)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+@contextmanager
+def password_hash_pool(workers=None):
+    """Pool de processos para gerar os hashes das senhas iniciais (scrypt/PBKDF2 é CPU puro).
+
+    workers padrão = AD_HASH_WORKERS da configuração (0 = nº de CPUs). Entrega None
+    (hash em série) com 1 worker, no executável congelado, onde subir processos
+    relançaria o próprio programa, e dentro de uma requisição (subir o pool custaria
+    mais que os hashes de uma tela).
+
+    Os processos sobem por spawn, nunca por fork: o worker web e o de tarefas têm
+    outras threads e conexões abertas, e um filho de fork herdaria travas presas
+    (logging, pool do SQLAlchemy). O filho só importa o werkzeug para gerar os hashes.
+    """
+    if workers is None:
+        workers = current_app.config.get('AD_HASH_WORKERS') or os.cpu_count() or 1
+    if workers <= 1 or getattr(sys, 'frozen', False) or has_request_context():
+        yield None
+        return
+
+    context = multiprocessing.get_context('spawn')
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    try:
+        yield executor
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def hash_passwords(passwords, executor=None):
+    """Hashes na mesma ordem das senhas; distribui no pool quando há volume, senão em série"""
+    passwords = list(passwords)
+    if executor is None or len(passwords) < HASH_POOL_MIN_PASSWORDS:
+        return [generate_password_hash(password) for password in passwords]
+    try:
+        return list(executor.map(generate_password_hash, passwords, chunksize=HASH_POOL_TASK_SIZE))
+    except (BrokenProcessPool, OSError):
+        # Processo filho morto ou sem recursos para criar processos: conclui em série
+        return [generate_password_hash(password) for password in passwords]
+
+
+def import_ad_users(ad_users, progress=None, executor=None, chunk_size=AD_IMPORT_CHUNK_SIZE):
+    """Cria os usuários do AD que ainda não existem (por username ou e-mail); senha inicial = username.
+
+    Por lote: duas consultas IN (usernames e e-mails já cadastrados), hashes no
+    pool de processos (executor, de password_hash_pool; None = em série) e um
+    bulk_insert_mappings. Retorna (importados, ignorados). O commit fica com quem chama.
+    """
+    ad_users = list(ad_users)
+    imported_count = 0
+    skipped_count = 0
+    now = datetime.utcnow()
+
+    for processed, chunk in enumerate(iter_chunks(ad_users, chunk_size), 1):
+        usernames = {user_data['username'] for user_data in chunk}
+        emails = {user_data['email'] for user_data in chunk}
+        taken_usernames = {row[0] for row in db.session.query(User.username).filter(User.username.in_(usernames))}
+        taken_emails = {row[0] for row in db.session.query(User.email).filter(User.email.in_(emails))}
+
+        new_users = []
+        for user_data in chunk:
+            username, email = user_data['username'], user_data['email']
+            if username in taken_usernames or email in taken_emails:
+                skipped_count += 1
+                continue
+            # Repetidos dentro do próprio resultado do AD contam como já existentes
+            taken_usernames.add(username)
+            taken_emails.add(email)
+            new_users.append(user_data)
+
+        if new_users:
+            password_hashes = hash_passwords([user_data['username'] for user_data in new_users], executor)
+            db.session.bulk_insert_mappings(User, [{
+                'username': user_data['username'], 'email': user_data['email'],
+                'fullname': user_data['display_name'], 'password_hash': password_hash, 'role': 'user',
+                'is_technician': False, 'active': True, 'ad_dn': user_data.get('dn') or None, 'created_at': now,
+            } for user_data, password_hash in zip(new_users, password_hashes)])
+            # bulk_insert_mappings não dispara os eventos do ORM: invalida o diretório de usuários aqui
+            bump_cache_version(db.session.connection(), USERS_CACHE_NAME)
+            imported_count += len(new_users)
+
+        if progress:
+            progress(min(processed * chunk_size, len(ad_users)), len(ad_users))
+
+    return imported_count, skipped_count
+
+
+def import_ad_user_stream(ad_users, chunk_size=AD_IMPORT_CHUNK_SIZE, progress=None):
+    """Importa um fluxo de usuários do AD (ex: iter_ad_users) em lotes, com commit por lote.
+
+    Só um lote fica em memória por vez, então o tamanho do diretório não importa.
+    progress, se informado, recebe (usuários processados, None). Retorna (importados, ignorados).
+    """
+    imported_count = skipped_count = processed = 0
+    # Um único pool para o fluxo inteiro: os processos sobem uma vez, não a cada lote
+    with password_hash_pool() as executor:
+        for chunk in iter_chunks(ad_users, chunk_size):
+            imported, skipped = import_ad_users(chunk, executor=executor, chunk_size=chunk_size)
+            db.session.commit()
+            imported_count += imported
+            skipped_count += skipped
+            processed += len(chunk)
+            if progress:
+                progress(processed, None)
+    return imported_count, skipped_count
@@ -0,0 +1,112 @@
+import secrets
+from datetime import datetime, timedelta
+from sqlalchemy import insert, exists, or_
+from app.extensions import db
+from app.models.ad_search import AdSearch, AdSearchEntry
+from app.models.user import User
+
+AD_SEARCH_TTL = timedelta(minutes=30)
+AD_SEARCH_PER_PAGE = 50
+INSERT_CHUNK_SIZE = 500
+
+
+def purge_expired_ad_searches(now=None):
+    """Apaga as buscas vencidas e suas entradas; retorna quantas buscas foram removidas"""
+    now = now or datetime.utcnow()
+    expired = [row.id for row in db.session.query(AdSearch.id).filter(AdSearch.expires_at <= now)]
+    if expired:
+        delete_ad_searches(expired)
+    return len(expired)
+
+
+def delete_ad_searches(search_ids):
+    AdSearchEntry.query.filter(AdSearchEntry.search_id.in_(search_ids)).delete(synchronize_session=False)
+    AdSearch.query.filter(AdSearch.id.in_(search_ids)).delete(synchronize_session=False)
+
+
+def create_ad_search(ad_users, user_id=None, search_term=None, ttl=AD_SEARCH_TTL):
+    """Guarda o resultado de uma busca no AD e retorna o AdSearch (o id é o handle do cliente).
+
+    ad_users pode ser qualquer iterável (inclusive um gerador): as entradas são
+    gravadas em lotes de INSERT_CHUNK_SIZE. Também remove as buscas vencidas.
+    O commit fica com quem chama.
+    """
+    purge_expired_ad_searches()
+    now = datetime.utcnow()
+    search = AdSearch(id=secrets.token_urlsafe(9), user_id=user_id, search_term=search_term,
+                      created_at=now, expires_at=now + ttl)
+    db.session.add(search)
+    db.session.flush()
+
+    batch = []
+    total = 0
+    for position, user in enumerate(ad_users):
+        batch.append({
+            'search_id': search.id, 'position': position, 'username': user['username'],
+            'email': user.get('email'), 'display_name': user.get('display_name'),
+            'first_name': user.get('first_name'), 'last_name': user.get('last_name'), 'dn': user.get('dn'),
+        })
+        if len(batch) >= INSERT_CHUNK_SIZE:
+            db.session.execute(insert(AdSearchEntry), batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(AdSearchEntry), batch)
+        total += len(batch)
+
+    search.total = total
+    return search
+
+
+def get_ad_search(handle, user_id=None):
+    """Busca ainda válida pelo handle (e do mesmo usuário, se informado); None se venceu ou não existe"""
+    if not handle:
+        return None
+    query = AdSearch.query.filter(AdSearch.id == handle, AdSearch.expires_at > datetime.utcnow())
+    if user_id is not None:
+        query = query.filter(AdSearch.user_id == user_id)
+    return query.first()
+
+
+def ad_search_page(search, page=1, per_page=AD_SEARCH_PER_PAGE):
+    """Uma página de entradas já marcadas com 'exists' (username ou e-mail cadastrado) em uma única consulta.
+
+    Retorna (lista de dicts, há próxima página).
+    """
+    already_registered = exists().where(or_(User.username == AdSearchEntry.username,
+                                            User.email == AdSearchEntry.email))
+    rows = db.session.query(AdSearchEntry, already_registered.label('exists')) \
+        .filter(AdSearchEntry.search_id == search.id) \
+        .order_by(AdSearchEntry.position) \
+        .offset((page - 1) * per_page).limit(per_page + 1).all()
+
+    entries = [dict(entry.to_dict(), exists=bool(registered)) for entry, registered in rows[:per_page]]
+    return entries, len(rows) > per_page
+
+
+def find_ad_search_entry(search, username):
+    return search.entries.filter(AdSearchEntry.username == username).first()
+
+
+def remove_ad_search_entry(search, entry):
+    db.session.delete(entry)
+    search.total = max((search.total or 0) - 1, 0)
+
+
+def iter_ad_search_entries(search):
+    """Todas as entradas como dicts, lidas em lotes por position.
+
+    Cada lote é uma consulta nova (paginação por chave), então quem consome pode
+    fazer commit no meio da iteração.
+    """
+    search_id = search.id
+    last_position = -1
+    while True:
+        entries = AdSearchEntry.query.filter(AdSearchEntry.search_id == search_id,
+                                             AdSearchEntry.position > last_position) \
+            .order_by(AdSearchEntry.position).limit(INSERT_CHUNK_SIZE).all()
+        if not entries:
+            return
+        for entry in entries:
+            yield entry.to_dict()
+        last_position = entries[-1].position
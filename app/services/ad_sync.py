@@ -0,0 +1,176 @@
+import json
+from datetime import datetime
+from typing import NamedTuple, Optional
+from app.extensions import db
+from app.models.settings import AppSettings
+from app.models.user import User
+from app.services.active_directory import (
+    AD_USER_ATTRIBUTES, get_ad_connection, get_ad_base_dn, paged_ad_search, ad_entry_to_user,
+    ad_account_disabled, ad_attribute, iter_chunks, password_hash_pool, hash_passwords,
+)
+from app.services.cache import bump_cache_version
+from app.services.directory import CACHE_NAME as USERS_CACHE_NAME
+
+AD_SYNC_CHUNK_SIZE = 500
+AD_SYNC_ATTRIBUTES = AD_USER_ATTRIBUTES + ['uSNChanged']
+
+# Ao contrário de AD_ACTIVE_USER_FILTER, inclui as contas desabilitadas: é assim que a desativação chega
+AD_SYNC_FILTER = '(&(objectCategory=person)(objectClass=user)(!(sAMAccountName=*$)){since})'
+
+
+class AdSyncResult(NamedTuple):
+    created: int = 0
+    updated: int = 0
+    disabled: int = 0
+    skipped: int = 0
+    server: Optional[str] = None
+    since: Optional[int] = None  # Marca d'água usada (None = leitura completa)
+    watermark: Optional[int] = None  # Nova marca d'água gravada
+
+    def __add__(self, other):
+        return self._replace(created=self.created + other.created, updated=self.updated + other.updated,
+                             disabled=self.disabled + other.disabled, skipped=self.skipped + other.skipped)
+
+
+def get_ad_watermarks(app_settings):
+    """{servidor: maior uSNChanged sincronizado}; vazio se nunca sincronizou"""
+    try:
+        return json.loads(app_settings.ad_sync_watermarks or '{}')
+    except ValueError:
+        return {}
+
+
+def ad_server_key(conn, app_settings):
+    """Identifica o controlador de domínio: o uSNChanged é local a cada DC.
+
+    Usa o dnsHostName do rootDSE (o ad_server pode apontar para vários DCs
+    atrás de um mesmo nome) e cai no ad_server configurado se não houver.
+    """
+    info = conn.server.info
+    host = ad_attribute(info.other, 'dnsHostName') if info and info.other else None
+    return (host or app_settings.ad_server).lower()
+
+
+def apply_ad_changes(entries, app_settings, executor=None):
+    """Aplica um lote de entradas do AD [(dn, atributos)] aos usuários locais em operações em lote.
+
+    - conta habilitada e sem usuário local: cria (senha inicial = username);
+    - conta habilitada com usuário local: atualiza nome, e-mail e DN e reativa;
+    - conta desabilitada com usuário local ativo: desativa.
+    O usuário local é encontrado pelo username (sAMAccountName). E-mail já usado
+    por outro usuário não é aplicado (cria é ignorado, atualização mantém o atual).
+    Os hashes das senhas iniciais vão para o pool de processos (executor), se houver.
+    O commit fica com quem chama. Retorna AdSyncResult com as contagens.
+    """
+    changes = {}
+    skipped = 0
+    for dn, attributes in entries:
+        username = ad_attribute(attributes, 'sAMAccountName')
+        if not username or '$' in username:
+            skipped += 1
+            continue
+        if ad_account_disabled(attributes):
+            changes[username] = None
+        else:
+            changes[username] = ad_entry_to_user(attributes, dn, app_settings)
+    if not changes:
+        return AdSyncResult(skipped=skipped)
+
+    existing = {row.username: row for row in db.session.query(
+        User.id, User.username, User.email, User.fullname, User.active, User.ad_dn
+    ).filter(User.username.in_(list(changes)))}
+
+    wanted_emails = {data['email'] for data in changes.values() if data}
+    email_owner = dict(db.session.query(User.email, User.id).filter(User.email.in_(list(wanted_emails)))) \
+        if wanted_emails else {}
+
+    creates, updates, disables = [], [], []
+    now = datetime.utcnow()
+    for username, data in changes.items():
+        user = existing.get(username)
+        if data is None:
+            if user and user.active:
+                disables.append({'id': user.id, 'active': False})
+            continue
+
+        owner = email_owner.get(data['email'])
+        if user is None:
+            if owner is not None:
+                skipped += 1
+                continue
+            creates.append({
+                'username': username, 'email': data['email'], 'fullname': data['display_name'],
+                'role': 'user', 'is_technician': False,
+                'active': True, 'ad_dn': data['dn'] or None, 'created_at': now,
+            })
+            email_owner[data['email']] = username  # Reserva o e-mail dentro do lote
+            continue
+
+        values = {}
+        if data['display_name'] and data['display_name'] != user.fullname:
+            values['fullname'] = data['display_name']
+        if data['email'] != user.email and owner is None:
+            values['email'] = data['email']
+            email_owner[data['email']] = user.id
+        if (data['dn'] or None) != user.ad_dn:
+            values['ad_dn'] = data['dn'] or None
+        if not user.active:
+            values['active'] = True
+        if values:
+            updates.append(dict(values, id=user.id))
+
+    if creates:
+        for values, password_hash in zip(creates, hash_passwords([values['username'] for values in creates], executor)):
+            values['password_hash'] = password_hash
+        db.session.bulk_insert_mappings(User, creates)
+    if updates or disables:
+        db.session.bulk_update_mappings(User, updates + disables)
+    if creates or updates or disables:
+        # Operações em lote não disparam os eventos do ORM: invalida o diretório de usuários aqui
+        bump_cache_version(db.session.connection(), USERS_CACHE_NAME)
+
+    return AdSyncResult(created=len(creates), updated=len(updates), disabled=len(disables), skipped=skipped)
+
+
+def sync_ad_users(full=False, chunk_size=AD_SYNC_CHUNK_SIZE, progress=None):
+    """Sincronização incremental com o AD: só busca as entradas com uSNChanged acima da marca d'água.
+
+    A marca d'água é guardada por servidor em AppSettings.ad_sync_watermarks e
+    só avança depois que todos os lotes foram aplicados; se a execução falhar no
+    meio, a próxima repete as mesmas entradas (aplicar de novo não muda nada).
+    full=True ignora a marca d'água e relê o diretório inteiro. Contas excluídas
+    do AD não aparecem na busca e continuam como estão.
+    progress, se informado, recebe (entradas processadas, None).
+    """
+    app_settings = AppSettings.query.first()
+    conn = get_ad_connection(app_settings)
+    try:
+        base_dn = get_ad_base_dn(app_settings)
+        server = ad_server_key(conn, app_settings)
+        watermarks = get_ad_watermarks(app_settings)
+        since = None if full else watermarks.get(server)
+
+        search_filter = AD_SYNC_FILTER.format(since=f'(uSNChanged>={since + 1})' if since is not None else '')
+        entries = paged_ad_search(conn, base_dn, search_filter, AD_SYNC_ATTRIBUTES)
+
+        result = AdSyncResult()
+        highest = since or 0
+        processed = 0
+        with password_hash_pool() as executor:
+            for chunk in iter_chunks(entries, chunk_size):
+                highest = max([highest] + [int(ad_attribute(attributes, 'uSNChanged') or 0) for _, attributes in chunk])
+                result += apply_ad_changes(chunk, app_settings, executor)
+                db.session.commit()
+                processed += len(chunk)
+                if progress:
+                    progress(processed, None)
+    finally:
+        try:
+            conn.unbind()
+        except Exception:
+            pass
+
+    watermarks[server] = highest
+    app_settings.ad_sync_watermarks = json.dumps(watermarks, sort_keys=True)
+    db.session.commit()
+    return result._replace(server=server, since=since, watermark=highest)
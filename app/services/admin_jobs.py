@@ -0,0 +1,100 @@
+import os
+from datetime import datetime
+from flask import current_app
+from app.extensions import db
+from app.services.jobs import job_handler, job_storage_dir
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Tipo de tarefa -> rótulo exibido ao usuário
+JOB_LABELS = {
+    'inventory_import': 'Importação de estoque',
+    'ad_bulk_import': 'Importação em massa do AD',
+    'backup': 'Backup completo',
+    'stats_export': 'Relatório de chamados (Excel)',
+    'usage_export': 'Relatório de consumo de itens',
+}
+
+
+def _parse_date(value, end_of_day=False):
+    if not value:
+        return None
+    date = datetime.fromisoformat(value)
+    return date.replace(hour=23, minute=59, second=59) if end_of_day else date
+
+
+def _percent(ctx, label):
+    """Adapta (feito, total) dos serviços para ctx.progress; sem total conhecido fica em 50%"""
+    def report(done, total):
+        percent = done * 100 // total if total else 50
+        ctx.progress(min(percent, 99), f'{label}: {done}' + (f' de {total}' if total else ''))
+    return report
+
+
+@job_handler('inventory_import')
+def run_inventory_import(ctx, input_file, filename=None, dry_run=False):
+    from app.services.inventory_import import import_inventory_workbook
+
+    with open(ctx.path(input_file), 'rb') as fileobj:
+        report = import_inventory_workbook(fileobj, dry_run=dry_run, progress=_percent(ctx, 'Linha'),
+                                           user_id=ctx.user_id)
+    if dry_run:
+        db.session.rollback()
+        message = f'Simulação: {report.created} novos, {report.updated} atualizados, {len(report.errors)} linha(s) com erro.'
+    else:
+        message = f'Sucesso! {report.updated} itens atualizados e {report.created} novos itens criados.'
+        if report.errors:
+            message += f' {len(report.errors)} linha(s) ignorada(s).'
+    return {'message': message, 'filename': filename, **report.to_dict()}
+
+
+@job_handler('ad_bulk_import')
+def run_ad_bulk_import(ctx):
+    from app.models.settings import get_app_settings
+    from app.services.active_directory import iter_ad_users, import_ad_user_stream
+
+    ctx.progress(5, 'Buscando usuários no AD...', force=True)
+    # Busca paginada consumida em streaming: cada lote é importado e gravado antes da próxima página
+    imported, skipped = import_ad_user_stream(iter_ad_users(get_app_settings()), progress=_percent(ctx, 'Usuário'))
+    if not imported and not skipped:
+        return {'message': 'Nenhum usuário ativo encontrado para importar.', 'imported': 0, 'skipped': 0}
+
+    return {'message': f'✅ SUCESSO! {imported} usuários importados. {skipped} já existiam ou foram ignorados.',
+            'imported': imported, 'skipped': skipped}
+
+
+@job_handler('backup')
+def run_backup(ctx):
+    from app.services.backup import write_backup_zip
+
+    root_dir = os.path.abspath(os.path.join(current_app.root_path, os.pardir))
+    filename = f"helpdesk_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    with open(ctx.path('backup.zip'), 'wb') as fileobj:
+        count = write_backup_zip(fileobj, os.path.join(root_dir, 'instance'), current_app.config['UPLOAD_FOLDER'],
+                                 exclude_dirs=[job_storage_dir()], progress=_percent(ctx, 'Arquivo'))
+    ctx.set_file('backup.zip', filename, 'application/zip')
+    return {'message': f'Backup gerado ({count} arquivo(s)).', 'files': count}
+
+
+@job_handler('stats_export')
+def run_stats_export(ctx, start_date=None, end_date=None):
+    from app.services.exports import write_stats_xlsx
+
+    with open(ctx.path('relatorio.xlsx'), 'wb') as fileobj:
+        write_stats_xlsx(fileobj, _parse_date(start_date), _parse_date(end_date, end_of_day=True),
+                         progress=_percent(ctx, 'Chamado'))
+    ctx.set_file('relatorio.xlsx', f"relatorio_helpdesk_{datetime.now().strftime('%Y%m%d')}.xlsx", XLSX_MIMETYPE)
+    return {'message': 'Relatório gerado.'}
+
+
+@job_handler('usage_export')
+def run_usage_export(ctx, start_date=None, end_date=None):
+    from app.services.exports import write_usage_xlsx
+
+    with open(ctx.path('consumo.xlsx'), 'wb') as fileobj:
+        count = write_usage_xlsx(fileobj, _parse_date(start_date), _parse_date(end_date, end_of_day=True),
+                                 progress=_percent(ctx, 'Registro'))
+    if not count:
+        return {'message': 'Nenhum registro encontrado para o período selecionado.', 'records': 0}
+    ctx.set_file('consumo.xlsx', f"relatorio_consumo_{datetime.now().strftime('%Y%m%d')}.xlsx", XLSX_MIMETYPE)
+    return {'message': f'Relatório gerado ({count} registro(s)).', 'records': count}
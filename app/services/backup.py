@@ -0,0 +1,32 @@
+import os
+import zipfile
+
+
+def write_backup_zip(fileobj, instance_path, uploads_path, exclude_dirs=(), progress=None):
+    """Compacta o banco (pasta instance) e os anexos no formato esperado pela restauração.
+
+    exclude_dirs: pastas dentro de instance que não entram no backup (ex: arquivos de tarefas).
+    progress, se informado, recebe (arquivos gravados, total). Retorna o nº de arquivos.
+    """
+    exclude_dirs = {os.path.abspath(path) for path in exclude_dirs}
+    files = []
+
+    # Adicionar banco de dados
+    if os.path.exists(instance_path):
+        for root, dirs, names in os.walk(instance_path):
+            dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) not in exclude_dirs]
+            for name in names:
+                files.append((os.path.join(root, name), os.path.join('instance', name)))
+
+    # Adicionar uploads
+    if os.path.exists(uploads_path):
+        for root, dirs, names in os.walk(uploads_path):
+            for name in names:
+                files.append((os.path.join(root, name), os.path.join('app/uploads', name)))
+
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for i, (file_path, arcname) in enumerate(files, 1):
+            zf.write(file_path, arcname)
+            if progress:
+                progress(i, len(files))
+    return len(files)
@@ -0,0 +1,28 @@
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.extensions import db
+from app.models.settings import CacheVersion
+
+
+def bump_cache_version(connection, name):
+    """Incrementa a versão de um cache na mesma transação da alteração (upsert atômico)"""
+    table = CacheVersion.__table__
+
+    if connection.dialect.name in ('postgresql', 'sqlite'):
+        insert = pg_insert if connection.dialect.name == 'postgresql' else sqlite_insert
+        stmt = insert(table).values(name=name, version=1)
+        stmt = stmt.on_conflict_do_update(index_elements=['name'], set_={'version': table.c.version + 1})
+        connection.execute(stmt)
+        return
+
+    # Fallback genérico: UPDATE e, se não existir, INSERT
+    result = connection.execute(
+        table.update().where(table.c.name == name).values(version=table.c.version + 1)
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(name=name, version=1))
+
+
+def get_cache_version(name):
+    """Versão atual do cache (0 se nunca foi incrementada)"""
+    return db.session.query(CacheVersion.version).filter_by(name=name).scalar() or 0
@@ -0,0 +1,76 @@
+import hashlib
+import json
+from sqlalchemy import event, inspect as sa_inspect
+from app.extensions import db
+from app.models.user import User
+from app.services.cache import bump_cache_version, get_cache_version
+
+CACHE_NAME = 'users'
+DIRECTORY_FIELDS = ('username', 'fullname', 'active')  # Campos que definem o que os seletores mostram; mudanças invalidam o cache
+
+# Cache do processo: (versão, UserDirectory). Substituído por inteiro a cada recarga.
+_directory = (None, None)
+
+
+class UserDirectory:
+    """Lista de usuários ativos (id, username, fullname) ordenada por nome, com índice para busca por prefixo"""
+
+    def __init__(self, version, users):
+        self.version = version
+        self.users = users
+        payload = json.dumps(users, sort_keys=True).encode()
+        self.etag = f'users-{version}-{hashlib.sha1(payload).hexdigest()[:12]}'
+        self._keys = [(_search_keys(u), u) for u in users]
+
+    def search(self, prefix, limit=None):
+        """Usuários cujo username ou alguma palavra do nome começa com o prefixo"""
+        prefix = (prefix or '').strip().lower()
+        if not prefix:
+            return self.users[:limit] if limit else list(self.users)
+        found = [u for keys, u in self._keys if any(k.startswith(prefix) for k in keys)]
+        return found[:limit] if limit else found
+
+
+def _search_keys(user):
+    fullname = (user['fullname'] or '').lower()
+    return [user['username'].lower(), fullname] + fullname.split()
+
+
+def _load_directory(version):
+    # Contas desativadas (ex: removidas do AD) não aparecem nos seletores
+    rows = db.session.query(User.id, User.username, User.fullname).filter(User.active.is_(True)).all()
+    users = [{'id': r.id, 'username': r.username, 'fullname': r.fullname or r.username} for r in rows]
+    users.sort(key=lambda u: u['fullname'].lower())
+    return UserDirectory(version, users)
+
+
+def get_user_directory():
+    """Diretório de usuários em cache no processo, recarregado só quando a versão no banco muda"""
+    global _directory
+    version = get_cache_version(CACHE_NAME)
+    if _directory[0] != version:
+        _directory = (version, _load_directory(version))
+    return _directory[1]
+
+
+def invalidate_user_directory():
+    """Força a recarga do diretório (ex: após restaurar o banco a partir de um backup)"""
+    global _directory
+    _directory = (None, None)
+    with db.engine.begin() as connection:
+        bump_cache_version(connection, CACHE_NAME)
+
+
+# --- Invalidação: qualquer alteração visível em User incrementa a versão ---
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_delete')
+def _directory_changed(mapper, connection, target):
+    bump_cache_version(connection, CACHE_NAME)
+
+
+@event.listens_for(User, 'after_update')
+def _directory_after_update(mapper, connection, target):
+    state = sa_inspect(target)
+    if any(state.attrs[attr].history.has_changes() for attr in DIRECTORY_FIELDS):
+        bump_cache_version(connection, CACHE_NAME)
@@ -0,0 +1,281 @@
+import csv
+import io
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+from openpyxl.utils import get_column_letter
+from sqlalchemy import func
+from sqlalchemy.orm import aliased
+from app.extensions import db
+from app.models.ticket import Ticket, TicketItem
+from app.models.settings import Item
+from app.models.user import User
+
+EXPORT_BATCH_SIZE = 1000  # Linhas lidas do banco por lote (yield_per)
+WIDTH_SAMPLE_SIZE = 200  # Linhas usadas para estimar a largura das colunas
+
+STATS_HEADERS = ['Data', 'ID', 'Categoria', 'Título', 'Status', 'Prioridade', 'Autor', 'Responsável', 'Tempo Resolução']
+
+
+def _stats_export_query(start_date=None, end_date=None):
+    """Consulta apenas as colunas necessárias, já com autor e responsável (sem lazy load por linha)"""
+    author = aliased(User)
+    assignee = aliased(User)
+    query = db.session.query(
+        Ticket.id, Ticket.created_at, Ticket.category, Ticket.title, Ticket.status,
+        Ticket.priority, Ticket.resolved_at,
+        author.fullname.label('author_fullname'), author.username.label('author_username'),
+        assignee.fullname.label('assignee_fullname')
+    ).join(author, Ticket.user_id == author.id).outerjoin(assignee, Ticket.assigned_to_id == assignee.id)
+
+    if start_date:
+        query = query.filter(Ticket.created_at >= start_date)
+    if end_date:
+        query = query.filter(Ticket.created_at <= end_date)
+    return query.order_by(Ticket.created_at.desc(), Ticket.id.desc())
+
+
+def _stats_row(row):
+    # Duration calculation
+    duration = "-"
+    if row.resolved_at:
+        hours = (row.resolved_at - row.created_at).total_seconds() / 3600
+        duration = f"{hours:.1f}h"
+
+    return [
+        row.created_at.strftime('%d/%m/%Y %H:%M'),
+        f"#{row.id}",
+        row.category,
+        row.title,
+        row.status,
+        row.priority,
+        row.author_fullname or row.author_username,
+        row.assignee_fullname or "Não atribuído",
+        duration
+    ]
+
+
+def write_stats_xlsx(fileobj, start_date=None, end_date=None, progress=None):
+    """Gera o relatório detalhado em modo write-only (memória limitada, independente do nº de linhas).
+
+    progress, se informado, recebe (linhas escritas, total).
+    """
+    query = _stats_export_query(start_date, end_date)
+    total = query.order_by(None).count() if progress else None
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Relatório Detalhado")
+
+    # Largura das colunas estimada por amostra (em write-only precisa ser definida antes das linhas)
+    widths = [len(h) for h in STATS_HEADERS]
+    for row in query.limit(WIDTH_SAMPLE_SIZE):
+        for i, value in enumerate(_stats_row(row)):
+            widths[i] = max(widths[i], len(str(value)))
+    for i, width in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(i)].width = min(width + 2, 50)
+
+    # Styling
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="2563EB", end_color="2563EB", fill_type="solid")
+    month_fill = PatternFill(start_color="F1F5F9", end_color="F1F5F9", fill_type="solid")
+    month_font = Font(bold=True, color="0F172A")
+    center_aligned = Alignment(horizontal="center")
+    month_aligned = Alignment(horizontal="left", indent=1)
+    border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+
+    def styled(value, font=None, fill=None, alignment=center_aligned):
+        cell = WriteOnlyCell(ws, value=value)
+        if font: cell.font = font
+        if fill: cell.fill = fill
+        cell.alignment = alignment
+        cell.border = border
+        return cell
+
+    ws.append([styled(h, header_font, header_fill) for h in STATS_HEADERS])
+
+    current_month_year = None
+    for i, row in enumerate(query.yield_per(EXPORT_BATCH_SIZE), 1):
+        if progress and i % EXPORT_BATCH_SIZE == 0:
+            progress(i, total)
+        ticket_month_year = row.created_at.strftime('%m/%Y')
+
+        # Add month separator
+        if ticket_month_year != current_month_year:
+            separator = [styled(f"MÊS: {ticket_month_year}", month_font, month_fill, month_aligned)]
+            separator += [styled(None, fill=month_fill) for _ in STATS_HEADERS[1:]]
+            ws.append(separator)
+            current_month_year = ticket_month_year
+
+        ws.append([styled(value) for value in _stats_row(row)])
+
+    wb.save(fileobj)
+
+
+def iter_stats_csv(start_date=None, end_date=None):
+    """Gera o relatório detalhado em CSV, enviando um bloco por lote do banco"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+
+    def flush():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return data
+
+    buffer.write('\ufeff')  # BOM para o Excel reconhecer UTF-8
+    writer.writerow(STATS_HEADERS)
+
+    for i, row in enumerate(_stats_export_query(start_date, end_date).yield_per(EXPORT_BATCH_SIZE), 1):
+        writer.writerow(_stats_row(row))
+        if i % EXPORT_BATCH_SIZE == 0:
+            yield flush()
+
+    yield flush()
+
+
+USAGE_HEADERS = [
+    'Data', 'Item', 'Categoria', 'Quantidade', 'Custo Unitário (R$)',
+    'Custo Total (R$)', 'Solicitante', 'Username', 'Chamado', 'Notas'
+]
+
+
+def supports_window_functions(connection):
+    """SQLite só tem funções de janela a partir da 3.25; Postgres e demais bancos suportados já têm"""
+    if connection.dialect.name == 'sqlite':
+        return connection.dialect.dbapi.sqlite_version_info >= (3, 25, 0)
+    return True
+
+
+def _usage_export_query(start_date=None, end_date=None, with_subtotals=True):
+    """Linhas de consumo só com as colunas do relatório, agrupadas por item e da mais recente para a mais antiga.
+
+    Com with_subtotals, cada linha traz também (via funções de janela) o total
+    do item e se é a última do grupo, para o subtotal ser escrito sem
+    acumular nada em Python.
+    """
+    cost = TicketItem.quantity_used * Item.unit_cost
+    columns = [
+        TicketItem.used_at, TicketItem.quantity_used, TicketItem.notes,
+        Item.id.label('item_id'), Item.name.label('item_name'), Item.category.label('item_category'), Item.unit_cost,
+        cost.label('cost'),
+        User.fullname.label('user_fullname'), User.username.label('user_username'),
+        Ticket.id.label('ticket_id'), Ticket.title.label('ticket_title'),
+    ]
+    if with_subtotals:
+        by_item = {'partition_by': TicketItem.item_id}
+        columns += [
+            func.sum(TicketItem.quantity_used).over(**by_item).label('item_quantity'),
+            func.sum(cost).over(**by_item).label('item_cost'),
+            func.row_number().over(order_by=(TicketItem.used_at.desc(), TicketItem.id.desc()), **by_item).label('item_position'),
+            func.count().over(**by_item).label('item_rows'),
+        ]
+
+    query = db.session.query(*columns).\
+        join(Ticket, TicketItem.ticket_id == Ticket.id).\
+        join(User, Ticket.user_id == User.id).\
+        join(Item, TicketItem.item_id == Item.id)
+
+    if start_date:
+        query = query.filter(TicketItem.used_at >= start_date)
+    if end_date:
+        query = query.filter(TicketItem.used_at <= end_date)
+    return query.order_by(Item.name, Item.id, TicketItem.used_at.desc(), TicketItem.id.desc())
+
+
+def _usage_subtotals(start_date=None, end_date=None):
+    """Fallback sem funções de janela: {item_id: (quantidade, custo)} em um GROUP BY (uma linha por item)"""
+    query = db.session.query(
+        TicketItem.item_id, func.sum(TicketItem.quantity_used), func.sum(TicketItem.quantity_used * Item.unit_cost)
+    ).join(Item, TicketItem.item_id == Item.id).join(Ticket, TicketItem.ticket_id == Ticket.id)
+    if start_date:
+        query = query.filter(TicketItem.used_at >= start_date)
+    if end_date:
+        query = query.filter(TicketItem.used_at <= end_date)
+    return {item_id: (quantity, cost) for item_id, quantity, cost in query.group_by(TicketItem.item_id)}
+
+
+def _usage_row(row):
+    return [
+        row.used_at.strftime('%d/%m/%Y %H:%M'),
+        row.item_name,
+        row.item_category,
+        row.quantity_used,
+        row.unit_cost,
+        row.cost,
+        row.user_fullname or row.user_username,
+        row.user_username,
+        f"#{row.ticket_id} - {row.ticket_title}",
+        row.notes or ''
+    ]
+
+
+def write_usage_xlsx(fileobj, start_date=None, end_date=None, progress=None):
+    """Relatório de consumo de itens com subtotal por item; retorna o nº de registros (0 = nada gravado).
+
+    Subtotais calculados no banco e detalhes lidos em lotes (yield_per) direto
+    para um workbook write-only: a memória não cresce com o histórico de consumo.
+    """
+    with_subtotals = supports_window_functions(db.session.connection())
+    query = _usage_export_query(start_date, end_date, with_subtotals)
+
+    sample = query.limit(WIDTH_SAMPLE_SIZE).all()
+    if not sample:
+        return 0
+    total = _usage_export_query(start_date, end_date, with_subtotals=False).order_by(None).count() if progress else None
+    subtotals = None if with_subtotals else _usage_subtotals(start_date, end_date)
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Consumo de Itens")
+
+    # Largura das colunas estimada por amostra (em write-only precisa ser definida antes das linhas)
+    widths = [len(h) for h in USAGE_HEADERS]
+    for row in sample:
+        for i, value in enumerate(_usage_row(row)):
+            widths[i] = max(widths[i], len(str(value)))
+    for i, width in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(i)].width = min(width + 4, 60)
+
+    # Format Headers
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="C0504D", end_color="C0504D", fill_type="solid")
+    subtotal_font = Font(bold=True)
+    subtotal_fill = PatternFill(start_color="F2DCDB", end_color="F2DCDB", fill_type="solid")
+
+    def header_cell(value):
+        cell = WriteOnlyCell(ws, value=value)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = Alignment(horizontal='center')
+        return cell
+
+    def subtotal_cell(value=None):
+        cell = WriteOnlyCell(ws, value=value)
+        cell.font = subtotal_font
+        cell.fill = subtotal_fill
+        return cell
+
+    def write_subtotal(item_name, quantity, cost):
+        values = ['---', f'TOTAL {item_name}', None, quantity, None, cost, None, None, None, 'Subtotal por item']
+        ws.append([subtotal_cell(value) for value in values])
+
+    ws.append([header_cell(h) for h in USAGE_HEADERS])
+
+    count = 0
+    previous = None
+    for row in query.yield_per(EXPORT_BATCH_SIZE):
+        count += 1
+        if progress and count % EXPORT_BATCH_SIZE == 0:
+            progress(count, total)
+
+        if subtotals is not None and previous is not None and previous.item_id != row.item_id:
+            write_subtotal(previous.item_name, *subtotals[previous.item_id])
+        ws.append(_usage_row(row))
+        if subtotals is None and row.item_position == row.item_rows:
+            write_subtotal(row.item_name, row.item_quantity, row.item_cost)
+        previous = row
+
+    if subtotals is not None and previous is not None:
+        write_subtotal(previous.item_name, *subtotals[previous.item_id])
+
+    wb.save(fileobj)
+    return count
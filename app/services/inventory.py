@@ -0,0 +1,115 @@
+from typing import NamedTuple
+from sqlalchemy import event, func, case, inspect as sa_inspect
+from app.extensions import db
+from app.models.settings import Item
+from app.services.cache import bump_cache_version, get_cache_version
+from app.services.item_search import search_items
+
+CATEGORIES_CACHE_NAME = 'item_categories'
+ITEMS_CACHE_NAME = 'items'  # Qualquer alteração em itens (inclusive saldo); versiona o ETag da consulta
+LOOKUP_PER_PAGE = 50
+
+# Cache do processo: (versão, [categorias]). Substituído por inteiro a cada recarga.
+_categories = (None, None)
+
+
+class InventoryTotals(NamedTuple):
+    count: int
+    value: float
+    low_stock: int
+
+
+def inventory_totals(query=None):
+    """Nº de itens, valor total e itens com estoque baixo em uma única consulta agregada.
+
+    query: Item.query já filtrado (os filtros da tela); sem ela, o inventário todo.
+    """
+    query = (query if query is not None else Item.query).order_by(None)
+    row = query.with_entities(
+        func.count(Item.id),
+        func.coalesce(func.sum(Item.total_value), 0.0),
+        func.coalesce(func.sum(case((Item.low_stock.is_(True), 1), else_=0)), 0),
+    ).one()
+    return InventoryTotals(row[0], float(row[1]), int(row[2]))
+
+
+def get_item_categories():
+    """Categorias distintas dos itens, em cache no processo até alguma categoria mudar"""
+    global _categories
+    version = get_cache_version(CATEGORIES_CACHE_NAME)
+    if _categories[0] != version:
+        rows = db.session.query(Item.category).distinct().order_by(Item.category).all()
+        _categories = (version, [row[0] for row in rows if row[0]])
+    return _categories[1]
+
+
+def get_items_version():
+    return get_cache_version(ITEMS_CACHE_NAME)
+
+
+def item_lookup(q='', category=None, page=1, per_page=LOOKUP_PER_PAGE, in_stock=True):
+    """Página de itens agrupados por categoria para os seletores de material.
+
+    Busca per_page + 1 linhas para saber se há próxima página sem um COUNT.
+    Retorna {'page', 'per_page', 'has_next', 'groups': [{'category', 'items'}]};
+    um grupo pode continuar na página seguinte.
+    """
+    query = db.session.query(Item.id, Item.name, Item.category, Item.quantity, Item.unit_cost, Item.location)
+    if in_stock:
+        query = query.filter(Item.quantity > 0)
+    if category:
+        query = query.filter(Item.category == category)
+    if q and q.strip():
+        query = search_items(query, q).order_by(None)
+
+    rows = query.order_by(Item.category, Item.name, Item.id) \
+        .offset((page - 1) * per_page).limit(per_page + 1).all()
+
+    groups = []
+    for row in rows[:per_page]:
+        if not groups or groups[-1]['category'] != row.category:
+            groups.append({'category': row.category, 'items': []})
+        groups[-1]['items'].append(row._asdict())
+    return {'page': page, 'per_page': per_page, 'has_next': len(rows) > per_page, 'groups': groups}
+
+
+def item_category_counts(in_stock=True):
+    """[(categoria, nº de itens)] em uma consulta agrupada, para o filtro dos seletores"""
+    query = db.session.query(Item.category, func.count(Item.id))
+    if in_stock:
+        query = query.filter(Item.quantity > 0)
+    return query.group_by(Item.category).order_by(Item.category).all()
+
+
+def notify_stock_changed(connection):
+    """Para baixas de estoque feitas com UPDATE direto (sem passar pelo ORM)"""
+    bump_cache_version(connection, ITEMS_CACHE_NAME)
+
+
+def notify_items_changed(connection):
+    """Para gravações em lote que não passam pelos eventos do ORM (bulk_*_mappings, restauração)"""
+    bump_cache_version(connection, CATEGORIES_CACHE_NAME)
+    bump_cache_version(connection, ITEMS_CACHE_NAME)
+
+
+def invalidate_item_categories():
+    global _categories
+    _categories = (None, None)
+    with db.engine.begin() as connection:
+        notify_items_changed(connection)
+
+
+# --- Invalidação: inclusão/exclusão de item ou troca de categoria ---
+
+@event.listens_for(Item, 'after_insert')
+@event.listens_for(Item, 'after_delete')
+def _categories_changed(mapper, connection, target):
+    bump_cache_version(connection, CATEGORIES_CACHE_NAME)
+    bump_cache_version(connection, ITEMS_CACHE_NAME)
+
+
+@event.listens_for(Item, 'after_update')
+def _categories_after_update(mapper, connection, target):
+    if sa_inspect(target).attrs.category.history.has_changes():
+        bump_cache_version(connection, CATEGORIES_CACHE_NAME)
+    bump_cache_version(connection, ITEMS_CACHE_NAME)
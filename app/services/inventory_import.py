@@ -0,0 +1,200 @@
+from openpyxl import load_workbook
+from app.extensions import db
+from app.models.settings import Item
+from app.services.inventory import notify_items_changed
+from app.services.item_search import INDEXED_FIELDS, reindex_items
+from app.services.low_stock import sync_low_stock
+from app.services.stock import record_movements
+from app.models.stock import MOVEMENT_IMPORT
+
+IMPORT_CHUNK_SIZE = 500  # Linhas gravadas por lote (bulk_insert_mappings / bulk_update_mappings)
+REPORT_CHANGES_LIMIT = 500  # Diferenças guardadas para exibição na simulação
+
+# Campo do Item -> nomes aceitos no cabeçalho (busca por trecho, sem diferenciar maiúsculas)
+COLUMN_ALIASES = {
+    'name': ['nome', 'item', 'produto'],
+    'category': ['categoria', 'grupo'],
+    'quantity': ['quantidade', 'estoque', 'qtd'],
+    'min_quantity': ['mínima', 'minima', 'alerta'],
+    'unit_cost': ['custo', 'valor', 'preço', 'preco'],
+    'description': ['descrição', 'descricao', 'obs'],
+    'location': ['localização', 'localizacao', 'local', 'prateleira'],
+    'supplier': ['fornecedor', 'marca'],
+}
+REQUIRED_COLUMNS = ('name', 'category', 'quantity')
+TEXT_FIELDS = ('description', 'location', 'supplier')
+ITEM_FIELDS = ('category', 'quantity', 'min_quantity', 'unit_cost') + TEXT_FIELDS
+
+
+class InventoryImportError(ValueError):
+    """Planilha sem as colunas obrigatórias"""
+
+
+class ImportReport:
+    """Resultado da importação (ou da simulação): contadores, erros por linha e diferenças"""
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.errors = []  # [(linha, mensagem)]
+        self.changes = []  # [{'row', 'name', 'action', 'fields': {campo: (antes, depois)}}]
+
+    @classmethod
+    def from_dict(cls, data):
+        report = cls(data.get('dry_run', False))
+        for key in ('created', 'updated', 'unchanged', 'errors', 'changes'):
+            setattr(report, key, data.get(key, getattr(report, key)))
+        return report
+
+    def to_dict(self):
+        return {'dry_run': self.dry_run, 'created': self.created, 'updated': self.updated,
+                'unchanged': self.unchanged, 'errors': self.errors, 'changes': self.changes}
+
+    @property
+    def total(self):
+        return self.created + self.updated + self.unchanged
+
+    def add_change(self, row, name, action, fields):
+        if len(self.changes) < REPORT_CHANGES_LIMIT:
+            self.changes.append({'row': row, 'name': name, 'action': action, 'fields': fields})
+
+
+def _find_columns(headers):
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for i, header in enumerate(headers):
+            if header and any(alias in str(header).lower() for alias in aliases):
+                columns[field] = i
+                break
+    return columns
+
+
+def _parse_row(values, columns):
+    """Converte a linha da planilha em {campo: valor}; campos ausentes/vazios ficam de fora.
+
+    Levanta ValueError com a mensagem do erro da linha.
+    """
+    def cell(field):
+        index = columns.get(field)
+        return values[index] if index is not None and index < len(values) else None
+
+    data = {'category': str(cell('category') or 'Geral').strip()}
+
+    for field, convert, label in (('quantity', int, 'Quantidade'), ('min_quantity', int, 'Quantidade mínima'),
+                                  ('unit_cost', float, 'Custo')):
+        value = cell(field)
+        if value is None or value == '':
+            continue
+        try:
+            data[field] = convert(float(value)) if convert is int else convert(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'{label} inválida: {value!r}')
+    data.setdefault('quantity', 0)
+
+    for field in TEXT_FIELDS:
+        value = cell(field)
+        if value:
+            data[field] = str(value).strip()
+    return data
+
+
+def import_inventory_workbook(fileobj, dry_run=False, chunk_size=IMPORT_CHUNK_SIZE, progress=None, user_id=None):
+    """Importa (ou simula, com dry_run) uma planilha de estoque em modo streaming.
+
+    A planilha é lida em read-only, linha a linha; os itens existentes são
+    carregados uma única vez em um dicionário por nome e as gravações saem em
+    lotes com bulk_insert_mappings/bulk_update_mappings. Itens são casados pelo
+    nome: atualiza se existir, cria se for novo. O commit fica com quem chama.
+    progress, se informado, recebe (linha atual, total de linhas ou None).
+    Mudanças de quantidade vão para o razão de estoque em nome de user_id.
+    """
+    wb = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        ws = wb.active
+        total_rows = ws.max_row  # Vem da dimensão gravada no arquivo; pode faltar
+        rows = ws.iter_rows(values_only=True)
+        columns = _find_columns(next(rows, None) or ())
+        if any(field not in columns for field in REQUIRED_COLUMNS):
+            raise InventoryImportError('O arquivo deve conter as colunas: Nome, Categoria e Quantidade.')
+
+        existing = {row.name: row._asdict() for row in
+                    db.session.query(Item.id, Item.name, *(getattr(Item, f) for f in ITEM_FIELDS))}
+
+        report = ImportReport(dry_run)
+        inserts, updates = [], []
+        pending = set()  # nomes criados neste lote e ainda não gravados
+        quantity_deltas = {}  # item_id -> variação de quantidade dos itens já gravados, para o razão
+
+        def flush():
+            if not dry_run:
+                if inserts:
+                    # return_defaults preenche o id nos mappings: linhas repetidas em lotes seguintes viram update
+                    db.session.bulk_insert_mappings(Item, inserts, return_defaults=True)
+                if updates:
+                    db.session.bulk_update_mappings(Item, updates)
+                # Nem os eventos do ORM que mantêm o índice de busca: reindexa o lote explicitamente
+                reindex_items(db.session.connection(),
+                              [m['id'] for m in inserts] +
+                              [m['id'] for m in updates if any(f in m for f in INDEXED_FIELDS)])
+                sync_low_stock(db.session.connection(),
+                               [m['id'] for m in inserts] +
+                               [m['id'] for m in updates if 'quantity' in m or 'min_quantity' in m])
+                record_movements(db.session.connection(),
+                                 {**quantity_deltas, **{m['id']: m['quantity'] for m in inserts}},
+                                 MOVEMENT_IMPORT, user_id=user_id)
+            inserts.clear()
+            quantity_deltas.clear()
+            updates.clear()
+            pending.clear()
+
+        for row_number, values in enumerate(rows, start=2):
+            if progress and row_number % 100 == 0:
+                progress(row_number, total_rows)
+            name_index = columns['name']
+            name = values[name_index] if name_index < len(values) else None
+            if name is None or str(name).strip() == '':
+                continue
+            name = str(name).strip()
+
+            try:
+                data = _parse_row(values, columns)
+            except ValueError as e:
+                report.errors.append((row_number, f'{name}: {e}'))
+                continue
+
+            current = existing.get(name)
+            if current is None:
+                current = {'name': name, 'min_quantity': 0, 'unit_cost': 0.0,
+                           'description': '', 'location': '', 'supplier': '', **data}
+                inserts.append(current)
+                pending.add(name)
+                existing[name] = current
+                report.add_change(row_number, name, 'create', {f: (None, current[f]) for f in ITEM_FIELDS})
+                report.created += 1
+            else:
+                changed = {f: (current[f], v) for f, v in data.items() if current[f] != v}
+                if not changed:
+                    report.unchanged += 1
+                    continue
+                current.update({f: new for f, (_, new) in changed.items()})
+                if name not in pending and current.get('id') is not None:
+                    # Item criado em lote já gravado (nome repetido na planilha) também cai aqui
+                    updates.append({'id': current['id'], **{f: new for f, (_, new) in changed.items()}})
+                    if 'quantity' in changed:
+                        old, new = changed['quantity']
+                        quantity_deltas[current['id']] = quantity_deltas.get(current['id'], 0) + new - (old or 0)
+                report.add_change(row_number, name, 'update', changed)
+                report.updated += 1
+
+            if len(inserts) + len(updates) >= chunk_size:
+                flush()
+
+        flush()
+        if not dry_run and (report.created or report.updated):
+            # bulk_*_mappings não dispara os eventos do ORM que invalidam o cache de categorias
+            notify_items_changed(db.session.connection())
+        return report
+    finally:
+        wb.close()
@@ -0,0 +1,190 @@
+import re
+from sqlalchemy import event, or_, text, literal_column, func, inspect as sa_inspect
+from sqlalchemy.exc import DBAPIError
+from app.extensions import db
+from app.models.settings import Item
+
+# Campos indexados; alterar outro campo (quantidade, custo...) não reindexa o item
+INDEXED_FIELDS = ('name', 'description', 'location', 'supplier')
+REINDEX_CHUNK_SIZE = 500
+TYPEAHEAD_LIMIT = 20
+
+_backend = None
+
+
+def _search_terms(q):
+    """Extrai os termos de busca (apenas letras/números) para montar a consulta FTS com segurança"""
+    return re.findall(r'\w+', q or '')
+
+
+class LikeItemSearch:
+    """Fallback sem índice: ILIKE em nome, descrição, localização e fornecedor"""
+    name = 'like'
+
+    def setup(self, connection):
+        pass
+
+    def rebuild(self, connection):
+        pass
+
+    def reindex(self, connection, item_ids):
+        pass
+
+    def remove(self, connection, item_id):
+        pass
+
+    def apply(self, query, q):
+        return query.filter(or_(
+            Item.name.ilike(f'%{q}%'),
+            Item.description.ilike(f'%{q}%'),
+            Item.location.ilike(f'%{q}%'),
+            Item.supplier.ilike(f'%{q}%')
+        ))
+
+
+class SqliteItemSearch(LikeItemSearch):
+    """Tabela virtual FTS5 (item_fts) com índice de prefixos, rowid = item.id"""
+    name = 'sqlite-fts5'
+
+    _select_sql = "SELECT i.id, i.name, i.description, i.location, i.supplier FROM item i"
+
+    def setup(self, connection):
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS item_fts USING fts5("
+            "name, description, location, supplier, "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        ))
+        if connection.execute(text("SELECT count(*) FROM item_fts")).scalar() == 0:
+            self.rebuild(connection)
+
+    def rebuild(self, connection):
+        connection.execute(text("DELETE FROM item_fts"))
+        connection.execute(text(
+            f"INSERT INTO item_fts (rowid, name, description, location, supplier) {self._select_sql}"
+        ))
+
+    def reindex(self, connection, item_ids):
+        item_ids = list(item_ids)
+        for start in range(0, len(item_ids), REINDEX_CHUNK_SIZE):
+            chunk = item_ids[start:start + REINDEX_CHUNK_SIZE]
+            params = {f'id{n}': item_id for n, item_id in enumerate(chunk)}
+            placeholders = ', '.join(f':{key}' for key in params)
+            connection.execute(text(f"DELETE FROM item_fts WHERE rowid IN ({placeholders})"), params)
+            connection.execute(text(
+                f"INSERT INTO item_fts (rowid, name, description, location, supplier) "
+                f"{self._select_sql} WHERE i.id IN ({placeholders})"
+            ), params)
+
+    def remove(self, connection, item_id):
+        connection.execute(text("DELETE FROM item_fts WHERE rowid = :id"), {'id': item_id})
+
+    def apply(self, query, q):
+        terms = _search_terms(q)
+        if not terms:
+            return super().apply(query, q)
+
+        # Prefixo em cada termo, ranqueado por bm25: nome pesa mais, depois fornecedor e localização
+        match = ' '.join(f'"{t}"*' for t in terms)
+        matches = text(
+            "SELECT rowid AS item_id, bm25(item_fts, 10.0, 1.0, 2.0, 3.0) AS rank "
+            "FROM item_fts WHERE item_fts MATCH :match"
+        ).bindparams(match=match).columns(
+            literal_column('item_id'), literal_column('rank')
+        ).subquery('item_fts_match')
+
+        return query.join(matches, Item.id == matches.c.item_id).order_by(matches.c.rank)
+
+
+class PostgresItemSearch(LikeItemSearch):
+    """Índices GIN de trigramas (pg_trgm): o próprio ILIKE '%q%' passa a usar índice"""
+    name = 'postgres-trgm'
+
+    def setup(self, connection):
+        for field in INDEXED_FIELDS:
+            connection.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_item_{field}_trgm ON item USING GIN ({field} gin_trgm_ops)"
+            ))
+
+    def apply(self, query, q):
+        # Além do ILIKE, o operador % do pg_trgm tolera erros de digitação no nome
+        query = query.filter(or_(
+            Item.name.ilike(f'%{q}%'),
+            Item.name.op('%')(q),
+            Item.description.ilike(f'%{q}%'),
+            Item.location.ilike(f'%{q}%'),
+            Item.supplier.ilike(f'%{q}%')
+        ))
+        others = func.concat_ws(' ', Item.supplier, Item.location, Item.description)
+        rank = func.word_similarity(q, Item.name) * 2 + func.word_similarity(q, others)
+        return query.order_by(rank.desc())
+
+
+def _detect_backend(connection):
+    if connection.dialect.name == 'postgresql':
+        try:
+            # Savepoint: sem permissão para criar a extensão, a transação de fora continua válida
+            with connection.begin_nested():
+                connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            return PostgresItemSearch()
+        except DBAPIError:
+            return LikeItemSearch()
+    if connection.dialect.name == 'sqlite':
+        if connection.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar():
+            return SqliteItemSearch()
+    return LikeItemSearch()
+
+
+def get_item_search_backend(connection=None):
+    """Backend de busca do inventário conforme o banco (FTS5, pg_trgm ou ILIKE)"""
+    global _backend
+    if _backend is None:
+        if connection is not None:
+            _backend = _detect_backend(connection)
+        else:
+            with db.engine.begin() as conn:
+                _backend = _detect_backend(conn)
+    return _backend
+
+
+def setup_item_search_index():
+    """Cria o índice de busca do inventário (se necessário) e preenche com os itens existentes"""
+    with db.engine.begin() as connection:
+        get_item_search_backend(connection).setup(connection)
+
+
+def rebuild_item_search_index():
+    with db.engine.begin() as connection:
+        get_item_search_backend(connection).rebuild(connection)
+
+
+def reindex_items(connection, item_ids):
+    """Para gravações em lote que não passam pelos eventos do ORM (bulk_*_mappings)"""
+    if item_ids:
+        get_item_search_backend(connection).reindex(connection, item_ids)
+
+
+def search_items(query, q):
+    """Filtra e ordena por relevância; a ordenação da tela deve vir depois, como desempate"""
+    q = q.strip()
+    if not q:
+        return query
+    return get_item_search_backend().apply(query, q)
+
+
+# --- Sincronização do índice com Item ---
+
+@event.listens_for(Item, 'after_insert')
+def _index_item_after_insert(mapper, connection, target):
+    get_item_search_backend(connection).reindex(connection, [target.id])
+
+
+@event.listens_for(Item, 'after_update')
+def _index_item_after_update(mapper, connection, target):
+    state = sa_inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in INDEXED_FIELDS):
+        get_item_search_backend(connection).reindex(connection, [target.id])
+
+
+@event.listens_for(Item, 'after_delete')
+def _index_item_after_delete(mapper, connection, target):
+    get_item_search_backend(connection).remove(connection, target.id)
@@ -0,0 +1,324 @@
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.exc import OperationalError
+from app.extensions import db
+from app.models.job import Job, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED
+
+POLL_SECONDS = 2  # Intervalo entre buscas por tarefas quando a fila está vazia
+PROGRESS_MIN_INTERVAL = 1.0  # Segundos mínimos entre gravações de progresso da mesma tarefa
+PROGRESS_LOCK_TIMEOUT_MS = 200  # SQLite: não espera o lock de escrita da própria tarefa para gravar progresso
+STALE_JOB_MINUTES = 30  # Tarefa 'Executando' sem sinal de vida há mais tempo é dada como interrompida
+RETENTION_DAYS = 7  # Tarefas concluídas (e seus arquivos) são apagadas depois disso
+MAINTENANCE_SECONDS = 3600
+
+_handlers = {}
+
+
+def job_handler(kind):
+    """Registra a função que executa as tarefas do tipo `kind`: handler(ctx, **params)"""
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def _load_handlers():
+    # Handlers das telas administrativas (importações, exportações, backup)
+    from app.services import admin_jobs  # noqa: F401
+
+
+def job_storage_dir(job_id=None):
+    """Pasta de entradas e resultados das tarefas (precisa ser compartilhada entre web e worker)"""
+    base = current_app.config.get('JOB_STORAGE_DIR') or os.path.join(current_app.instance_path, 'jobs')
+    path = os.path.join(base, str(job_id)) if job_id is not None else base
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def jobs_run_inline():
+    """Sem worker (embutido ou `flask worker` à parte), ex: serverless na Vercel: a tarefa roda na própria requisição"""
+    config = current_app.config
+    return not (config.get('JOB_WORKER_ENABLED') or config.get('JOB_EXTERNAL_WORKER'))
+
+
+def run_job_inline(job):
+    """Reserva esta tarefa (se ainda estiver na fila) e a executa na hora; retorna a tarefa atualizada"""
+    table = Job.__table__
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        update(table).where(table.c.id == job.id, table.c.status == JOB_QUEUED)
+        .values(status=JOB_RUNNING, worker=f'{socket.gethostname()}:{os.getpid()}/inline', started_at=now,
+                heartbeat_at=now, progress=0, message='Iniciando...')
+    ).rowcount
+    db.session.commit()
+    job = db.session.get(Job, job.id)
+    return run_job(job) if claimed else job
+
+
+def enqueue_job(kind, params=None, user_id=None, upload=None, upload_name='input'):
+    """Cria a tarefa na fila e grava o arquivo enviado (se houver) na pasta dela.
+
+    Faz commit: o worker só enxerga a tarefa depois disso. Sem worker
+    configurado (jobs_run_inline), executa a tarefa antes de retornar.
+    """
+    _load_handlers()
+    if kind not in _handlers:
+        raise ValueError(f'Tipo de tarefa desconhecido: {kind}')
+    params = dict(params or {})
+    job = Job(kind=kind, status=JOB_QUEUED, user_id=user_id, progress=0, message='Aguardando o worker...')
+    db.session.add(job)
+    db.session.flush()
+
+    if upload is not None:
+        filename = os.path.basename(upload_name)
+        upload.save(os.path.join(job_storage_dir(job.id), filename))
+        params['input_file'] = filename
+    job.params = json.dumps(params)
+    db.session.commit()
+    return run_job_inline(job) if jobs_run_inline() else job
+
+
+def enqueue_copy(job, kind, params=None, user_id=None):
+    """Nova tarefa reaproveitando o arquivo de entrada de outra (ex: confirmar uma simulação)"""
+    source = job.params_dict.get('input_file')
+    new_job = Job(kind=kind, status=JOB_QUEUED, user_id=user_id, progress=0, message='Aguardando o worker...')
+    db.session.add(new_job)
+    db.session.flush()
+    params = dict(params or {})
+    if source:
+        shutil.copyfile(os.path.join(job_storage_dir(job.id), source),
+                        os.path.join(job_storage_dir(new_job.id), source))
+        params['input_file'] = source
+    new_job.params = json.dumps(params)
+    db.session.commit()
+    return run_job_inline(new_job) if jobs_run_inline() else new_job
+
+
+def claim_next_job(worker_id):
+    """Reserva a tarefa mais antiga da fila; None se vazia.
+
+    UPDATE ... WHERE id = (próxima da fila) AND status = 'Na fila' é atômico:
+    dois workers nunca pegam a mesma tarefa. No Postgres o SKIP LOCKED evita
+    que fiquem esperando um pelo outro.
+    """
+    table = Job.__table__
+    connection = db.session.connection()
+    candidate = select(table.c.id).where(table.c.status == JOB_QUEUED).order_by(table.c.id).limit(1)
+    if connection.dialect.name == 'postgresql':
+        candidate = candidate.with_for_update(skip_locked=True)
+
+    now = datetime.utcnow()
+    stmt = update(table).where(table.c.id == candidate.scalar_subquery(), table.c.status == JOB_QUEUED) \
+        .values(status=JOB_RUNNING, worker=worker_id, started_at=now, heartbeat_at=now, progress=0,
+                message='Iniciando...')
+
+    if connection.dialect.update_returning:
+        job_id = connection.execute(stmt.returning(table.c.id)).scalar()
+    else:
+        job_id = connection.execute(candidate).scalar()
+        if job_id is not None and not connection.execute(stmt.where(table.c.id == job_id)).rowcount:
+            job_id = None
+    db.session.commit()
+    return db.session.get(Job, job_id) if job_id is not None else None
+
+
+class JobContext:
+    """Passado ao handler: caminhos da tarefa e relato de progresso"""
+
+    def __init__(self, job):
+        self.job_id = job.id
+        self.user_id = job.user_id
+        self.directory = job_storage_dir(job.id)
+        self._last_progress = 0.0
+        self.result_path = None
+        self.result_name = None
+        self.result_mimetype = None
+
+    def path(self, filename):
+        return os.path.join(self.directory, os.path.basename(filename))
+
+    def progress(self, percent, message=None, force=False):
+        """Grava o progresso em conexão própria (visível para quem consulta antes do commit da tarefa).
+
+        No máximo uma gravação por PROGRESS_MIN_INTERVAL; se o banco estiver
+        travado pela própria tarefa (SQLite com escrita pendente), pula esta.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_progress < PROGRESS_MIN_INTERVAL:
+            return
+        self._last_progress = now
+        values = {'progress': max(0, min(100, int(percent))), 'heartbeat_at': datetime.utcnow()}
+        if message is not None:
+            values['message'] = message[:255]
+
+        with db.engine.connect() as connection:
+            sqlite = connection.dialect.name == 'sqlite'
+            if sqlite:
+                previous_timeout = connection.exec_driver_sql('PRAGMA busy_timeout').scalar()
+                connection.exec_driver_sql(f'PRAGMA busy_timeout = {PROGRESS_LOCK_TIMEOUT_MS}')
+            try:
+                connection.execute(update(Job.__table__).where(Job.__table__.c.id == self.job_id).values(**values))
+                connection.commit()
+            except OperationalError:
+                connection.rollback()
+            finally:
+                if sqlite:
+                    connection.exec_driver_sql(f'PRAGMA busy_timeout = {previous_timeout}')
+
+    def set_file(self, filename, download_name, mimetype):
+        """Declara o arquivo gerado (já gravado em ctx.path(filename)) como resultado para download"""
+        self.result_path = os.path.basename(filename)
+        self.result_name = download_name
+        self.result_mimetype = mimetype
+
+
+def run_job(job):
+    """Executa a tarefa já reservada e grava o resultado (ou o erro)"""
+    _load_handlers()
+    job_id, kind = job.id, job.kind
+    ctx = JobContext(job)
+    handler = _handlers.get(kind)
+    try:
+        if handler is None:
+            raise ValueError(f'Tipo de tarefa desconhecido: {kind}')
+        summary = handler(ctx, **job.params_dict) or {}
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f'Tarefa #{job_id} ({kind}) falhou: {e}\n{traceback.format_exc()}')
+        job = db.session.get(Job, job_id)
+        job.status = JOB_FAILED
+        job.error = str(e) or e.__class__.__name__
+        job.message = 'Falhou.'
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return job
+
+    job = db.session.get(Job, job_id)
+    job.status = JOB_DONE
+    job.progress = 100
+    job.message = summary.pop('message', None) or 'Concluído.'
+    job.result = json.dumps(summary, default=str)
+    job.result_path = ctx.result_path
+    job.result_name = ctx.result_name
+    job.result_mimetype = ctx.result_mimetype
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    return job
+
+
+def fail_stale_jobs(minutes=STALE_JOB_MINUTES):
+    """Marca como falhas as tarefas 'Executando' sem sinal de vida (worker morto no meio).
+
+    Não são recolocadas na fila: importações não são idempotentes.
+    """
+    limit = datetime.utcnow() - timedelta(minutes=minutes)
+    count = Job.query.filter(Job.status == JOB_RUNNING, Job.heartbeat_at < limit).update({
+        'status': JOB_FAILED, 'error': 'Interrompida (worker parou durante a execução).',
+        'message': 'Falhou.', 'finished_at': datetime.utcnow()
+    }, synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def purge_old_jobs(days=RETENTION_DAYS):
+    """Apaga tarefas finalizadas antigas e suas pastas"""
+    limit = datetime.utcnow() - timedelta(days=days)
+    old_ids = [row.id for row in db.session.query(Job.id)
+               .filter(Job.status.in_((JOB_DONE, JOB_FAILED)), Job.finished_at < limit)]
+    for job_id in old_ids:
+        shutil.rmtree(job_storage_dir(job_id), ignore_errors=True)
+    if old_ids:
+        Job.query.filter(Job.id.in_(old_ids)).delete(synchronize_session=False)
+        db.session.commit()
+    return len(old_ids)
+
+
+class JobWorker:
+    """Pool de threads que consome a tabela job"""
+
+    def __init__(self, app, threads=2, poll_seconds=POLL_SECONDS):
+        self.app = app
+        self.threads = threads
+        self.poll_seconds = poll_seconds
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._stop = threading.Event()
+        self._threads = []
+        self._last_maintenance = 0.0
+        self._maintenance_lock = threading.Lock()
+
+    def _maintenance(self):
+        with self._maintenance_lock:
+            if time.monotonic() - self._last_maintenance < MAINTENANCE_SECONDS:
+                return
+            self._last_maintenance = time.monotonic()
+        stale = fail_stale_jobs()
+        purged = purge_old_jobs()
+        if stale or purged:
+            self.app.logger.info(f'Tarefas: {stale} interrompida(s), {purged} antiga(s) removida(s).')
+
+        # Buscas no AD abandonadas também vencem aqui, não só quando alguém faz outra busca
+        from app.services.ad_search import purge_expired_ad_searches
+        if purge_expired_ad_searches():
+            db.session.commit()
+
+    def run_once(self, name=None):
+        """Executa no máximo uma tarefa; retorna False se a fila estava vazia"""
+        with self.app.app_context():
+            try:
+                self._maintenance()
+                job = claim_next_job(f'{self.worker_id}/{name or threading.current_thread().name}')
+                if job is None:
+                    return False
+                self.app.logger.info(f'Tarefa #{job.id} ({job.kind}) iniciada.')
+                job = run_job(job)
+                self.app.logger.info(f'Tarefa #{job.id} ({job.kind}): {job.status}.')
+                return True
+            finally:
+                db.session.remove()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                worked = self.run_once()
+            except Exception as e:
+                self.app.logger.error(f'Erro no worker de tarefas: {e}')
+                worked = False
+            if not worked:
+                self._stop.wait(self.poll_seconds)
+
+    def start(self):
+        for i in range(self.threads):
+            thread = threading.Thread(target=self._loop, name=f'job-worker-{i + 1}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def join(self):
+        for thread in self._threads:
+            while thread.is_alive():
+                thread.join(timeout=1)
+
+    def stop(self):
+        self._stop.set()
+
+
+def start_job_worker(app, threads=2, poll_seconds=POLL_SECONDS, background=True):
+    """Inicia o pool (em segundo plano ou, com background=False, bloqueando até Ctrl+C)"""
+    _load_handlers()
+    worker = JobWorker(app, threads, poll_seconds).start()
+    if not background:
+        try:
+            worker.join()
+        except KeyboardInterrupt:
+            worker.stop()
+            raise
+    return worker
@@ -0,0 +1,103 @@
+from datetime import datetime
+from sqlalchemy import event, select, inspect as sa_inspect
+from sqlalchemy.orm import joinedload
+from app.extensions import db
+from app.models.settings import Item, LowStockEvent
+
+SYNC_CHUNK_SIZE = 500
+FEED_LIMIT = 100
+
+
+def _below_minimum(quantity, min_quantity):
+    return (quantity or 0) <= (min_quantity or 0)
+
+
+def _record_crossings(connection, rows):
+    """Grava no feed os cruzamentos [(item_id, low_stock, quantity, min_quantity)]"""
+    if rows:
+        now = datetime.utcnow()
+        connection.execute(LowStockEvent.__table__.insert(), [{
+            'item_id': item_id, 'low_stock': low_stock, 'quantity': quantity,
+            'min_quantity': min_quantity, 'created_at': now
+        } for item_id, low_stock, quantity, min_quantity in rows])
+
+
+def sync_low_stock(connection, item_ids):
+    """Atualiza o flag low_stock dos itens informados e registra os cruzamentos de limite.
+
+    Para gravações que não passam pelo ORM (UPDATE direto da baixa de estoque,
+    bulk_*_mappings da importação). Só lê os itens cujo flag divergiu do saldo,
+    então o custo é proporcional aos itens alterados. Retorna o nº de cruzamentos.
+    """
+    table = Item.__table__
+    item_ids = list(item_ids)
+    crossings = []
+    for start in range(0, len(item_ids), SYNC_CHUNK_SIZE):
+        chunk = item_ids[start:start + SYNC_CHUNK_SIZE]
+        below = table.c.quantity <= table.c.min_quantity
+        rows = connection.execute(
+            select(table.c.id, below.label('below'), table.c.quantity, table.c.min_quantity)
+            .where(table.c.id.in_(chunk), table.c.low_stock != below)
+        ).all()
+        for value in (True, False):
+            ids = [row.id for row in rows if bool(row.below) is value]
+            if ids:
+                connection.execute(table.update().where(table.c.id.in_(ids)).values(low_stock=value))
+        crossings.extend((row.id, bool(row.below), row.quantity, row.min_quantity) for row in rows)
+    _record_crossings(connection, crossings)
+    return len(crossings)
+
+
+def rebuild_low_stock():
+    """Recalcula o flag de todos os itens (backfill ou conferência); não gera eventos.
+
+    Retorna o nº de itens corrigidos.
+    """
+    table = Item.__table__
+    below = table.c.quantity <= table.c.min_quantity
+    with db.engine.begin() as connection:
+        fixed = connection.execute(
+            table.update().where(table.c.low_stock != below).values(low_stock=below)
+        ).rowcount
+    return fixed
+
+
+def low_stock_items():
+    """Conjunto atual de itens com estoque baixo, pelo índice ix_item_low_stock_name"""
+    return Item.query.filter(Item.low_stock.is_(True)).order_by(Item.name).all()
+
+
+def low_stock_events(after_id=None, limit=FEED_LIMIT):
+    """Cruzamentos de limite em ordem de id; after_id funciona como cursor do feed"""
+    query = LowStockEvent.query.options(joinedload(LowStockEvent.item))
+    if after_id:
+        query = query.filter(LowStockEvent.id > after_id)
+    return query.order_by(LowStockEvent.id).limit(limit).all()
+
+
+# --- Gravações pelo ORM: o flag vai no próprio INSERT/UPDATE do item ---
+
+@event.listens_for(Item, 'before_insert')
+def _flag_before_insert(mapper, connection, target):
+    target.low_stock = _below_minimum(target.quantity, target.min_quantity)
+
+
+@event.listens_for(Item, 'before_update')
+def _flag_before_update(mapper, connection, target):
+    state = sa_inspect(target)
+    if not (state.attrs.quantity.history.has_changes() or state.attrs.min_quantity.history.has_changes()):
+        return
+    if isinstance(target.quantity, (int, type(None))) and isinstance(target.min_quantity, (int, type(None))):
+        target.low_stock = _below_minimum(target.quantity, target.min_quantity)
+
+
+@event.listens_for(Item, 'after_insert')
+def _record_after_insert(mapper, connection, target):
+    if target.low_stock:
+        _record_crossings(connection, [(target.id, True, target.quantity, target.min_quantity)])
+
+
+@event.listens_for(Item, 'after_update')
+def _record_after_update(mapper, connection, target):
+    if sa_inspect(target).attrs.low_stock.history.has_changes():
+        _record_crossings(connection, [(target.id, target.low_stock, target.quantity, target.min_quantity)])
@@ -0,0 +1,117 @@
+import base64
+import json
+import math
+from datetime import datetime
+from sqlalchemy import tuple_
+
+
+class KeysetPage:
+    """Página obtida por seek em (created_at, id), sem OFFSET"""
+
+    def __init__(self, items, per_page, page, total, next_cursor, prev_cursor):
+        self.items = items
+        self.per_page = per_page
+        self.page = page
+        self.total = total
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    @property
+    def pages(self):
+        if self.total is None:
+            return None
+        return max(1, math.ceil(self.total / self.per_page))
+
+
+def encode_cursor(data):
+    raw = json.dumps(data, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Decodifica o token opaco; tokens inválidos voltam para a primeira página"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = json.loads(raw)
+        data['c'] = datetime.fromisoformat(data['c']) if data['c'] is not None else None
+        data['i'] = int(data['i'])
+        return data
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _seek(query, sort_column, id_column, state, direction, limit):
+    """Linhas a partir da posição do cursor, na ordem (sort desc, id desc) com sort nulo no fim.
+
+    Linhas sem sort_column (ex: chamados migrados sem created_at) formam um trecho
+    final ordenado só por id; cada trecho é uma consulta por faixa no índice, e a
+    busca passa de um para o outro quando o primeiro acaba.
+    """
+    not_null = query.filter(sort_column.isnot(None))
+    nulls = query.filter(sort_column.is_(None))
+    key = tuple_(sort_column, id_column)
+
+    if direction == 'prev':
+        if state['c'] is None:
+            rows = nulls.filter(id_column > state['i']).order_by(id_column.asc()).limit(limit).all()
+            if len(rows) < limit:
+                rows += not_null.order_by(sort_column.asc(), id_column.asc()).limit(limit - len(rows)).all()
+            return rows
+        return not_null.filter(key > tuple_(state['c'], state['i'])) \
+            .order_by(sort_column.asc(), id_column.asc()).limit(limit).all()
+
+    if state is not None and state['c'] is None:
+        return nulls.filter(id_column < state['i']).order_by(id_column.desc()).limit(limit).all()
+    if state is not None:
+        not_null = not_null.filter(key < tuple_(state['c'], state['i']))
+    rows = not_null.order_by(sort_column.desc(), id_column.desc()).limit(limit).all()
+    if len(rows) < limit:
+        rows += nulls.order_by(id_column.desc()).limit(limit - len(rows)).all()
+    return rows
+
+
+def keyset_paginate(query, sort_column, id_column, cursor=None, per_page=10):
+    """Pagina em ordem decrescente de (sort_column, id_column) usando um cursor opaco.
+
+    O total só é contado na primeira página e segue dentro do cursor, então
+    páginas profundas custam o mesmo que a primeira.
+    """
+    state = decode_cursor(cursor)
+
+    if state is None:
+        page, total, direction = 1, query.order_by(None).count(), 'next'
+    else:
+        page, total, direction = state.get('p', 1), state.get('n'), state.get('d', 'next')
+    rows = _seek(query, sort_column, id_column, state, direction, per_page + 1)
+
+    has_more = len(rows) > per_page
+    items = rows[:per_page]
+    if direction == 'prev':
+        items.reverse()
+
+    def make_cursor(item, d, p):
+        value = getattr(item, sort_column.key)
+        return encode_cursor({
+            'c': value.isoformat() if value is not None else None,
+            'i': getattr(item, id_column.key),
+            'd': d, 'p': p, 'n': total
+        })
+
+    next_cursor = prev_cursor = None
+    if items:
+        if has_more or direction == 'prev':
+            next_cursor = make_cursor(items[-1], 'next', page + 1)
+        if page > 1 and (has_more or direction == 'next'):
+            prev_cursor = make_cursor(items[0], 'prev', page - 1)
+
+    return KeysetPage(items, per_page, page, total, next_cursor, prev_cursor)
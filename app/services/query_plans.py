@@ -0,0 +1,107 @@
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import event, tuple_, func
+from app.extensions import db
+from app.models.ticket import Ticket, Comment, TicketItem, ticket_observers
+from app.services.stats import ticket_visibility_filter, OPEN_STATUSES
+from app.services.sla_breaches import open_status_filter, breached_filter, breaching_filter, breach_rate_query
+
+
+class _SampleUser:
+    """Usuário fictício para montar o filtro de visibilidade sem depender de dados"""
+    id = 1
+    role = 'user'
+
+
+def hot_queries():
+    """Formatos de consulta das rotas mais acessadas que devem ser atendidos por índice"""
+    visible = Ticket.query.filter(ticket_visibility_filter(_SampleUser()))
+    now = datetime(2024, 1, 1)
+    return {
+        'tickets.list_tickets (admin)':
+            Ticket.query.order_by(Ticket.created_at.desc(), Ticket.id.desc()).limit(11),
+        'tickets.list_tickets (cursor)':
+            Ticket.query.filter(tuple_(Ticket.created_at, Ticket.id) < tuple_(datetime(2024, 1, 1), 1))
+            .order_by(Ticket.created_at.desc(), Ticket.id.desc()).limit(11),
+        'tickets.list_tickets (usuário)':
+            visible.order_by(Ticket.created_at.desc(), Ticket.id.desc()).limit(11),
+        'main.index (recentes)':
+            Ticket.query.filter(Ticket.status.in_(OPEN_STATUSES)).order_by(Ticket.updated_at.desc()).limit(5),
+        'chamados atribuídos por status':
+            Ticket.query.filter(Ticket.assigned_to_id == 1, Ticket.status.in_(OPEN_STATUSES)),
+        'chamados do autor':
+            Ticket.query.filter(Ticket.user_id == 1).order_by(Ticket.created_at.desc()),
+        'observadores por usuário':
+            db.session.query(ticket_observers.c.ticket_id).filter(ticket_observers.c.user_id == 1),
+        'tickets.view_ticket (comentários)':
+            Comment.query.filter(Comment.ticket_id == 1).order_by(Comment.created_at),
+        'tickets.view_ticket (itens usados)':
+            TicketItem.query.filter(TicketItem.ticket_id == 1),
+        'sla: vencidos':
+            db.session.query(func.count(Ticket.id))
+            .filter(open_status_filter(), Ticket.due_at.isnot(None), breached_filter(now)),
+        'sla: vencendo em 24h':
+            db.session.query(func.count(Ticket.id))
+            .filter(open_status_filter(), Ticket.due_at.isnot(None), *breaching_filter(24, now)),
+        'sla: taxa por técnico':
+            breach_rate_query(Ticket.assigned_to_id, now),
+    }
+
+
+def _explain(connection, sql):
+    if connection.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql).fetchall()
+        return [row[-1] for row in rows]
+    rows = connection.exec_driver_sql('EXPLAIN ' + sql).fetchall()
+    return [row[0] for row in rows]
+
+
+def _full_scans(connection, plan):
+    """Linhas do plano que indicam varredura completa de tabela"""
+    if connection.dialect.name == 'sqlite':
+        # "SCAN ticket" é varredura; "SCAN ticket USING INDEX ..." e "SEARCH ..." usam índice
+        return [line for line in plan
+                if line.startswith('SCAN ') and 'USING' not in line and 'SUBQUERY' not in line]
+    return [line for line in plan if 'Seq Scan' in line]
+
+
+def check_query_plans():
+    """Executa EXPLAIN para cada consulta e retorna {nome: linhas com varredura completa}"""
+    failures = {}
+    with db.engine.connect() as connection:
+        if connection.dialect.name == 'postgresql':
+            # Em tabelas pequenas o planner prefere Seq Scan mesmo com índice disponível
+            connection.exec_driver_sql('SET enable_seqscan = off')
+        for name, query in hot_queries().items():
+            sql = str(query.statement.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True}))
+            scans = _full_scans(connection, _explain(connection, sql))
+            if scans:
+                failures[name] = scans
+    return failures
+
+
+class StatementCounter:
+    """Comandos SQL enviados ao banco enquanto count_statements() está ativo"""
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+@contextmanager
+def count_statements(engine=None):
+    """Conta os comandos SQL executados no bloco (before_cursor_execute do engine)"""
+    engine = engine or db.engine
+    counter = StatementCounter()
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        counter.statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', _record)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', _record)
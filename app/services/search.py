@@ -0,0 +1,188 @@
+import re
+from sqlalchemy import event, or_, text, literal_column, func, inspect as sa_inspect
+from app.extensions import db
+from app.models.ticket import Ticket, Comment
+
+_backend = None
+
+
+def _search_terms(q):
+    """Extrai os termos de busca (apenas letras/números) para montar a consulta FTS com segurança"""
+    return re.findall(r'\w+', q or '')
+
+
+class LikeTicketSearch:
+    """Fallback sem índice: ILIKE em título e descrição"""
+    name = 'like'
+
+    def setup(self, connection):
+        pass
+
+    def rebuild(self, connection):
+        pass
+
+    def reindex(self, connection, ticket_id):
+        pass
+
+    def remove(self, connection, ticket_id):
+        pass
+
+    def apply(self, query, q):
+        return query.filter(or_(
+            Ticket.title.ilike(f'%{q}%'),
+            Ticket.description.ilike(f'%{q}%')
+        ))
+
+
+class SqliteTicketSearch(LikeTicketSearch):
+    """Tabela virtual FTS5 (ticket_fts) com título, descrição e comentários, rowid = ticket.id"""
+    name = 'sqlite-fts5'
+
+    def setup(self, connection):
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS ticket_fts USING fts5("
+            "title, description, comments, tokenize='unicode61 remove_diacritics 2')"
+        ))
+        if connection.execute(text("SELECT count(*) FROM ticket_fts")).scalar() == 0:
+            self.rebuild(connection)
+
+    def rebuild(self, connection):
+        connection.execute(text("DELETE FROM ticket_fts"))
+        connection.execute(text(
+            "INSERT INTO ticket_fts (rowid, title, description, comments) "
+            "SELECT t.id, t.title, t.description, "
+            "(SELECT group_concat(c.content, ' ') FROM comment c WHERE c.ticket_id = t.id) FROM ticket t"
+        ))
+
+    def reindex(self, connection, ticket_id):
+        self.remove(connection, ticket_id)
+        connection.execute(text(
+            "INSERT INTO ticket_fts (rowid, title, description, comments) "
+            "SELECT t.id, t.title, t.description, "
+            "(SELECT group_concat(c.content, ' ') FROM comment c WHERE c.ticket_id = t.id) "
+            "FROM ticket t WHERE t.id = :id"
+        ), {'id': ticket_id})
+
+    def remove(self, connection, ticket_id):
+        connection.execute(text("DELETE FROM ticket_fts WHERE rowid = :id"), {'id': ticket_id})
+
+    def apply(self, query, q):
+        terms = _search_terms(q)
+        if not terms:
+            return super().apply(query, q)
+
+        # Busca por prefixo em cada termo ("impres"* "rede"*), ranqueada por bm25 (título pesa mais)
+        match = ' '.join(f'"{t}"*' for t in terms)
+        matches = text(
+            "SELECT rowid AS ticket_id, bm25(ticket_fts, 10.0, 5.0, 1.0) AS rank "
+            "FROM ticket_fts WHERE ticket_fts MATCH :match"
+        ).bindparams(match=match).columns(
+            literal_column('ticket_id'), literal_column('rank')
+        ).subquery('ticket_fts_match')
+
+        return query.join(matches, Ticket.id == matches.c.ticket_id).order_by(matches.c.rank)
+
+
+class PostgresTicketSearch(LikeTicketSearch):
+    """Coluna tsvector (ticket.search_vector) com índice GIN"""
+    name = 'postgres-tsvector'
+    config = 'portuguese'
+
+    _vector_sql = (
+        "setweight(to_tsvector('portuguese', coalesce(t.title, '')), 'A') || "
+        "setweight(to_tsvector('portuguese', coalesce(t.description, '')), 'B') || "
+        "setweight(to_tsvector('portuguese', coalesce("
+        "(SELECT string_agg(c.content, ' ') FROM comment c WHERE c.ticket_id = t.id), '')), 'C')"
+    )
+
+    def setup(self, connection):
+        connection.execute(text("ALTER TABLE ticket ADD COLUMN IF NOT EXISTS search_vector tsvector"))
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_ticket_search_vector ON ticket USING GIN (search_vector)"
+        ))
+        connection.execute(text(
+            f"UPDATE ticket t SET search_vector = {self._vector_sql} WHERE t.search_vector IS NULL"
+        ))
+
+    def rebuild(self, connection):
+        connection.execute(text(f"UPDATE ticket t SET search_vector = {self._vector_sql}"))
+
+    def reindex(self, connection, ticket_id):
+        connection.execute(text(
+            f"UPDATE ticket t SET search_vector = {self._vector_sql} WHERE t.id = :id"
+        ), {'id': ticket_id})
+
+    def apply(self, query, q):
+        terms = _search_terms(q)
+        if not terms:
+            return super().apply(query, q)
+
+        tsquery = func.to_tsquery(self.config, ' & '.join(f'{t}:*' for t in terms))
+        vector = literal_column('ticket.search_vector')
+        return query.filter(vector.op('@@')(tsquery)).order_by(func.ts_rank(vector, tsquery).desc())
+
+
+def _detect_backend(connection):
+    if connection.dialect.name == 'postgresql':
+        return PostgresTicketSearch()
+    if connection.dialect.name == 'sqlite':
+        if connection.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar():
+            return SqliteTicketSearch()
+    return LikeTicketSearch()
+
+
+def get_search_backend(connection=None):
+    """Backend de busca de tickets conforme o banco (FTS5, tsvector ou ILIKE)"""
+    global _backend
+    if _backend is None:
+        if connection is not None:
+            _backend = _detect_backend(connection)
+        else:
+            with db.engine.connect() as conn:
+                _backend = _detect_backend(conn)
+    return _backend
+
+
+def setup_search_index():
+    """Cria o índice de busca (se necessário) e preenche com os tickets existentes"""
+    with db.engine.begin() as connection:
+        get_search_backend(connection).setup(connection)
+
+
+def rebuild_search_index():
+    with db.engine.begin() as connection:
+        get_search_backend(connection).rebuild(connection)
+
+
+def search_tickets(query, q):
+    """Aplica a busca textual: número (ou #número) vai direto ao id, texto usa o índice ranqueado"""
+    q = q.strip()
+    if q.lstrip('#').isdigit():
+        return query.filter(Ticket.id == int(q.lstrip('#')))
+    return get_search_backend().apply(query, q)
+
+
+# --- Sincronização do índice com Ticket e Comment ---
+
+@event.listens_for(Ticket, 'after_insert')
+def _index_ticket_after_insert(mapper, connection, target):
+    get_search_backend(connection).reindex(connection, target.id)
+
+
+@event.listens_for(Ticket, 'after_update')
+def _index_ticket_after_update(mapper, connection, target):
+    state = sa_inspect(target)
+    if state.attrs.title.history.has_changes() or state.attrs.description.history.has_changes():
+        get_search_backend(connection).reindex(connection, target.id)
+
+
+@event.listens_for(Ticket, 'after_delete')
+def _index_ticket_after_delete(mapper, connection, target):
+    get_search_backend(connection).remove(connection, target.id)
+
+
+@event.listens_for(Comment, 'after_insert')
+@event.listens_for(Comment, 'after_update')
+@event.listens_for(Comment, 'after_delete')
+def _index_comment_change(mapper, connection, target):
+    get_search_backend(connection).reindex(connection, target.ticket_id)
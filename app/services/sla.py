@@ -0,0 +1,339 @@
+import re
+import unicodedata
+from array import array
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from typing import NamedTuple
+from zoneinfo import ZoneInfo
+from flask import current_app
+from sqlalchemy import bindparam
+from app.extensions import db
+from app.models.ticket import Ticket
+from app.models.settings import get_app_settings
+from app.services.stats import OPEN_STATUSES
+from app.services.sla_watcher import notify_due_dates_reloaded
+
+MINUTES_PER_DAY = 24 * 60
+DEFAULT_SLA_HOURS = 24  # Prioridade desconhecida
+DEFAULT_TIMEZONE = 'America/Sao_Paulo'  # Fuso do expediente (datas no banco estão em UTC)
+CALENDAR_HORIZON_DAYS = 2 * 366  # Dias pré-calculados a partir do primeiro uso; a janela cresce se preciso
+RECOMPUTE_BATCH_SIZE = 1000
+
+# Palavra-chave da prioridade (sem acento, minúscula) -> campo de horas em AppSettings
+PRIORITY_POLICIES = (
+    ('baixa', 'sla_hours_baixa'),
+    ('media', 'sla_hours_media'),
+    ('alta', 'sla_hours_alta'),
+    ('critica', 'sla_hours_critica'),
+    ('urgente', 'sla_hours_critica'),
+)
+
+WEEKDAY_NAMES = ('Seg', 'Ter', 'Qua', 'Qui', 'Sex', 'Sáb', 'Dom')
+
+
+def normalize_priority(priority):
+    """'Média' -> 'media', 'CRÍTICA' -> 'critica'"""
+    text = unicodedata.normalize('NFKD', priority or '')
+    return ''.join(c for c in text if not unicodedata.combining(c)).strip().lower()
+
+
+# --- Parsing das configurações do calendário ---
+
+def parse_business_hours(value):
+    """'08:00-12:00, 13:00-18:00' -> ((480, 720), (780, 1080)); vazio = 24 horas"""
+    windows = []
+    for part in re.split(r'[,;\s]+', (value or '').strip()):
+        if not part:
+            continue
+        match = re.fullmatch(r'(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})', part)
+        if not match:
+            raise ValueError(f'Horário inválido: {part} (use HH:MM-HH:MM)')
+        h1, m1, h2, m2 = map(int, match.groups())
+        start, end = h1 * 60 + m1, h2 * 60 + m2
+        if m1 > 59 or m2 > 59 or not 0 <= start < end <= MINUTES_PER_DAY:
+            raise ValueError(f'Horário inválido: {part}')
+        windows.append((start, end))
+
+    windows.sort()
+    for (_, previous_end), (start, _) in zip(windows, windows[1:]):
+        if start < previous_end:
+            raise ValueError('Os intervalos de expediente não podem se sobrepor')
+    return tuple(windows)
+
+
+def parse_work_days(value):
+    """'0,1,2,3,4' (0 = segunda) -> frozenset({0, 1, 2, 3, 4})"""
+    days = frozenset(int(d) for d in re.findall(r'\d', value or ''))
+    if any(d > 6 for d in days):
+        raise ValueError('Dias úteis devem estar entre 0 (segunda) e 6 (domingo)')
+    return days
+
+
+def parse_holidays(value):
+    """Feriados separados por vírgula ou linha: 'AAAA-MM-DD', 'DD/MM/AAAA' ou 'DD/MM' (todo ano).
+
+    Retorna (datas fixas, {(mês, dia)} recorrentes).
+    """
+    fixed, yearly = set(), set()
+    for part in re.split(r'[,;\s]+', (value or '').strip()):
+        if not part:
+            continue
+        try:
+            if re.fullmatch(r'\d{4}-\d{2}-\d{2}', part):
+                fixed.add(date.fromisoformat(part))
+            elif re.fullmatch(r'\d{1,2}/\d{1,2}/\d{4}', part):
+                fixed.add(datetime.strptime(part, '%d/%m/%Y').date())
+            elif re.fullmatch(r'\d{1,2}/\d{1,2}', part):
+                day, month = map(int, part.split('/'))
+                date(2000, month, day)  # valida (2000 é bissexto, aceita 29/02)
+                yearly.add((month, day))
+            else:
+                raise ValueError
+        except ValueError:
+            raise ValueError(f'Feriado inválido: {part} (use AAAA-MM-DD, DD/MM/AAAA ou DD/MM)')
+    return frozenset(fixed), frozenset(yearly)
+
+
+# --- Calendários ---
+
+class AlwaysOpenCalendar:
+    """24x7: prazo = início + horas corridas"""
+
+    def add_minutes(self, start, minutes):
+        return start + timedelta(minutes=minutes)
+
+    def add_minutes_many(self, starts, minutes):
+        delta = timedelta(minutes=minutes)
+        return [start + delta for start in starts]
+
+
+class BusinessCalendar:
+    """Expediente semanal com feriados, calculado em O(1) por arrays de minutos acumulados.
+
+    Todos os dias úteis têm o mesmo expediente (day_length minutos), então:
+    - minute_cum[m]: minutos úteis do dia antes do minuto m (0..1440)
+    - minute_at[k]: minuto do dia em que o k-ésimo minuto útil termina
+    - workdays_before[d]: dias úteis antes do dia d da janela
+    - workday_index[j]: dia da janela correspondente ao j-ésimo dia útil
+    Um prazo vira uma soma de minutos úteis desde o início da janela e volta a
+    ser data/hora com duas consultas indexadas, sem percorrer hora a hora.
+    Precisão de minuto (segundos do horário de abertura são ignorados).
+    """
+
+    def __init__(self, windows, work_days, holidays=(frozenset(), frozenset()), tz=DEFAULT_TIMEZONE):
+        if not windows or not work_days:
+            raise ValueError('Calendário sem expediente')
+        self.windows = windows
+        self.work_days = work_days
+        self.fixed_holidays, self.yearly_holidays = holidays
+        self.tz = ZoneInfo(tz)
+
+        self.minute_cum = array('i', [0]) * (MINUTES_PER_DAY + 1)
+        minute_at = [0]
+        for m in range(MINUTES_PER_DAY):
+            working = any(start <= m < end for start, end in windows)
+            self.minute_cum[m + 1] = self.minute_cum[m] + working
+            if working:
+                minute_at.append(m + 1)
+        self.minute_at = array('i', minute_at)
+        self.day_length = len(minute_at) - 1
+
+        # Janela pré-calculada: (primeiro dia, workdays_before, workday_index)
+        self._window = None
+
+    def is_workday(self, day):
+        return (day.weekday() in self.work_days and day not in self.fixed_holidays
+                and (day.month, day.day) not in self.yearly_holidays)
+
+    def _build(self, first_day, days):
+        workdays_before = array('i', [0]) * (days + 1)
+        workday_index = array('i')
+        for d in range(days):
+            is_workday = self.is_workday(first_day + timedelta(days=d))
+            workdays_before[d + 1] = workdays_before[d] + is_workday
+            if is_workday:
+                workday_index.append(d)
+        # Substitui a janela de uma vez (leituras concorrentes veem a antiga ou a nova)
+        self._window = (first_day, workdays_before, workday_index)
+        return self._window
+
+    def _window_for(self, day, workdays_needed):
+        """Janela que cobre o dia e mais workdays_needed dias úteis a partir dele"""
+        window = self._window
+        if window is None:
+            window = self._build(day - timedelta(days=CALENDAR_HORIZON_DAYS // 2), CALENDAR_HORIZON_DAYS)
+        first_day, workdays_before, workday_index = window
+        days = len(workdays_before) - 1
+        offset = (day - first_day).days
+        while offset < 0 or offset >= days or workdays_before[offset] + workdays_needed >= len(workday_index):
+            first_day = min(first_day, day - timedelta(days=CALENDAR_HORIZON_DAYS // 2))
+            days = max(days, (day - first_day).days + 1) + CALENDAR_HORIZON_DAYS + workdays_needed * 2
+            first_day, workdays_before, workday_index = self._build(first_day, days)
+            offset = (day - first_day).days
+        return first_day, workdays_before, workday_index
+
+    def add_minutes(self, start, minutes):
+        if minutes <= 0:
+            return start
+        local = start.replace(tzinfo=timezone.utc).astimezone(self.tz)
+        day = local.date()
+        first_day, workdays_before, workday_index = self._window_for(day, minutes // self.day_length + 1)
+
+        # Minutos úteis desde o início da janela até o horário de abertura
+        offset = (day - first_day).days
+        minute = local.hour * 60 + local.minute
+        elapsed = workdays_before[offset] * self.day_length
+        if workdays_before[offset + 1] > workdays_before[offset]:
+            elapsed += self.minute_cum[minute]
+
+        # ... e de volta para data/hora: qual dia útil e qual minuto dentro dele
+        workday, position = divmod(elapsed + minutes - 1, self.day_length)
+        due_day = first_day + timedelta(days=workday_index[workday])
+        due_local = datetime.combine(due_day, datetime.min.time(), self.tz) + timedelta(minutes=self.minute_at[position + 1])
+        return due_local.astimezone(timezone.utc).replace(tzinfo=None)
+
+    def _local_midnight(self, day):
+        """(meia-noite local do dia em UTC, deslocamento fixo do dia ou None se o fuso muda nele)"""
+        midnight = datetime.combine(day, datetime.min.time(), self.tz)
+        next_midnight = datetime.combine(day + timedelta(days=1), datetime.min.time(), self.tz)
+        uniform = midnight.utcoffset() == next_midnight.utcoffset()
+        return midnight.astimezone(timezone.utc).replace(tzinfo=None), uniform
+
+    def add_minutes_many(self, starts, minutes):
+        """add_minutes para vários inícios (UTC) em ordem crescente, com o mesmo prazo.
+
+        Consulta fuso e janela uma vez por dia local de abertura e por dia de
+        vencimento; cada chamado custa só as buscas nos arrays de minutos.
+        Dias com mudança de horário (horário de verão) caem em add_minutes.
+        """
+        if minutes <= 0:
+            return list(starts)
+        workdays_needed = minutes // self.day_length + 1
+        one_minute = timedelta(minutes=1)
+        due_days, due_index = {}, None
+        day_start = day_end = None
+        result = []
+        for start in starts:
+            if day_start is None or not day_start <= start < day_end:
+                day = start.replace(tzinfo=timezone.utc).astimezone(self.tz).date()
+                day_start, uniform = self._local_midnight(day)
+                day_end = self._local_midnight(day + timedelta(days=1))[0]
+                first_day, workdays_before, workday_index = self._window_for(day, workdays_needed)
+                if workday_index is not due_index:
+                    due_days, due_index = {}, workday_index  # janela recalculada: índices mudaram
+                offset = (day - first_day).days
+                day_elapsed = workdays_before[offset] * self.day_length
+                is_workday = workdays_before[offset + 1] > workdays_before[offset]
+            if not uniform:
+                result.append(self.add_minutes(start, minutes))
+                continue
+
+            elapsed = day_elapsed
+            if is_workday:
+                elapsed += self.minute_cum[(start - day_start) // one_minute]
+            workday, position = divmod(elapsed + minutes - 1, self.day_length)
+            due_day = due_days.get(workday)
+            if due_day is None:
+                due_day = due_days[workday] = self._local_midnight(first_day + timedelta(days=workday_index[workday]))
+            due_midnight, due_uniform = due_day
+            if due_uniform:
+                result.append(due_midnight + timedelta(minutes=self.minute_at[position + 1]))
+            else:
+                result.append(self.add_minutes(start, minutes))
+        return result
+
+
+# --- Tabela de políticas ---
+
+class SlaPolicy(NamedTuple):
+    name: str
+    hours: int
+    calendar: object
+
+    def due_from(self, start):
+        return self.calendar.add_minutes(start, self.hours * 60)
+
+
+@lru_cache(maxsize=8)
+def _build_policies(settings, tz):
+    """Tabela prioridade -> política, montada uma vez por versão das configurações"""
+    windows = parse_business_hours(settings.sla_business_hours)
+    if windows:
+        calendar = BusinessCalendar(windows, parse_work_days(settings.sla_work_days),
+                                    parse_holidays(settings.sla_holidays), tz)
+    else:
+        calendar = AlwaysOpenCalendar()
+
+    defaults = type(settings)()
+    table = {}
+    for keyword, field in PRIORITY_POLICIES:
+        hours = getattr(settings, field) or getattr(defaults, field)
+        table[keyword] = SlaPolicy(keyword, hours, calendar)
+    return table, SlaPolicy('padrao', DEFAULT_SLA_HOURS, calendar)
+
+
+def get_policies(settings=None):
+    settings = settings or get_app_settings()
+    return _build_policies(settings, current_app.config.get('SLA_TIMEZONE', DEFAULT_TIMEZONE))
+
+
+def sla_policy(priority, settings=None):
+    """Política de SLA da prioridade (ex: 'Média', 'Urgente'); desconhecida usa DEFAULT_SLA_HOURS"""
+    table, default = get_policies(settings)
+    key = normalize_priority(priority)
+    policy = table.get(key)
+    if policy is None:
+        # Textos livres antigos ("Prioridade Alta"): procura a palavra-chave
+        policy = next((table[k] for k, _ in PRIORITY_POLICIES if k in key), default)
+    return policy
+
+
+def compute_due_at(priority, start, settings=None):
+    """Prazo de resolução a partir de start (UTC) conforme a prioridade e o calendário configurado"""
+    return sla_policy(priority, settings).due_from(start)
+
+
+def recompute_open_due_dates(settings=None):
+    """Recalcula due_at de todos os chamados abertos a partir de created_at.
+
+    Lê só (id, prioridade, created_at, due_at) em lotes ordenados por prioridade e
+    abertura; cada bloco da mesma prioridade é calculado de uma vez pelo calendário
+    (add_minutes_many) e as mudanças vão num UPDATE em lote (executemany).
+    Retorna o nº de chamados alterados.
+    """
+    table = Ticket.__table__
+    stmt = table.update().where(table.c.id == bindparam('ticket_id')).values(due_at=bindparam('new_due_at'))
+    rows = db.session.query(Ticket.id, Ticket.priority, Ticket.created_at, Ticket.due_at) \
+        .filter(Ticket.status.in_(OPEN_STATUSES), Ticket.created_at.isnot(None)) \
+        .order_by(Ticket.priority, Ticket.created_at)
+
+    policies = {}
+    changes = []
+    updated = 0
+
+    def flush_block(priority, block):
+        policy = policies.get(priority)
+        if policy is None:
+            policy = policies[priority] = sla_policy(priority, settings)
+        due_dates = policy.calendar.add_minutes_many([row.created_at for row in block], policy.hours * 60)
+        changes.extend({'ticket_id': row.id, 'new_due_at': due_at}
+                       for row, due_at in zip(block, due_dates) if due_at != row.due_at)
+
+    block = []
+    for row in rows.yield_per(RECOMPUTE_BATCH_SIZE):
+        if block and (row.priority != block[0].priority or len(block) >= RECOMPUTE_BATCH_SIZE):
+            flush_block(block[0].priority, block)
+            block = []
+        block.append(row)
+        if len(changes) >= RECOMPUTE_BATCH_SIZE:
+            db.session.execute(stmt, changes)
+            updated += len(changes)
+            changes = []
+    if block:
+        flush_block(block[0].priority, block)
+    if changes:
+        db.session.execute(stmt, changes)
+        updated += len(changes)
+    if updated:
+        notify_due_dates_reloaded(db.session.connection())
+    return updated
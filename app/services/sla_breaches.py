@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta
+from sqlalchemy import func, case, literal_column
+from app.extensions import db
+from app.models.ticket import Ticket
+from app.models.user import User
+from app.services.stats import OPEN_STATUSES
+from app.services.directory import get_user_directory
+
+DEFAULT_BREACHING_HOURS = 24
+BREACHED_LIST_LIMIT = 50
+
+
+def open_status_filter():
+    """status IN ('Aberto', 'Em andamento') com literais.
+
+    O SQLite só usa o índice parcial ix_ticket_open_due_at quando o termo da
+    consulta é idêntico ao WHERE do índice; parâmetros (?) não casam.
+    """
+    return Ticket.status.in_([literal_column(f"'{status}'") for status in OPEN_STATUSES])
+
+
+def _open_with_due(query, created_from=None, created_to=None):
+    query = query.filter(open_status_filter(), Ticket.due_at.isnot(None))
+    if created_from:
+        query = query.filter(Ticket.created_at >= created_from)
+    if created_to:
+        query = query.filter(Ticket.created_at <= created_to)
+    return query
+
+
+def breached_filter(now=None):
+    return Ticket.due_at < (now or datetime.utcnow())
+
+
+def breaching_filter(hours=DEFAULT_BREACHING_HOURS, now=None):
+    now = now or datetime.utcnow()
+    return Ticket.due_at >= now, Ticket.due_at < now + timedelta(hours=hours)
+
+
+def count_breached(now=None, created_from=None, created_to=None):
+    """Chamados abertos com prazo vencido"""
+    query = _open_with_due(db.session.query(func.count(Ticket.id)), created_from, created_to)
+    return query.filter(breached_filter(now)).scalar()
+
+
+def count_breaching(hours=DEFAULT_BREACHING_HOURS, now=None, created_from=None, created_to=None):
+    """Chamados abertos cujo prazo vence nas próximas `hours` horas"""
+    query = _open_with_due(db.session.query(func.count(Ticket.id)), created_from, created_to)
+    return query.filter(*breaching_filter(hours, now)).scalar()
+
+
+def breached_tickets(now=None, limit=BREACHED_LIST_LIMIT):
+    """Chamados vencidos, do prazo mais antigo para o mais recente"""
+    query = _open_with_due(db.session.query(
+        Ticket.id, Ticket.title, Ticket.priority, Ticket.category, Ticket.assigned_to_id, Ticket.due_at))
+    return query.filter(breached_filter(now)).order_by(Ticket.due_at).limit(limit).all()
+
+
+def breach_rate_query(group_column, now=None, created_from=None, created_to=None):
+    now = now or datetime.utcnow()
+    query = _open_with_due(db.session.query(
+        group_column,
+        func.count(Ticket.id),
+        func.sum(case((Ticket.due_at < now, 1), else_=0))
+    ), created_from, created_to)
+    return query.group_by(group_column)
+
+
+def breach_rates(group_column, now=None, created_from=None, created_to=None):
+    """[(grupo, abertos, vencidos)] dos chamados abertos, agrupados por responsável ou categoria"""
+    return breach_rate_query(group_column, now, created_from, created_to).all()
+
+
+def _rate_rows(rows, label):
+    result = []
+    for key, total, breached in rows:
+        breached = int(breached or 0)
+        result.append({
+            'key': key,
+            'name': label(key),
+            'open': total,
+            'breached': breached,
+            'rate': round(breached / total * 100, 1) if total else 0.0
+        })
+    return sorted(result, key=lambda r: (-r['rate'], -r['breached'], r['name']))
+
+
+def get_breach_summary(hours=DEFAULT_BREACHING_HOURS, now=None, created_from=None, created_to=None):
+    """Resumo do SLA: vencidos, vencendo em N horas e taxa de vencidos por técnico e categoria"""
+    now = now or datetime.utcnow()
+    names = {u['id']: u['fullname'] for u in get_user_directory().users}
+    by_technician = breach_rates(Ticket.assigned_to_id, now, created_from, created_to)
+    # O diretório só tem contas ativas; técnicos desativados com chamados abertos vêm do banco
+    missing = [key for key, _, _ in by_technician if key and key not in names]
+    if missing:
+        names.update((r.id, r.fullname or r.username) for r in db.session.query(
+            User.id, User.fullname, User.username).filter(User.id.in_(missing)))
+    by_category = breach_rates(Ticket.category, now, created_from, created_to)
+
+    return {
+        'now': now,
+        'hours': hours,
+        'breached': count_breached(now, created_from, created_to),
+        'breaching': count_breaching(hours, now, created_from, created_to),
+        'by_technician': _rate_rows(by_technician, lambda k: names.get(k, 'Não atribuído') if k else 'Não atribuído'),
+        'by_category': _rate_rows(by_category, lambda k: k or 'Sem categoria'),
+    }
@@ -0,0 +1,226 @@
+import heapq
+import threading
+from datetime import datetime
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, object_session
+from app.extensions import db
+from app.models.ticket import Ticket, SlaBreachEvent
+from app.services.cache import bump_cache_version, get_cache_version
+from app.services.stats import OPEN_STATUSES
+from app.services.sla_breaches import open_status_filter
+
+SLA_CACHE_NAME = 'sla'  # Versão incrementada por recálculos em massa de due_at (sem eventos do ORM)
+REFRESH_SECONDS = 60  # Intervalo máximo entre buscas de mudanças feitas por outros processos
+
+_watcher = None
+
+
+class SlaWatcher:
+    """Vigia de prazos: min-heap de (due_at, ticket_id) dos chamados abertos.
+
+    A thread dorme até o próximo prazo (ou até REFRESH_SECONDS) em vez de
+    consultar a tabela periodicamente. Mudanças feitas neste processo chegam
+    por notify() após o commit; as de outros processos são buscadas de forma
+    incremental por updated_at (índice ix_ticket_status_updated_at). Entradas
+    obsoletas do heap são descartadas ao sair (lazy deletion).
+    """
+
+    def __init__(self, app, refresh_seconds=REFRESH_SECONDS):
+        self.app = app
+        self.refresh_seconds = refresh_seconds
+        self._heap = []
+        self._due = {}  # ticket_id -> due_at vigente (o heap pode ter entradas antigas)
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._version = None
+        self._watermark = None
+
+    # --- Estado do heap ---
+
+    def _track(self, ticket_id, due_at, is_open):
+        if is_open and due_at is not None:
+            if self._due.get(ticket_id) != due_at:
+                self._due[ticket_id] = due_at
+                heapq.heappush(self._heap, (due_at, ticket_id))
+        else:
+            self._due.pop(ticket_id, None)
+
+    def notify(self, changes):
+        """Recebe [(ticket_id, due_at, aberto)] já commitados e acorda a thread se o próximo prazo mudou"""
+        with self._condition:
+            for change in changes:
+                self._track(*change)
+            self._condition.notify()
+
+    def _load(self):
+        """Carga completa dos chamados abertos com prazo (índice parcial ix_ticket_open_due_at)"""
+        rows = db.session.query(Ticket.id, Ticket.due_at) \
+            .filter(open_status_filter(), Ticket.due_at.isnot(None)).all()
+        with self._condition:
+            self._due = {row.id: row.due_at for row in rows}
+            self._heap = [(due_at, ticket_id) for ticket_id, due_at in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def _refresh(self):
+        """Aplica mudanças feitas fora deste processo desde a última busca"""
+        version = get_cache_version(SLA_CACHE_NAME)
+        now = datetime.utcnow()
+        if version != self._version or self._watermark is None:
+            self._load()
+        else:
+            rows = db.session.query(Ticket.id, Ticket.status, Ticket.due_at) \
+                .filter(Ticket.status.in_(OPEN_STATUSES), Ticket.updated_at >= self._watermark).all()
+            with self._condition:
+                for row in rows:
+                    self._track(row.id, row.due_at, True)
+        self._version, self._watermark = version, now
+
+    # --- Vencimentos ---
+
+    def _pop_due(self, now):
+        due = []
+        with self._condition:
+            while self._heap and self._heap[0][0] <= now:
+                due_at, ticket_id = heapq.heappop(self._heap)
+                if self._due.get(ticket_id) == due_at:
+                    del self._due[ticket_id]
+                    due.append(ticket_id)
+        return due
+
+    def _record_breaches(self, ticket_ids, now):
+        """Confere no banco (o heap pode estar defasado) e grava os eventos de vencimento"""
+        rows = db.session.query(Ticket.id, Ticket.status, Ticket.priority, Ticket.assigned_to_id, Ticket.due_at) \
+            .filter(Ticket.id.in_(ticket_ids)).all()
+        events = [{
+            'ticket_id': row.id, 'due_at': row.due_at, 'detected_at': now, 'status': row.status,
+            'priority': row.priority, 'assigned_to_id': row.assigned_to_id
+        } for row in rows if row.status in OPEN_STATUSES and row.due_at is not None and row.due_at <= now]
+
+        # Prazo adiado por outro processo: volta para o heap com o novo valor
+        with self._condition:
+            for row in rows:
+                if row.status in OPEN_STATUSES and row.due_at is not None and row.due_at > now:
+                    self._track(row.id, row.due_at, True)
+
+        if not events:
+            return 0
+        table = SlaBreachEvent.__table__
+        connection = db.session.connection()
+        if connection.dialect.name in ('postgresql', 'sqlite'):
+            # Já registrado por outro vigia (ou antes de reiniciar): ignorado pela constraint única
+            insert = pg_insert if connection.dialect.name == 'postgresql' else sqlite_insert
+            stmt = insert(table).on_conflict_do_nothing(index_elements=['ticket_id', 'due_at']).returning(table.c.ticket_id)
+            recorded = set(connection.execute(stmt, events).scalars())
+        else:
+            # Fallback genérico: ignora os que outro vigia já registrou
+            existing = {(r.ticket_id, r.due_at) for r in db.session.query(SlaBreachEvent.ticket_id, SlaBreachEvent.due_at)
+                        .filter(SlaBreachEvent.ticket_id.in_([e['ticket_id'] for e in events]))}
+            events = [e for e in events if (e['ticket_id'], e['due_at']) not in existing]
+            if events:
+                connection.execute(table.insert(), events)
+            recorded = {e['ticket_id'] for e in events}
+        db.session.commit()
+
+        for e in events:
+            if e['ticket_id'] in recorded:
+                self.app.logger.warning(f"SLA vencido: chamado #{e['ticket_id']} (prazo {e['due_at']:%d/%m/%Y %H:%M} UTC)")
+        return len(recorded)
+
+    def tick(self):
+        """Uma iteração: busca mudanças externas se for hora e registra os prazos vencidos"""
+        with self.app.app_context():
+            try:
+                now = datetime.utcnow()
+                if self._watermark is None or (now - self._watermark).total_seconds() >= self.refresh_seconds:
+                    self._refresh()
+                due = self._pop_due(now)
+                if due:
+                    self._record_breaches(due, now)
+            finally:
+                db.session.remove()
+
+    def _seconds_to_next(self):
+        now = datetime.utcnow()
+        wait = self.refresh_seconds
+        if self._watermark is not None:
+            wait = max(0.0, self.refresh_seconds - (now - self._watermark).total_seconds())
+        if self._heap:
+            wait = min(wait, max(0.0, (self._heap[0][0] - now).total_seconds()))
+        return wait
+
+    def run(self):
+        self._running = True
+        while self._running:
+            try:
+                self.tick()
+            except Exception as e:
+                self.app.logger.error(f'Erro no vigia de SLA: {e}')
+            with self._condition:
+                if self._running:
+                    self._condition.wait(timeout=self._seconds_to_next())
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='sla-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+
+def start_sla_watcher(app, background=True, refresh_seconds=REFRESH_SECONDS):
+    """Inicia o vigia (thread em segundo plano ou, com background=False, bloqueando o processo)"""
+    global _watcher
+    _watcher = SlaWatcher(app, refresh_seconds)
+    if background:
+        _watcher.start()
+    else:
+        _watcher.run()
+    return _watcher
+
+
+def notify_due_dates_reloaded(connection):
+    """Avisa os vigias (de todos os processos) que due_at mudou em massa, sem eventos do ORM"""
+    bump_cache_version(connection, SLA_CACHE_NAME)
+
+
+# --- Eventos de Ticket: acumulados na sessão e entregues ao vigia só após o commit ---
+
+def _queue_change(target, is_open):
+    session = object_session(target)
+    if _watcher is None or session is None:
+        return
+    session.info.setdefault('sla_watch', {})[target.id] = (target.id, target.due_at, is_open)
+
+
+@event.listens_for(Ticket, 'after_insert')
+def _watch_after_insert(mapper, connection, target):
+    _queue_change(target, target.status in OPEN_STATUSES)
+
+
+@event.listens_for(Ticket, 'after_update')
+def _watch_after_update(mapper, connection, target):
+    state = sa_inspect(target)
+    if state.attrs.status.history.has_changes() or state.attrs.due_at.history.has_changes():
+        _queue_change(target, target.status in OPEN_STATUSES)
+
+
+@event.listens_for(Ticket, 'after_delete')
+def _watch_after_delete(mapper, connection, target):
+    _queue_change(target, False)
+
+
+@event.listens_for(Session, 'after_commit')
+def _watch_after_commit(session):
+    changes = session.info.pop('sla_watch', None)
+    if changes and _watcher is not None:
+        _watcher.notify(list(changes.values()))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _watch_after_rollback(session, previous_transaction):
+    session.info.pop('sla_watch', None)
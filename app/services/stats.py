@@ -0,0 +1,193 @@
+from sqlalchemy import func, case, extract, event, select, union, inspect as sa_inspect
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.extensions import db
+from app.models.ticket import Ticket, TicketStatsRollup, ticket_observers
+
+OPEN_STATUSES = ['Aberto', 'Em andamento']
+CLOSED_STATUSES = ['Resolvido', 'Fechado']
+
+ROLLUP_KEYS = ('year', 'month', 'status', 'priority', 'category')
+
+
+def ticket_visibility_filter(user):
+    """Filtro de visibilidade: tickets criados, atribuídos ou observados pelo usuário (None para admin)
+
+    Montado como UNION de três buscas indexadas (user_id, assigned_to_id e
+    ticket_observers.user_id) em vez de um OR com EXISTS, que força varredura.
+    """
+    if user.role == 'admin':
+        return None
+    visible_ids = union(
+        select(Ticket.id).where(Ticket.user_id == user.id),
+        select(Ticket.id).where(Ticket.assigned_to_id == user.id),
+        select(ticket_observers.c.ticket_id).where(ticket_observers.c.user_id == user.id)
+    )
+    return Ticket.id.in_(visible_ids)
+
+
+def get_dashboard_stats(user):
+    """Contadores do dashboard calculados com um único COUNT ... GROUP BY status"""
+    query = db.session.query(Ticket.status, func.count(Ticket.id))
+    visibility = ticket_visibility_filter(user)
+    if visibility is not None:
+        query = query.filter(visibility)
+
+    counts = dict(query.group_by(Ticket.status).all())
+
+    return {
+        'total': sum(counts.values()),
+        'open': counts.get('Aberto', 0),
+        'in_progress': counts.get('Em andamento', 0),
+        'closed': sum(counts.get(s, 0) for s in CLOSED_STATUSES)
+    }
+
+
+# --- Rollup materializado (ticket_stats_rollup) ---
+
+def _rollup_key(date, status, priority, category):
+    if date is None:
+        return None
+    return (date.year, date.month, status or '', priority or '', category or '')
+
+
+def _bump_rollup(connection, key, opened=0, resolved=0):
+    """Incrementa (ou decrementa) uma linha do rollup com upsert atômico"""
+    if key is None or (opened == 0 and resolved == 0):
+        return
+    table = TicketStatsRollup.__table__
+    values = dict(zip(ROLLUP_KEYS, key), opened=opened, resolved=resolved)
+
+    if connection.dialect.name in ('postgresql', 'sqlite'):
+        insert = pg_insert if connection.dialect.name == 'postgresql' else sqlite_insert
+        stmt = insert(table).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(ROLLUP_KEYS),
+            set_={'opened': table.c.opened + opened, 'resolved': table.c.resolved + resolved}
+        )
+        connection.execute(stmt)
+        return
+
+    # Fallback genérico: UPDATE e, se não existir, INSERT
+    where = [table.c[k] == v for k, v in zip(ROLLUP_KEYS, key)]
+    result = connection.execute(
+        table.update().where(*where).values(opened=table.c.opened + opened, resolved=table.c.resolved + resolved)
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(**values))
+
+
+def _ticket_rollup_keys(status, priority, category, created_at, resolved_at):
+    return (_rollup_key(created_at, status, priority, category),
+            _rollup_key(resolved_at, status, priority, category))
+
+
+def _old_value(state, attr):
+    history = state.attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.object, attr)
+
+
+@event.listens_for(Ticket, 'after_insert')
+def _rollup_after_insert(mapper, connection, target):
+    opened_key, resolved_key = _ticket_rollup_keys(
+        target.status, target.priority, target.category, target.created_at, target.resolved_at)
+    _bump_rollup(connection, opened_key, opened=1)
+    _bump_rollup(connection, resolved_key, resolved=1)
+
+
+@event.listens_for(Ticket, 'after_update')
+def _rollup_after_update(mapper, connection, target):
+    state = sa_inspect(target)
+    tracked = ('status', 'priority', 'category', 'created_at', 'resolved_at')
+    if not any(state.attrs[attr].history.has_changes() for attr in tracked):
+        return
+
+    old_keys = _ticket_rollup_keys(*(_old_value(state, attr) for attr in tracked))
+    new_keys = _ticket_rollup_keys(
+        target.status, target.priority, target.category, target.created_at, target.resolved_at)
+
+    if old_keys[0] != new_keys[0]:
+        _bump_rollup(connection, old_keys[0], opened=-1)
+        _bump_rollup(connection, new_keys[0], opened=1)
+    if old_keys[1] != new_keys[1]:
+        _bump_rollup(connection, old_keys[1], resolved=-1)
+        _bump_rollup(connection, new_keys[1], resolved=1)
+
+
+@event.listens_for(Ticket, 'after_delete')
+def _rollup_after_delete(mapper, connection, target):
+    state = sa_inspect(target)
+    opened_key, resolved_key = _ticket_rollup_keys(
+        *(_old_value(state, attr) for attr in ('status', 'priority', 'category', 'created_at', 'resolved_at')))
+    _bump_rollup(connection, opened_key, opened=-1)
+    _bump_rollup(connection, resolved_key, resolved=-1)
+
+
+def _expected_rollup():
+    """Recalcula os contadores a partir da tabela ticket (usado no rebuild e na verificação)"""
+    expected = {}
+
+    def collect(date_col, field):
+        rows = db.session.query(
+            extract('year', date_col), extract('month', date_col),
+            Ticket.status, Ticket.priority, Ticket.category, func.count(Ticket.id)
+        ).filter(date_col.isnot(None)).group_by(
+            extract('year', date_col), extract('month', date_col),
+            Ticket.status, Ticket.priority, Ticket.category
+        ).all()
+        for year, month, status, priority, category, count in rows:
+            key = (int(year), int(month), status or '', priority or '', category or '')
+            counters = expected.setdefault(key, {'opened': 0, 'resolved': 0})
+            counters[field] += count
+
+    collect(Ticket.created_at, 'opened')
+    collect(Ticket.resolved_at, 'resolved')
+    return expected
+
+
+def rebuild_ticket_rollup():
+    """Reconstrói o rollup do zero a partir dos tickets existentes. Retorna o número de linhas."""
+    expected = _expected_rollup()
+    TicketStatsRollup.query.delete()
+    db.session.bulk_insert_mappings(TicketStatsRollup, [
+        dict(zip(ROLLUP_KEYS, key), **counters) for key, counters in expected.items()
+    ])
+    db.session.commit()
+    return len(expected)
+
+
+def check_ticket_rollup():
+    """Compara o rollup com os tickets. Retorna lista de (chave, esperado, atual) divergentes."""
+    expected = _expected_rollup()
+    current = {
+        tuple(getattr(r, k) for k in ROLLUP_KEYS): {'opened': r.opened, 'resolved': r.resolved}
+        for r in TicketStatsRollup.query.all()
+    }
+    empty = {'opened': 0, 'resolved': 0}
+    mismatches = []
+    for key in sorted(set(expected) | set(current)):
+        exp = expected.get(key, empty)
+        cur = current.get(key, empty)
+        if exp != cur:
+            mismatches.append((key, exp, cur))
+    return mismatches
+
+
+def get_rollup_stats():
+    """Totais e séries mensais do /admin/stats lidos do rollup (O(meses))"""
+    totals = db.session.query(
+        func.coalesce(func.sum(TicketStatsRollup.opened), 0),
+        func.coalesce(func.sum(case((TicketStatsRollup.status.in_(OPEN_STATUSES), TicketStatsRollup.opened), else_=0)), 0)
+    ).one()
+
+    monthly = db.session.query(
+        TicketStatsRollup.year, TicketStatsRollup.month,
+        func.sum(TicketStatsRollup.opened).label('opened'),
+        func.sum(TicketStatsRollup.resolved).label('resolved')
+    ).group_by(TicketStatsRollup.year, TicketStatsRollup.month).all()
+
+    created_stats = [m for m in monthly if m.opened]
+    resolved_stats = [m for m in monthly if m.resolved]
+    return int(totals[0]), int(totals[1]), created_stats, resolved_stats
@@ -0,0 +1,267 @@
+from collections import OrderedDict
+from datetime import datetime
+from typing import NamedTuple, Optional
+from sqlalchemy import case, insert, select, literal, func, event, Integer, String, DateTime, inspect as sa_inspect
+from app.extensions import db
+from app.models.settings import Item
+from app.models.ticket import TicketItem
+from app.models.stock import (StockMovement, movement_period, MOVEMENT_INITIAL, MOVEMENT_TICKET_USE,
+                              MOVEMENT_ADJUSTMENT, MOVEMENT_RECONCILIATION, MOVEMENT_DELETION)
+from app.services.inventory import notify_stock_changed
+from app.services.low_stock import sync_low_stock
+
+
+class ConsumptionLine(NamedTuple):
+    """Uma linha do formulário: item, quantidade e observação"""
+    item_id: int
+    quantity: int
+    notes: Optional[str] = None
+
+
+class ConsumptionFailure(NamedTuple):
+    line: ConsumptionLine
+    message: str
+
+
+def parse_consumption_lines(item_ids, quantities, notes=()):
+    """Converte as listas do formulário (used_items[], quantities[], notes[]) em linhas válidas e falhas"""
+    lines, failures = [], []
+    for i, item_id in enumerate(item_ids):
+        quantity = quantities[i] if i < len(quantities) else None
+        if not item_id or not quantity:
+            continue
+        note = notes[i] if i < len(notes) else None
+        try:
+            line = ConsumptionLine(int(item_id), int(quantity), note)
+        except ValueError:
+            failures.append(ConsumptionFailure(ConsumptionLine(0, 0, note), f'Linha {i + 1}: item ou quantidade inválidos.'))
+            continue
+        if line.quantity <= 0:
+            failures.append(ConsumptionFailure(line, f'Linha {i + 1}: a quantidade deve ser maior que zero.'))
+            continue
+        lines.append(line)
+    return lines, failures
+
+
+def _decrement_stock(requested):
+    """Baixa o estoque de vários itens de uma vez; retorna os ids que tinham saldo suficiente.
+
+    UPDATE ... SET quantity = quantity - CASE id ... WHERE quantity >= CASE id ...
+    é atômico por linha: dois técnicos consumindo a mesma peça nunca deixam o
+    estoque negativo, porque o segundo UPDATE já enxerga o saldo reduzido.
+    """
+    table = Item.__table__
+    amount = case(requested, value=table.c.id)
+    stmt = table.update().where(table.c.id.in_(list(requested)), table.c.quantity >= amount) \
+        .values(quantity=table.c.quantity - amount)
+
+    connection = db.session.connection()
+    if connection.dialect.update_returning:
+        return set(connection.execute(stmt.returning(table.c.id)).scalars())
+
+    # Sem RETURNING: um UPDATE protegido por item, conferindo o rowcount
+    consumed = set()
+    for item_id, quantity in requested.items():
+        result = connection.execute(
+            table.update().where(table.c.id == item_id, table.c.quantity >= quantity)
+            .values(quantity=table.c.quantity - quantity)
+        )
+        if result.rowcount:
+            consumed.add(item_id)
+    return consumed
+
+
+def consume_items(ticket_id, lines, user_id=None):
+    """Registra os itens usados no chamado e baixa o estoque com um número constante de consultas.
+
+    1 SELECT ... IN (com FOR UPDATE onde houver suporte) para nomes e saldos,
+    1 UPDATE atômico para todos os itens e 1 INSERT em lote de TicketItem.
+    Linhas do mesmo item são somadas; se o saldo não cobrir o total, todas
+    as linhas daquele item falham. Retorna (linhas registradas, falhas);
+    o commit fica com quem chama.
+    """
+    if not lines:
+        return [], []
+
+    requested = OrderedDict()
+    for line in lines:
+        requested[line.item_id] = requested.get(line.item_id, 0) + line.quantity
+
+    items = {row.id: row for row in db.session.query(Item.id, Item.name, Item.quantity)
+             .filter(Item.id.in_(list(requested))).with_for_update()}
+
+    failures = []
+    for item_id in list(requested):
+        if item_id not in items:
+            del requested[item_id]
+            failures.extend(ConsumptionFailure(line, f'Item #{item_id} não encontrado.')
+                            for line in lines if line.item_id == item_id)
+
+    consumed = _decrement_stock(requested) if requested else set()
+    if consumed:
+        # UPDATE direto não passa pelos eventos do ORM: invalida o ETag da consulta de itens
+        # e atualiza o flag de estoque baixo só dos itens baixados
+        notify_stock_changed(db.session.connection())
+        sync_low_stock(db.session.connection(), consumed)
+        record_movements(db.session.connection(), {item_id: -requested[item_id] for item_id in consumed},
+                         MOVEMENT_TICKET_USE, ticket_id=ticket_id, user_id=user_id)
+
+    now = datetime.utcnow()
+    recorded = []
+    for line in lines:
+        if line.item_id in consumed:
+            recorded.append(line)
+        elif line.item_id in items:
+            item = items[line.item_id]
+            failures.append(ConsumptionFailure(
+                line, f'Estoque insuficiente para o item "{item.name}". Disponível: {item.quantity}'))
+
+    if recorded:
+        db.session.execute(insert(TicketItem), [{
+            'ticket_id': ticket_id, 'item_id': line.item_id, 'quantity_used': line.quantity,
+            'notes': line.notes, 'used_at': now
+        } for line in recorded])
+    return recorded, failures
+
+
+# --- Razão de estoque (stock_movement) ---
+
+MOVEMENT_CHUNK_SIZE = 500
+
+
+def record_movements(connection, deltas, reason, ticket_id=None, user_id=None):
+    """Grava no razão os deltas {item_id: delta} já aplicados a Item.quantity.
+
+    Um INSERT ... SELECT por lote: balance_after vem do próprio saldo do item,
+    lido na mesma transação que o alterou. Deltas zerados são ignorados.
+    """
+    deltas = {item_id: delta for item_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    item = Item.__table__
+    now = datetime.utcnow()
+    columns = ['item_id', 'delta', 'balance_after', 'reason', 'ticket_id', 'user_id', 'created_at', 'period']
+    item_ids = list(deltas)
+    for start in range(0, len(item_ids), MOVEMENT_CHUNK_SIZE):
+        chunk = {item_id: deltas[item_id] for item_id in item_ids[start:start + MOVEMENT_CHUNK_SIZE]}
+        rows = select(
+            item.c.id, case(chunk, value=item.c.id), item.c.quantity, literal(reason, String),
+            literal(ticket_id, Integer), literal(user_id, Integer), literal(now, DateTime),
+            literal(movement_period(now), Integer)
+        ).where(item.c.id.in_(list(chunk)))
+        connection.execute(StockMovement.__table__.insert().from_select(columns, rows))
+
+
+def set_movement_context(item, reason, ticket_id=None, user_id=None):
+    """Motivo, chamado e usuário do movimento que o ORM vai registrar ao gravar a quantidade do item"""
+    item._stock_movement = (reason, ticket_id, user_id)
+
+
+def _pop_movement_context(target, default_reason):
+    return target.__dict__.pop('_stock_movement', None) or (default_reason, None, None)
+
+
+@event.listens_for(Item, 'after_insert')
+def _ledger_after_insert(mapper, connection, target):
+    reason, ticket_id, user_id = _pop_movement_context(target, MOVEMENT_INITIAL)
+    record_movements(connection, {target.id: target.quantity or 0}, reason, ticket_id, user_id)
+
+
+@event.listens_for(Item, 'after_update')
+def _ledger_after_update(mapper, connection, target):
+    history = sa_inspect(target).attrs.quantity.history
+    if not history.has_changes() or not isinstance(target.quantity, int):
+        return
+    old = history.deleted[0] if history.deleted else 0
+    # Sem contexto: alteração direta de Item.quantity, registrada como ajuste para o razão continuar batendo
+    reason, ticket_id, user_id = _pop_movement_context(target, MOVEMENT_ADJUSTMENT)
+    record_movements(connection, {target.id: target.quantity - (old or 0)}, reason, ticket_id, user_id)
+
+
+@event.listens_for(Item, 'after_delete')
+def _ledger_after_delete(mapper, connection, target):
+    if target.quantity:
+        now = datetime.utcnow()
+        reason, ticket_id, user_id = _pop_movement_context(target, MOVEMENT_DELETION)
+        connection.execute(StockMovement.__table__.insert().values(
+            item_id=target.id, delta=-target.quantity, balance_after=0, reason=reason,
+            ticket_id=ticket_id, user_id=user_id, created_at=now, period=movement_period(now)
+        ))
+
+
+def backfill_stock_ledger():
+    """Saldo inicial no razão para itens que ainda não têm movimentos; retorna quantos"""
+    item = Item.__table__
+    with db.engine.begin() as connection:
+        missing = connection.execute(
+            select(item.c.id, item.c.quantity)
+            .where(item.c.quantity != 0, ~select(StockMovement.id).where(StockMovement.item_id == item.c.id).exists())
+        ).all()
+        record_movements(connection, {row.id: row.quantity for row in missing}, MOVEMENT_INITIAL)
+    return len(missing)
+
+
+def check_stock_ledger():
+    """Itens cujo saldo em cache diverge da soma do razão: [(item_id, nome, saldo, soma do razão)]"""
+    ledger = db.session.query(StockMovement.item_id, func.sum(StockMovement.delta).label('total')) \
+        .group_by(StockMovement.item_id).subquery()
+    total = func.coalesce(ledger.c.total, 0)
+    return db.session.query(Item.id, Item.name, Item.quantity, total) \
+        .outerjoin(ledger, ledger.c.item_id == Item.id) \
+        .filter(func.coalesce(Item.quantity, 0) != total).order_by(Item.id).all()
+
+
+def reconcile_stock_ledger(user_id=None):
+    """Registra um movimento de conciliação para cada divergência (o saldo do item prevalece)"""
+    mismatches = check_stock_ledger()
+    record_movements(db.session.connection(),
+                     {item_id: (quantity or 0) - total for item_id, _, quantity, total in mismatches},
+                     MOVEMENT_RECONCILIATION, user_id=user_id)
+    db.session.commit()
+    return len(mismatches)
+
+
+def item_movements(item_id, start=None, end=None):
+    """Movimentos de um item em um intervalo (índice ix_stock_movement_item_id_created_at), mais recentes primeiro"""
+    query = StockMovement.query.filter(StockMovement.item_id == item_id)
+    if start:
+        query = query.filter(StockMovement.created_at >= start)
+    if end:
+        query = query.filter(StockMovement.created_at <= end)
+    return query.order_by(StockMovement.created_at.desc(), StockMovement.id.desc())
+
+
+def period_range(start=None, end=None):
+    """Filtro pelas partições mensais que cobrem o intervalo, além do filtro exato por data"""
+    filters = []
+    if start:
+        filters += [StockMovement.period >= movement_period(start), StockMovement.created_at >= start]
+    if end:
+        filters += [StockMovement.period <= movement_period(end), StockMovement.created_at <= end]
+    return filters
+
+
+def movement_totals(start=None, end=None, reasons=None):
+    """Entradas e saídas por item no período, só dos meses envolvidos: {item_id: (entradas, saídas)}"""
+    query = db.session.query(
+        StockMovement.item_id,
+        func.sum(case((StockMovement.delta > 0, StockMovement.delta), else_=0)),
+        func.sum(case((StockMovement.delta < 0, -StockMovement.delta), else_=0)),
+    ).filter(*period_range(start, end))
+    if reasons:
+        query = query.filter(StockMovement.reason.in_(reasons))
+    return {item_id: (int(incoming), int(outgoing)) for item_id, incoming, outgoing in query.group_by(StockMovement.item_id)}
+
+
+def stock_valuation_at(when):
+    """Saldo e valor de cada item em uma data, pelo último movimento até ela.
+
+    Retorna [(item_id, nome, saldo, valor)] e usa o custo unitário atual (não há histórico de custo).
+    """
+    last = db.session.query(func.max(StockMovement.id).label('id')) \
+        .filter(StockMovement.created_at <= when).group_by(StockMovement.item_id).subquery()
+    return db.session.query(Item.id, Item.name, StockMovement.balance_after,
+                            StockMovement.balance_after * Item.unit_cost) \
+        .join(last, last.c.id == StockMovement.id) \
+        .join(Item, Item.id == StockMovement.item_id) \
+        .filter(StockMovement.balance_after != 0).order_by(Item.name).all()
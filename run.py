@@ -2,6 +2,7 @@ from app import create_app, db
 from app.models.user import User
 from app.models.ticket import Ticket, Attachment, Comment, TicketItem
 from app.models.settings import Category, AppSettings, Item
+from app.models.job import Job
 
 app = create_app()
 
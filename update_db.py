@@ -32,6 +32,18 @@ with app.app_context():
     except Exception as e:
         print(f"Nota: Coluna sla_hours_critica provavelmente já existe ({str(e)})")
 
+    # 1b. Calendário do SLA (expediente, dias úteis e feriados)
+    for column, ddl in [
+        ('sla_business_hours', 'VARCHAR(100)'),
+        ('sla_work_days', "VARCHAR(20) DEFAULT '0,1,2,3,4'"),
+        ('sla_holidays', 'TEXT'),
+    ]:
+        try:
+            db.session.execute(text(f"ALTER TABLE app_settings ADD COLUMN {column} {ddl}"))
+            print(f"Coluna {column} adicionada.")
+        except Exception as e:
+            print(f"Nota: Coluna {column} provavelmente já existe ({str(e)})")
+
     # 2. Adicionar colunas due_at e assigned_by_id na tabela ticket
     try:
         db.session.execute(text("ALTER TABLE ticket ADD COLUMN due_at DATETIME"))
@@ -45,5 +57,47 @@ with app.app_context():
     except Exception as e:
         print(f"Nota: Coluna assigned_by_id provavelmente já existe ({str(e)})")
 
+    # 2b. Flag de estoque baixo mantido incrementalmente (app.services.low_stock)
+    try:
+        db.session.execute(text("ALTER TABLE item ADD COLUMN low_stock BOOLEAN NOT NULL DEFAULT FALSE"))
+        db.session.execute(text("UPDATE item SET low_stock = (quantity <= min_quantity)"))
+        print("Coluna low_stock adicionada e preenchida.")
+    except Exception as e:
+        print(f"Nota: Coluna low_stock provavelmente já existe ({str(e)})")
+
+    # 2c. Sincronização incremental com o AD (app.services.ad_sync)
+    for table, column, ddl in [
+        ('users', 'active', 'BOOLEAN NOT NULL DEFAULT TRUE'),
+        ('users', 'ad_dn', 'VARCHAR(500)'),
+        ('app_settings', 'ad_sync_watermarks', 'TEXT'),
+    ]:
+        try:
+            db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+            print(f"Coluna {column} adicionada.")
+        except Exception as e:
+            print(f"Nota: Coluna {column} provavelmente já existe ({str(e)})")
+
+    # 3. Índices compostos para os filtros e ordenações mais frequentes
+    indexes = [
+        "CREATE INDEX IF NOT EXISTS ix_ticket_assigned_to_id_status ON ticket (assigned_to_id, status)",
+        "CREATE INDEX IF NOT EXISTS ix_ticket_user_id_created_at ON ticket (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_ticket_status_updated_at ON ticket (status, updated_at)",
+        "CREATE INDEX IF NOT EXISTS ix_ticket_observers_user_id_ticket_id ON ticket_observers (user_id, ticket_id)",
+        "CREATE INDEX IF NOT EXISTS ix_comment_ticket_id_created_at ON comment (ticket_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_ticket_item_ticket_id ON ticket_item (ticket_id)",
+        "CREATE INDEX IF NOT EXISTS ix_ticket_item_item_id_used_at ON ticket_item (item_id, used_at)",
+        "CREATE INDEX IF NOT EXISTS ix_item_name ON item (name)",
+        "CREATE INDEX IF NOT EXISTS ix_item_category_name ON item (category, name)",
+        "CREATE INDEX IF NOT EXISTS ix_item_low_stock_name ON item (low_stock, name)",
+        "CREATE INDEX IF NOT EXISTS ix_ticket_open_due_at ON ticket (due_at, assigned_to_id, category) "
+        "WHERE status IN ('Aberto', 'Em andamento')",
+    ]
+    for statement in indexes:
+        try:
+            db.session.execute(text(statement))
+            print(f"Índice criado/verificado: {statement.split()[5]}")
+        except Exception as e:
+            print(f"Nota: falha ao criar índice ({str(e)})")
+
     db.session.commit()
     print("Migração concluída.")